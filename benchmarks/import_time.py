@@ -0,0 +1,53 @@
+"""Measures how long it takes a fresh Python process to import mixprop modules."""
+
+import statistics
+import subprocess
+import sys
+import time
+from typing import List
+
+from tap import Tap
+
+
+class ImportTimeArgs(Tap):
+    modules: List[str] = ['mixprop', 'mixprop.visc_pred_wrapper', 'mixprop.train']
+    """Modules whose import time is measured."""
+    repeats: int = 5
+    """Number of fresh processes used to time each module."""
+    top: int = 10
+    """Number of slowest modules (cumulative import time) to list for each measured module."""
+
+
+def import_time(module: str) -> float:
+    """Returns the wall time in seconds of a fresh interpreter importing a module."""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', f'import {module}'], check=True)
+    return time.perf_counter() - start
+
+
+def slowest_imports(module: str, top: int) -> List[str]:
+    """Returns the modules with the largest cumulative import time, as reported by -X importtime."""
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            check=True, capture_output=True, text=True).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative), name.strip()))
+
+    return [f'{cumulative / 1e6:8.3f}s  {name}' for cumulative, name in sorted(rows, reverse=True)[:top]]
+
+
+if __name__ == '__main__':
+    args = ImportTimeArgs().parse_args()
+
+    # The startup time of an interpreter that imports nothing is subtracted from each measurement
+    baseline = statistics.median(import_time('sys') for _ in range(args.repeats))
+    print(f'Interpreter startup: {baseline:.3f}s')
+
+    for module in args.modules:
+        times = [import_time(module) - baseline for _ in range(args.repeats)]
+        print(f'\n{module}: median {statistics.median(times):.3f}s, min {min(times):.3f}s over {args.repeats} runs')
+        for row in slowest_imports(module, args.top):
+            print(f'    {row}')
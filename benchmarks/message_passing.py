@@ -0,0 +1,116 @@
+"""Compares the padded and the scatter message passing backends of MPNEncoder for accuracy and speed."""
+
+import itertools
+import time
+from typing import List
+
+import torch
+from tap import Tap
+
+from mixprop.args import TrainArgs
+from mixprop.data import get_smiles
+from mixprop.features import get_atom_fdim, get_bond_fdim, mol2graph
+from mixprop.models import MPNEncoder
+
+
+class MessagePassingArgs(Tap):
+    smiles_path: str = None
+    """Path to a CSV file with SMILES in the first column. Defaults to a built-in set of molecules."""
+    batch_sizes: List[int] = [50, 500]
+    """Number of molecules per batch."""
+    high_valence_fraction: float = 0.02
+    """Fraction of molecules in a batch replaced by a molecule with a hexavalent atom."""
+    hidden_size: int = 300
+    """Hidden size of the encoder."""
+    depth: int = 3
+    """Number of message passing steps."""
+    repeats: int = 20
+    """Number of timed forward passes per batch size."""
+    device: str = 'cpu'
+    """Device on which the encoder is run."""
+
+
+MOLECULES = ['CCO', 'O', 'c1ccccc1', 'CC(=O)O', 'CCCCCCCCO', 'OCC(O)CO', 'CC(C)=O', 'CCN(CC)CC',
+             'c1ccc2ccccc2c1', 'CC(=O)Oc1ccccc1C(=O)O', 'CCOC(=O)C', 'ClC(Cl)Cl', 'CS(C)=O', 'C1CCOC1']
+HIGH_VALENCE = 'FS(F)(F)(F)(F)F'
+
+
+def encoder_args(atom_messages: bool, bias: bool, undirected: bool, aggregation: str,
+                 hidden_size: int, depth: int, device: str) -> TrainArgs:
+    """Builds the model arguments of an encoder."""
+    args = TrainArgs().parse_args(['--data_path', '', '--dataset_type', 'regression',
+                                   '--hidden_size', str(hidden_size), '--depth', str(depth),
+                                   '--aggregation', aggregation])
+    args.atom_messages, args.bias, args.undirected = atom_messages, bias, undirected
+    args.device = torch.device(device)
+
+    return args
+
+
+def make_encoders(args: TrainArgs) -> List[MPNEncoder]:
+    """Builds a padded and a scatter encoder sharing the same weights."""
+    torch.manual_seed(0)
+    encoders = []
+    for scatter in [False, True]:
+        args.scatter_message_passing = scatter
+        encoder = MPNEncoder(args, get_atom_fdim(), get_bond_fdim(atom_messages=args.atom_messages)).to(args.device)
+        encoder.eval()
+        encoders.append(encoder)
+    encoders[1].load_state_dict(encoders[0].state_dict())
+
+    return encoders
+
+
+def batch_smiles(smiles: List[str], batch_size: int, high_valence_fraction: float) -> List[str]:
+    """Builds a batch of molecules, a fraction of which contain a high-valence atom."""
+    batch = [smiles[i % len(smiles)] for i in range(batch_size)]
+    for i in range(0, batch_size, max(1, round(1 / high_valence_fraction)) if high_valence_fraction > 0 else batch_size + 1):
+        batch[i] = HIGH_VALENCE
+
+    return batch
+
+
+def time_forward(encoder: MPNEncoder, mol_graph, repeats: int) -> float:
+    """Returns the mean wall time in seconds of a forward pass."""
+    with torch.no_grad():
+        encoder(mol_graph)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            encoder(mol_graph)
+        if encoder.device.type == 'cuda':
+            torch.cuda.synchronize()
+
+    return (time.perf_counter() - start) / repeats
+
+
+def main(args: MessagePassingArgs) -> None:
+    smiles = get_smiles(path=args.smiles_path, flatten=True) if args.smiles_path is not None else MOLECULES
+
+    print('Maximum absolute (relative) difference between backends')
+    mol_graph = mol2graph(batch_smiles(smiles, 100, args.high_valence_fraction))
+    for atom_messages, bias, undirected, aggregation in itertools.product(
+            [False, True], [False, True], [False, True], ['mean', 'sum', 'norm']):
+        # Undirected atom messages are not supported by the encoder
+        if atom_messages and undirected:
+            continue
+        padded, scatter = make_encoders(encoder_args(atom_messages, bias, undirected, aggregation,
+                                                     args.hidden_size, args.depth, args.device))
+        with torch.no_grad():
+            padded_vecs, scatter_vecs = padded(mol_graph), scatter(mol_graph)
+        difference = (padded_vecs - scatter_vecs).abs().max().item()
+        print(f'atom_messages={atom_messages!s:5}  bias={bias!s:5}  undirected={undirected!s:5}  '
+              f'aggregation={aggregation:4}  {difference:.2e} ({difference / padded_vecs.abs().max().item():.2e})')
+
+    print('\nForward pass time')
+    padded, scatter = make_encoders(encoder_args(False, False, False, 'mean', args.hidden_size, args.depth, args.device))
+    for batch_size in args.batch_sizes:
+        mol_graph = mol2graph(batch_smiles(smiles, batch_size, args.high_valence_fraction))
+        padded_time = time_forward(padded, mol_graph, args.repeats)
+        scatter_time = time_forward(scatter, mol_graph, args.repeats)
+        print(f'batch_size={batch_size:5}  max_num_bonds={mol_graph.max_num_bonds}  '
+              f'padded {padded_time * 1000:8.2f} ms  scatter {scatter_time * 1000:8.2f} ms  '
+              f'speedup {padded_time / scatter_time:.2f}x')
+
+
+if __name__ == '__main__':
+    main(MessagePassingArgs().parse_args())
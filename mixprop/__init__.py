@@ -1,18 +1,35 @@
+import importlib
+
 import mixprop.data
 import mixprop.features
 import mixprop.models
-import mixprop.train
-
-import mixprop.args
-import mixprop.constants
-import mixprop.hyperparameter_optimization
-import mixprop.interpret
-import mixprop.nn_utils
-import mixprop.utils
-import mixprop.rdkit
-import mixprop.sklearn_predict
-import mixprop.sklearn_train
-import mixprop.spectra_utils
-import mixprop.hyperopt_utils
 
 from mixprop._version import __version__
+
+# The remaining submodules are imported on first access, since some of them pull in
+# slow optional dependencies (hyperopt, scikit-learn, tensorboardX) that predictions do not need
+_LAZY_SUBMODULES = [
+    'args',
+    'constants',
+    'hyperopt_utils',
+    'hyperparameter_optimization',
+    'interpret',
+    'nn_utils',
+    'rdkit',
+    'sklearn_predict',
+    'sklearn_train',
+    'spectra_utils',
+    'train',
+    'utils',
+    'visc_pred_wrapper',
+]
+
+
+def __getattr__(name: str):
+    if name in _LAZY_SUBMODULES:
+        return importlib.import_module(f'{__name__}.{name}')
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(list(globals()) + _LAZY_SUBMODULES)
@@ -1,4 +1,5 @@
 import json
+import multiprocessing
 import os
 from tempfile import TemporaryDirectory
 import pickle
@@ -9,7 +10,8 @@ import torch
 from tap import Tap  # pip install typed-argument-parser (https://github.com/swansonk14/typed-argument-parser)
 
 import mixprop.data.utils
-from mixprop.data import set_cache_mol, empty_cache
+from mixprop.data import set_cache_mol, empty_cache, set_features_store, set_graph_cache_budget, set_graph_store, \
+    set_mol_cache_budget
 from mixprop.features import get_available_features_generators
 
 
@@ -110,6 +112,45 @@ class CommonArgs(Tap):
     """
     Whether to empty all caches before training or predicting. This is necessary if multiple jobs are run within a single script and the atom or bond features change.
     """
+    cache_max_entries: int = None
+    """
+    Maximum number of molecules kept in each of the in-memory RDKit molecule and graph caches.
+    Least recently used molecules are evicted first. Unbounded by default.
+    """
+    graph_cache_max_bytes: int = None
+    """Maximum memory in bytes used by the in-memory graph cache. Unbounded by default."""
+    featurization_workers: int = 0
+    """
+    Number of processes used to featurize the unique molecules before training or predicting.
+    If 0, molecules are featurized in the main process.
+    """
+    featurization_chunk_size: int = 1000
+    """Number of molecules sent to a featurization process at once."""
+    graph_store_dir: str = None
+    """
+    Directory of a persistent featurization store. Molecular graphs are computed once, written to memory-mapped
+    files in this directory and reused by later runs and by DataLoader workers.
+    """
+    features_store_dir: str = None
+    """
+    Directory of a persistent store of features generator outputs. The features of each molecule are computed once,
+    written to a :code:`.npy` file per features generator in this directory and reused by later runs.
+    """
+    columnar_data: bool = False
+    """
+    Whether to store datasets column-wise, as numpy arrays indexing a table of unique molecules, instead of as one
+    object per row. Not compatible with atom descriptors or custom atom and bond features.
+    """
+    bucket_by_size: bool = False
+    """
+    Whether to group molecules of similar size and maximum degree into the same batches, which reduces the padding
+    of the batched molecular graphs. Training batches are still shuffled from epoch to epoch.
+    """
+    cache_batches: bool = False
+    """
+    Whether to build the batches of the validation, test and prediction data once, with their graphs, features,
+    targets and mask, and to reuse them every time the data is evaluated instead of building them again.
+    """
 
     def __init__(self, *args, **kwargs):
         super(CommonArgs, self).__init__(*args, **kwargs)
@@ -209,6 +250,11 @@ class CommonArgs(Tap):
                                       'per input (i.e., number_of_molecules = 1).')
 
         set_cache_mol(not self.no_cache_mol)
+        if self.cache_max_entries is not None or self.graph_cache_max_bytes is not None:
+            set_mol_cache_budget(max_entries=self.cache_max_entries)
+            set_graph_cache_budget(max_entries=self.cache_max_entries, max_bytes=self.graph_cache_max_bytes)
+        set_graph_store(self.graph_store_dir)
+        set_features_store(self.features_store_dir)
 
         if self.empty_cache:
             empty_cache()
@@ -328,6 +374,11 @@ class TrainArgs(CommonArgs):
     """Centers messages on atoms instead of on bonds."""
     undirected: bool = False
     """Undirected edges (always sum the two relevant bond vectors)."""
+    scatter_message_passing: bool = False
+    """
+    Aggregates messages with scatter sums over the list of bonds instead of padded neighbor index tensors.
+    Numerically equivalent to the default, but avoids padding every atom to the highest valence in the batch.
+    """
     ffn_hidden_size: int = None
     """Hidden dim for higher-capacity FFN (defaults to hidden_size)."""
     ffn_num_layers: int = 2
@@ -357,6 +408,19 @@ class TrainArgs(CommonArgs):
     """
     ensemble_size: int = 1
     """Number of models in ensemble."""
+    ensemble_workers: int = 0
+    """
+    Number of processes in which the models of the ensemble are trained concurrently, each using an equal share of
+    the PyTorch threads. The processes share the featurized data with the main process. If 0, the models are trained
+    one after another in the main process. Only available on the CPU.
+    """
+    fold_workers: int = 0
+    """
+    Number of processes in which the cross-validation folds are trained concurrently. Each process is restricted
+    to an equal share of the CPUs and uses that many PyTorch threads. The processes share the loaded data and the
+    featurized molecules with the main process. If 0, the folds are trained one after another in the main process.
+    Only available on the CPU.
+    """
     aggregation: Literal['mean', 'sum', 'norm'] = 'mean'
     """Aggregation scheme for atomic vectors into molecular vectors"""
     aggregation_norm: int = 100
@@ -722,6 +786,17 @@ class TrainArgs(CommonArgs):
             if min(self.target_weights) < 0:
                 raise ValueError('Provided target weights must be non-negative.')
 
+        # Ensemble members and folds inherit the data from the main process, which requires forked processes and no CUDA
+        if self.ensemble_workers > 0 or self.fold_workers > 0:
+            if self.cuda:
+                raise ValueError('Ensemble members and folds can only be trained in parallel on the CPU. Use --no_cuda.')
+            if 'fork' not in multiprocessing.get_all_start_methods():
+                raise ValueError('Ensemble members and folds can only be trained in parallel on platforms '
+                                 'which support forked processes.')
+            if self.ensemble_workers > 0 and self.fold_workers > 0:
+                raise ValueError('Only one of --ensemble_workers and --fold_workers can be used, since fold '
+                                 'processes cannot start processes of their own.')
+
 
 class PredictArgs(CommonArgs):
     """:class:`PredictArgs` includes :class:`CommonArgs` along with additional arguments used for predicting with a mixprop model."""
@@ -736,6 +811,8 @@ class PredictArgs(CommonArgs):
     """Whether to calculate the variance of ensembles as a measure of epistemic uncertainty. If True, the variance is saved as an additional column for each target in the preds_path."""
     individual_ensemble_predictions: bool = False
     """Whether to return the predictions made by each of the individual models rather than the average of the ensemble"""
+    stacked_ensemble: bool = False
+    """Whether to evaluate all models of the ensemble in a single batched forward pass. Requires models with the same architecture and the same feature scalers."""
 
     @property
     def ensemble_size(self) -> int:
@@ -751,6 +828,10 @@ class PredictArgs(CommonArgs):
             number_of_molecules=self.number_of_molecules,
         )
 
+        # Columnar datasets do not keep the CSV rows, which are written out with the predictions by default
+        if self.columnar_data and not self.drop_extra_columns:
+            raise ValueError('Columnar data storage requires --drop_extra_columns when predicting.')
+
         if self.checkpoint_paths is None or len(self.checkpoint_paths) == 0:
             raise ValueError('Found no checkpoints. Must specify --checkpoint_path <path> or '
                              '--checkpoint_dir <dir> containing at least one checkpoint.')
@@ -803,6 +884,61 @@ class FingerprintArgs(PredictArgs):
     """Choice of which type of latent fingerprint vector to use. Default is the output of the MPNN, excluding molecular features"""
 
 
+class ScreenArgs(CommonArgs):
+    """:class:`ScreenArgs` includes :class:`CommonArgs` along with additional arguments used for screening all pairs of two molecule libraries."""
+
+    smiles_path_1: str
+    """Path to CSV file containing the SMILES of the first molecule in each mixture."""
+    smiles_path_2: str
+    """Path to CSV file containing the SMILES of the second molecule in each mixture."""
+    save_path: str
+    """Path to :code:`.npy` file where the ensemble mean and variance of each mixture and grid point will be saved."""
+    molfrac1_values: List[float] = None
+    """Mole fractions of the first molecule at which mixtures are evaluated (defaults to 0 to 1 in steps of 0.1)."""
+    T_values: List[float] = None
+    """Temperatures at which mixtures are evaluated (defaults to 298)."""
+    tile_size: int = 100000
+    """Maximum number of mixture and grid point combinations evaluated in a single feed-forward batch."""
+    number_of_molecules: int = 2
+    """Number of molecules in each input to the model."""
+
+    def process_args(self) -> None:
+        super(ScreenArgs, self).process_args()
+
+        if self.molfrac1_values is None:
+            self.molfrac1_values = [round(0.1 * i, 1) for i in range(11)]
+        if self.T_values is None:
+            self.T_values = [298.0]
+
+        if self.number_of_molecules != 2:
+            raise ValueError('Screening is only supported for mixtures of two molecules (number_of_molecules = 2).')
+
+        if self.checkpoint_paths is None or len(self.checkpoint_paths) == 0:
+            raise ValueError('Found no checkpoints. Must specify --checkpoint_path <path> or '
+                             '--checkpoint_dir <dir> containing at least one checkpoint.')
+
+
+class PackArgs(Tap):
+    """:class:`PackArgs` contains arguments used for packing an ensemble of model checkpoints into a single file."""
+
+    checkpoint_dir: str = None
+    """Directory from which to load model checkpoints (walks directory and ensembles all models that are found)."""
+    checkpoint_paths: List[str] = None
+    """List of paths to model checkpoints (:code:`.pt` files)."""
+    save_path: str
+    """Path where the packed ensemble will be saved."""
+
+    def process_args(self) -> None:
+        self.checkpoint_paths = get_checkpoint_paths(
+            checkpoint_paths=self.checkpoint_paths,
+            checkpoint_dir=self.checkpoint_dir,
+        )
+
+        if self.checkpoint_paths is None or len(self.checkpoint_paths) == 0:
+            raise ValueError('Found no checkpoints. Must specify --checkpoint_paths <paths> or '
+                             '--checkpoint_dir <dir> containing at least one checkpoint.')
+
+
 class HyperoptArgs(TrainArgs):
     """:class:`HyperoptArgs` includes :class:`TrainArgs` along with additional arguments used for optimizing mixprop hyperparameters."""
 
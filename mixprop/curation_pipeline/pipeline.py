@@ -80,7 +80,8 @@ def prepare_dataset(input_args):
 #     "test_split": 0.2,  # Fraction to hold out for testing
 #     "thresh_pure": 0.025,  # Settings for inconsistent pure data screening
 #     "thresh_logV": 0.5,  # Settings for inconsistent pure data screening
-#     "out_path":"." # Location for files to be written to
+#     "out_path":".", # Location for files to be written to
+#     "binary_output": False # Whether to also write binary datasets (data_binary/, test_binary/) for fast loading
 # }
 
 def add_paths_to_args(args):
@@ -2,6 +2,8 @@ import numpy as np
 import pandas as pd
 import os
 
+from mixprop.data.binary_dataset import save_binary_dataset
+
 
 def write_data(nist_knovel_all, test_mols, input_args):
 
@@ -39,3 +41,16 @@ def write_data(nist_knovel_all, test_mols, input_args):
     test_data[["MolFrac_1", "T"]].to_csv(
         os.path.join(input_args["out_path"], "test_features.csv"), index=False
     )
+
+    # Optionally also write binary datasets which training loads without parsing text
+    if input_args.get("binary_output", False):
+        for name, split_data in [("data", train_data), ("test", test_data)]:
+            save_binary_dataset(
+                os.path.join(input_args["out_path"], name + "_binary"),
+                smiles=split_data[["MOL_1", "MOL_2"]].values.tolist(),
+                targets=split_data[["logV"]].values,
+                features=split_data[["MolFrac_1", "T"]].values,
+                smiles_columns=["MOL_1", "MOL_2"],
+                target_columns=["logV"],
+                features_columns=["MolFrac_1", "T"],
+            )
@@ -1,5 +1,9 @@
-from .data import cache_graph, cache_mol, MoleculeDatapoint, MoleculeDataset, MoleculeDataLoader, \
-    MoleculeSampler, set_cache_graph, empty_cache, set_cache_mol
+from .binary_dataset import BinaryDataset, is_binary_dataset, save_binary_dataset
+from .cache import LRUCache
+from .data import cache_graph, cache_mol, cache_stats, ColumnarMoleculeDataset, MoleculeDatapoint, MoleculeDataset, \
+    MoleculeDataLoader, MoleculeSampler, set_cache_graph, empty_cache, set_cache_mol, set_graph_cache_budget, set_mol_cache_budget, \
+    graph_store, set_graph_store, precompute_graphs, features_store, set_features_store, set_features_cache_budget, \
+    precompute_features
 from .scaffold import generate_scaffold, log_scaffold_stats, scaffold_split, scaffold_to_smiles
 from .scaler import StandardScaler
 from .utils import filter_invalid_smiles, get_class_sizes, get_data, get_data_from_smiles, \
@@ -7,15 +11,30 @@ from .utils import filter_invalid_smiles, get_class_sizes, get_data, get_data_fr
     validate_data, validate_dataset_type, get_invalid_smiles_from_file, get_invalid_smiles_from_list
 
 __all__ = [
+    'BinaryDataset',
+    'is_binary_dataset',
+    'save_binary_dataset',
+    'LRUCache',
     'cache_graph',
     'empty_cache',
     'cache_mol',
+    'cache_stats',
+    'ColumnarMoleculeDataset',
     'MoleculeDatapoint',
     'MoleculeDataset',
     'MoleculeDataLoader',
     'MoleculeSampler',
     'set_cache_graph',
     'set_cache_mol',
+    'set_graph_cache_budget',
+    'set_mol_cache_budget',
+    'graph_store',
+    'set_graph_store',
+    'precompute_graphs',
+    'features_store',
+    'set_features_store',
+    'set_features_cache_budget',
+    'precompute_features',
     'generate_scaffold',
     'log_scaffold_stats',
     'scaffold_split',
@@ -0,0 +1,138 @@
+import json
+import os
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+
+BINARY_DATASET_FORMAT = 'mixprop-dataset'
+BINARY_DATASET_VERSION = 1
+METADATA_FILE = 'metadata.json'
+
+
+def is_binary_dataset(path: str) -> bool:
+    """
+    Returns whether a path is a dataset saved by :func:`save_binary_dataset`.
+
+    :param path: Path to a data file or directory.
+    :return: Whether the path is a directory containing a binary dataset.
+    """
+    return path is not None and os.path.isfile(os.path.join(path, METADATA_FILE))
+
+
+def save_binary_dataset(path: str,
+                        smiles: List[List[str]],
+                        targets: np.ndarray,
+                        features: np.ndarray = None,
+                        smiles_columns: List[str] = None,
+                        target_columns: List[str] = None,
+                        features_columns: List[str] = None) -> None:
+    """
+    Saves a dataset in binary form so that it can be loaded without parsing text.
+
+    The dataset is a directory with a :code:`metadata.json` file holding the format version and the column names,
+    a table of the unique SMILES strings, one per line, and :code:`.npy` arrays holding the index of each molecule
+    in the table, the targets (NaN if unknown) and the features. The metadata is written last, so an interrupted
+    write does not leave a dataset which can be loaded.
+
+    :param path: Directory in which the dataset is saved.
+    :param smiles: A list of the SMILES strings of the molecules of each row.
+    :param targets: An array of shape :code:`(num_rows, num_tasks)` containing the targets.
+    :param features: An array of shape :code:`(num_rows, features_size)` containing additional features.
+    :param smiles_columns: The names of the SMILES columns. Defaults to :code:`smiles_1`, :code:`smiles_2`, ...
+    :param target_columns: The names of the target columns. Defaults to :code:`target_1`, :code:`target_2`, ...
+    :param features_columns: The names of the features. Defaults to :code:`feature_1`, :code:`feature_2`, ...
+    """
+    num_rows = len(smiles)
+    number_of_molecules = len(smiles[0]) if num_rows > 0 else len(smiles_columns or [])
+    targets = np.asarray(targets, dtype=np.float64).reshape(num_rows, -1)
+    if features is not None:
+        features = np.asarray(features, dtype=np.float64).reshape(num_rows, -1)
+
+    smiles_columns = smiles_columns or [f'smiles_{i + 1}' for i in range(number_of_molecules)]
+    target_columns = target_columns or [f'target_{i + 1}' for i in range(targets.shape[1])]
+    if features is not None:
+        features_columns = features_columns or [f'feature_{i + 1}' for i in range(features.shape[1])]
+    if len(smiles_columns) != number_of_molecules or len(target_columns) != targets.shape[1] \
+            or (features is not None and len(features_columns) != features.shape[1]):
+        raise ValueError('The number of column names must match the number of columns of the data.')
+
+    index = {}
+    smiles_ids = np.array([index.setdefault(s, len(index)) for row in smiles for s in row],
+                          dtype=np.int64).reshape(num_rows, number_of_molecules)
+
+    os.makedirs(path, exist_ok=True)
+    if os.path.exists(os.path.join(path, METADATA_FILE)):
+        os.remove(os.path.join(path, METADATA_FILE))
+    with open(os.path.join(path, 'smiles.txt'), 'w') as f:
+        f.writelines(s + '\n' for s in index)
+    np.save(os.path.join(path, 'smiles_ids.npy'), smiles_ids)
+    np.save(os.path.join(path, 'targets.npy'), targets)
+    if features is not None:
+        np.save(os.path.join(path, 'features.npy'), features)
+
+    metadata = OrderedDict([
+        ('format', BINARY_DATASET_FORMAT),
+        ('version', BINARY_DATASET_VERSION),
+        ('num_rows', num_rows),
+        ('smiles_columns', smiles_columns),
+        ('target_columns', target_columns),
+        ('features_columns', features_columns if features is not None else None)
+    ])
+    with open(os.path.join(path, METADATA_FILE), 'w') as f:
+        json.dump(metadata, f, indent=4)
+
+
+class BinaryDataset:
+    """
+    A :class:`BinaryDataset` reads a dataset saved by :func:`save_binary_dataset`. The arrays are memory-mapped,
+    so only the rows which are used are read from disk.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: Directory containing the dataset.
+        """
+        with open(os.path.join(path, METADATA_FILE)) as f:
+            metadata = json.load(f)
+
+        if metadata.get('format') != BINARY_DATASET_FORMAT:
+            raise ValueError(f'{path} is not a binary mixprop dataset.')
+        if metadata.get('version', 0) > BINARY_DATASET_VERSION:
+            raise ValueError(f'Binary dataset {path} has version {metadata["version"]}, but this version of mixprop '
+                             f'only reads versions up to {BINARY_DATASET_VERSION}.')
+
+        self.num_rows = metadata['num_rows']
+        self.smiles_columns = metadata['smiles_columns']
+        self.target_columns = metadata['target_columns']
+        self.features_columns = metadata['features_columns']
+
+        with open(os.path.join(path, 'smiles.txt')) as f:
+            self.smiles_table = f.read().splitlines()
+        self.smiles_ids = np.load(os.path.join(path, 'smiles_ids.npy'), mmap_mode='r')
+        self.targets = np.load(os.path.join(path, 'targets.npy'), mmap_mode='r')
+        self.features = np.load(os.path.join(path, 'features.npy'), mmap_mode='r') \
+            if self.features_columns is not None else None
+
+        if self.smiles_ids.shape != (self.num_rows, len(self.smiles_columns)) \
+                or self.targets.shape != (self.num_rows, len(self.target_columns)) \
+                or (self.features is not None and self.features.shape != (self.num_rows, len(self.features_columns))):
+            raise ValueError(f'The arrays of binary dataset {path} do not match its metadata.')
+
+    @property
+    def columns(self) -> List[str]:
+        """The names of the SMILES and target columns, as in the header of a data CSV file."""
+        return self.smiles_columns + self.target_columns
+
+    def smiles(self, smiles_columns: Optional[List[str]] = None) -> List[List[str]]:
+        """
+        Returns the SMILES strings of each row.
+
+        :param smiles_columns: The names of the SMILES columns to return. Defaults to all SMILES columns.
+        :return: A list of the SMILES strings of each row.
+        """
+        smiles_ids = self.smiles_ids
+        if smiles_columns is not None:
+            smiles_ids = smiles_ids[:, [self.smiles_columns.index(c) for c in smiles_columns]]
+
+        return [[self.smiles_table[i] for i in row] for row in smiles_ids.tolist()]
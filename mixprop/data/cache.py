@@ -0,0 +1,136 @@
+from collections import OrderedDict
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class LRUCache:
+    """
+    An :class:`LRUCache` is a bounded mapping which evicts its least recently used entries once it holds more
+    than :code:`max_entries` entries or more than :code:`max_bytes` bytes, as measured by :code:`sizeof`.
+
+    The cache counts hits, misses and evictions so that its effectiveness can be monitored. It is safe to use
+    from several threads, but each process holds its own cache.
+    """
+
+    def __init__(self,
+                 max_entries: Optional[int] = None,
+                 max_bytes: Optional[int] = None,
+                 sizeof: Callable[[Any], int] = None):
+        """
+        :param max_entries: Maximum number of entries, or None for no limit.
+        :param max_bytes: Maximum total size of the entries in bytes, or None for no limit.
+        :param sizeof: A function returning the size of a value in bytes. Required if :code:`max_bytes` is set.
+        """
+        self.sizeof = sizeof
+        self.entries = OrderedDict()  # key -> (value, size), ordered from least to most recently used
+        self.lock = threading.Lock()
+        self.nbytes = 0
+        self.hits = self.misses = self.evictions = 0
+        self.max_entries = self.max_bytes = None
+        self.set_budget(max_entries, max_bytes)
+
+    def set_budget(self, max_entries: Optional[int] = None, max_bytes: Optional[int] = None) -> None:
+        """
+        Sets the budget of the cache and evicts entries to fit.
+
+        :param max_entries: Maximum number of entries, or None for no limit.
+        :param max_bytes: Maximum total size of the entries in bytes, or None for no limit.
+        """
+        if max_bytes is not None and self.sizeof is None:
+            raise ValueError('A byte budget requires a sizeof function.')
+
+        with self.lock:
+            # Entries added without a byte budget were not measured
+            if max_bytes is not None and self.max_bytes is None:
+                for key, (value, _) in self.entries.items():
+                    self.entries[key] = (value, self.sizeof(value))
+                self.nbytes = sum(size for _, size in self.entries.values())
+            self.max_entries, self.max_bytes = max_entries, max_bytes
+            self._evict()
+
+    def _evict(self) -> None:
+        while len(self.entries) > 0 and ((self.max_entries is not None and len(self.entries) > self.max_entries)
+                                         or (self.max_bytes is not None and self.nbytes > self.max_bytes)):
+            _, (_, size) = self.entries.popitem(last=False)
+            self.nbytes -= size
+            self.evictions += 1
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.entries
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Looks up a value and marks it as recently used.
+
+        :param key: The key of the value.
+        :param default: The value returned if the key is not cached.
+        :return: The cached value, or :code:`default` if the key is not cached.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+
+            return entry[0]
+
+    def __getitem__(self, key: Hashable) -> Any:
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                raise KeyError(key)
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+
+            return self.entries[key][0]
+
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] is value:
+                self.entries.move_to_end(key)
+                return
+
+            size = self.sizeof(value) if self.max_bytes is not None else 0
+            if entry is not None:
+                self.nbytes -= entry[1]
+            self.entries[key] = (value, size)
+            self.entries.move_to_end(key)
+            self.nbytes += size
+            self._evict()
+
+    def clear(self) -> None:
+        """Removes all entries from the cache. The statistics are kept."""
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def reset_stats(self) -> None:
+        """Resets the hit, miss and eviction counts."""
+        with self.lock:
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> Dict[str, Optional[int]]:
+        """
+        Returns the usage statistics of the cache.
+
+        :return: A dictionary with the number of :code:`hits`, :code:`misses` and :code:`evictions`, the number of
+                 :code:`entries`, their size in :code:`bytes` (only measured with a byte budget) and the budget.
+        """
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'bytes': self.nbytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes
+            }
@@ -1,21 +1,28 @@
+import os
 import threading
 from collections import OrderedDict
+from functools import partial
+from itertools import islice
 from random import Random
 from typing import Dict, Iterator, List, Optional, Union, Tuple
 
 import numpy as np
+import torch
 from torch.utils.data import DataLoader, Dataset, Sampler
 from rdkit import Chem
 
+from .cache import LRUCache
 from .scaler import StandardScaler
-from mixprop.features import get_features_generator
 from mixprop.features import BatchMolGraph, MolGraph
+from mixprop.features import features_generator_hash, FeaturesStore, generate_features
+from mixprop.features.featurization import map_smiles, mol_graph_from_smiles
 from mixprop.features import is_explicit_h, is_reaction, is_adding_hs, is_mol
+from mixprop.features.graph_store import canonical_smiles, canonical_smiles_from_smiles, featurization_hash, GraphStore
 from mixprop.rdkit import make_mol
 
-# Cache of graph featurizations
+# Cache of graph featurizations, unbounded unless a budget is set
 CACHE_GRAPH = True
-SMILES_TO_GRAPH: Dict[str, MolGraph] = {}
+SMILES_TO_GRAPH = LRUCache(sizeof=lambda mol_graph: mol_graph.nbytes)
 
 
 def cache_graph() -> bool:
@@ -29,15 +36,236 @@ def set_cache_graph(cache_graph: bool) -> None:
     CACHE_GRAPH = cache_graph
 
 
+def set_graph_cache_budget(max_entries: Optional[int] = None, max_bytes: Optional[int] = None) -> None:
+    r"""
+    Sets the budget of the cache of :class:`~mixprop.features.MolGraph`\ s of this process
+    and evicts the least recently used graphs to fit.
+
+    :param max_entries: Maximum number of cached graphs, or None for no limit.
+    :param max_bytes: Maximum size of the arrays of the cached graphs in bytes, or None for no limit.
+    """
+    SMILES_TO_GRAPH.set_budget(max_entries, max_bytes)
+
+
 def empty_cache():
     r"""Empties the cache of :class:`~mixprop.features.MolGraph` and RDKit molecules."""
     SMILES_TO_GRAPH.clear()
     SMILES_TO_MOL.clear()
 
 
-# Cache of RDKit molecules
+def cache_stats() -> Dict[str, Dict[str, Optional[int]]]:
+    """
+    Returns the hits, misses, evictions, size and budget of the molecule, graph and features caches of this process.
+
+    :return: A dictionary mapping :code:`'mol'`, :code:`'graph'` and :code:`'features'` to the statistics of each cache.
+    """
+    return {'mol': SMILES_TO_MOL.stats(), 'graph': SMILES_TO_GRAPH.stats(), 'features': SMILES_TO_FEATURES.stats()}
+
+
+# Persistent on-disk store of graph featurizations, one per set of featurization parameters
+GRAPH_STORE_DIR = None
+GRAPH_STORE_CHUNK_SIZE = 10000  # number of molecules featurized before they are written to the graph store
+GRAPH_STORES: Dict[str, GraphStore] = {}
+
+
+def graph_store() -> Optional[GraphStore]:
+    """Returns the on-disk :class:`~mixprop.features.graph_store.GraphStore` for the current featurization parameters, if any."""
+    if GRAPH_STORE_DIR is None:
+        return None
+
+    key = featurization_hash()
+    if key not in GRAPH_STORES:
+        GRAPH_STORES[key] = GraphStore(os.path.join(GRAPH_STORE_DIR, key))
+
+    return GRAPH_STORES[key]
+
+
+def set_graph_store(graph_store_dir: Optional[str]) -> None:
+    """Sets the directory of the on-disk graph store, or disables it if None."""
+    global GRAPH_STORE_DIR
+    GRAPH_STORE_DIR = os.path.abspath(graph_store_dir) if graph_store_dir is not None else None
+    GRAPH_STORES.clear()
+
+
+def precompute_graphs(data: 'MoleculeDataset', num_workers: int = 0, chunk_size: int = 1000) -> None:
+    r"""
+    Featurizes the unique molecules of a dataset ahead of training or prediction, optionally in parallel.
+
+    The :class:`~mixprop.features.MolGraph`\ s are added to the on-disk graph store, if one is set, and to the
+    in-memory graph cache, if caching is enabled. This should be called in the main process before creating
+    a :class:`MoleculeDataLoader` so that DataLoader workers only read the featurized molecules.
+
+    :param data: A :class:`MoleculeDataset`.
+    :param num_workers: Number of worker processes used for featurization. If 0, molecules are featurized serially.
+    :param chunk_size: Number of molecules sent to a worker at once.
+    """
+    store = graph_store()
+    if store is None and not cache_graph():
+        return
+
+    if isinstance(data, ColumnarMoleculeDataset):
+        smiles = data.unique_smiles() if data.use_graph_store else []
+    else:
+        smiles = [s for d in data._data if d.use_graph_store for s in d.smiles]
+    smiles = list(dict.fromkeys(s for s in smiles if s not in SMILES_TO_GRAPH))
+
+    if store is None:
+        mol_graphs = map_smiles(mol_graph_from_smiles, smiles, num_workers, chunk_size)
+    else:
+        # Molecules are stored under their canonical SMILES, so only molecules new to the store are featurized
+        canonical = list(map_smiles(canonical_smiles_from_smiles, smiles, num_workers, chunk_size))
+        missing = {}
+        for s, c in zip(smiles, canonical):
+            if c is not None and c not in store and c not in missing:
+                missing[c] = s
+
+        new_graphs = map_smiles(mol_graph_from_smiles, list(missing.values()), num_workers, chunk_size)
+        new_smiles = list(missing.keys())
+        for i in range(0, len(new_smiles), GRAPH_STORE_CHUNK_SIZE):
+            store.add(new_smiles[i:i + GRAPH_STORE_CHUNK_SIZE], list(islice(new_graphs, GRAPH_STORE_CHUNK_SIZE)))
+
+        mol_graphs = (store.get(c) if c is not None else None for c in canonical)
+
+        # Datapoints keep the canonical SMILES of their molecules, so that later lookups in the store do not
+        # canonicalize them again
+        data.set_store_smiles(dict(zip(smiles, canonical)))
+
+    if cache_graph():
+        for s, mol_graph in zip(smiles, mol_graphs):
+            if mol_graph is not None:
+                SMILES_TO_GRAPH[s] = mol_graph
+
+
+def mol_nbytes(mol: Union[Chem.Mol, Tuple[Chem.Mol, Chem.Mol]]) -> int:
+    """Estimates the memory used by an RDKit molecule (or a reaction) by the size of its binary serialization."""
+    if mol is None:
+        return 0
+    if isinstance(mol, tuple):
+        return sum(mol_nbytes(m) for m in mol)
+
+    return len(mol.ToBinary())
+
+
+# Cache of features generator outputs keyed by (features generator, SMILES, keep hydrogens, add hydrogens),
+# unbounded unless a budget is set
+SMILES_TO_FEATURES = LRUCache(sizeof=lambda features: features.nbytes)
+
+# Persistent on-disk store of features generator outputs, one per features generator and its parameters
+FEATURES_STORE_DIR = None
+FEATURES_STORES: Dict[str, FeaturesStore] = {}
+
+
+def features_store(features_generator_name: str) -> Optional[FeaturesStore]:
+    """Returns the on-disk :class:`~mixprop.features.FeaturesStore` for a features generator, if any."""
+    if FEATURES_STORE_DIR is None:
+        return None
+
+    key = features_generator_hash(features_generator_name)
+    if key not in FEATURES_STORES:
+        FEATURES_STORES[key] = FeaturesStore(os.path.join(FEATURES_STORE_DIR, key))
+
+    return FEATURES_STORES[key]
+
+
+def set_features_store(features_store_dir: Optional[str]) -> None:
+    """Sets the directory of the on-disk features store, or disables it if None."""
+    global FEATURES_STORE_DIR
+    FEATURES_STORE_DIR = os.path.abspath(features_store_dir) if features_store_dir is not None else None
+    FEATURES_STORES.clear()
+
+
+def set_features_cache_budget(max_entries: Optional[int] = None, max_bytes: Optional[int] = None) -> None:
+    """
+    Sets the budget of the cache of features generator outputs of this process and evicts the least recently
+    used features to fit.
+
+    :param max_entries: Maximum number of cached feature vectors, or None for no limit.
+    :param max_bytes: Maximum size of the cached feature vectors in bytes, or None for no limit.
+    """
+    SMILES_TO_FEATURES.set_budget(max_entries, max_bytes)
+
+
+def molecule_features(features_generator_name: str, smiles: str, mol: Chem.Mol, keep_h: bool, add_h: bool) -> np.ndarray:
+    """
+    Looks up the features of a molecule in the features cache and store, generating them on a miss.
+
+    :param features_generator_name: The name of the features generator.
+    :param smiles: The SMILES string the molecule was parsed from.
+    :param mol: The RDKit molecule.
+    :param keep_h: Whether explicit hydrogens were kept when parsing the molecule.
+    :param add_h: Whether hydrogens were added when parsing the molecule.
+    :return: A 1D numpy array containing the features of the molecule.
+    """
+    key = (features_generator_name, smiles, keep_h, add_h)
+    features = SMILES_TO_FEATURES.get(key)
+    if features is None:
+        store = features_store(features_generator_name)
+        if store is not None:
+            features = store.get(canonical_smiles(mol))
+        if features is None:
+            features = generate_features(features_generator_name, mol)
+        SMILES_TO_FEATURES[key] = features
+
+    return features
+
+
+def features_from_smiles(features_generator_name: str, smiles: str) -> Optional[np.ndarray]:
+    """
+    Parses a molecule with the current featurization parameters and generates its features.
+
+    :param features_generator_name: The name of the features generator.
+    :param smiles: A SMILES string of a molecule (not a reaction).
+    :return: A 1D numpy array containing the features, or None if the SMILES is invalid.
+    """
+    mol = make_mol(smiles, is_explicit_h(), is_adding_hs())
+
+    return generate_features(features_generator_name, mol) if mol is not None else None
+
+
+def precompute_features(smiles: List[str],
+                        features_generator: List[str],
+                        num_workers: int = 0,
+                        chunk_size: int = 1000) -> None:
+    r"""
+    Generates the features of the unique molecules of a dataset before its :class:`MoleculeDatapoint`\ s are built,
+    optionally in parallel, so that each molecule is featurized once however many rows it appears in.
+
+    The features are added to the features cache and, if a store directory is set, molecules new to the
+    on-disk store are written to it. Reactions are featurized when their datapoints are built.
+
+    :param smiles: A list of SMILES strings, possibly with duplicates.
+    :param features_generator: A list of features generator names.
+    :param num_workers: Number of worker processes. If 0, features are generated serially.
+    :param chunk_size: Number of molecules sent to a worker at once.
+    """
+    keep_h, add_h = is_explicit_h(), is_adding_hs()
+    smiles = list(dict.fromkeys(s for s in smiles if not is_reaction(is_mol(s))))
+
+    for fg in features_generator:
+        missing = [s for s in smiles if (fg, s, keep_h, add_h) not in SMILES_TO_FEATURES]
+        store = features_store(fg)
+
+        if store is None:
+            features = map_smiles(partial(features_from_smiles, fg), missing, num_workers, chunk_size)
+        else:
+            # Molecules are stored under their canonical SMILES, so only molecules new to the store are featurized
+            canonical = list(map_smiles(canonical_smiles_from_smiles, missing, num_workers, chunk_size))
+            new = {}
+            for s, c in zip(missing, canonical):
+                if c is not None and c not in store and c not in new:
+                    new[c] = s
+            store.add(list(new.keys()), list(map_smiles(partial(features_from_smiles, fg), list(new.values()),
+                                                        num_workers, chunk_size)))
+            features = (store.get(c) if c is not None else None for c in canonical)
+
+        for s, f in zip(missing, features):
+            if f is not None:
+                SMILES_TO_FEATURES[(fg, s, keep_h, add_h)] = f
+
+
+# Cache of RDKit molecules, unbounded unless a budget is set
 CACHE_MOL = True
-SMILES_TO_MOL: Dict[str, Union[Chem.Mol, Tuple[Chem.Mol, Chem.Mol]]] = {}
+SMILES_TO_MOL = LRUCache(sizeof=mol_nbytes)
 
 
 def cache_mol() -> bool:
@@ -51,6 +279,16 @@ def set_cache_mol(cache_mol: bool) -> None:
     CACHE_MOL = cache_mol
 
 
+def set_mol_cache_budget(max_entries: Optional[int] = None, max_bytes: Optional[int] = None) -> None:
+    """
+    Sets the budget of the cache of RDKit molecules of this process and evicts the least recently used molecules to fit.
+
+    :param max_entries: Maximum number of cached molecules, or None for no limit.
+    :param max_bytes: Maximum estimated size of the cached molecules in bytes, or None for no limit.
+    """
+    SMILES_TO_MOL.set_budget(max_entries, max_bytes)
+
+
 class MoleculeDatapoint:
     """A :class:`MoleculeDatapoint` contains a single molecule and its associated features and targets."""
 
@@ -103,6 +341,11 @@ class MoleculeDatapoint:
         self.is_reaction_list = [is_reaction(x) for x in self.is_mol_list]
         self.is_explicit_h_list = [is_explicit_h(x) for x in self.is_mol_list]
         self.is_adding_hs_list = [is_adding_hs(x) for x in self.is_mol_list]
+        # Graphs with extra atom or bond features and reactions are not shared between datapoints, so they are
+        # neither precomputed nor stored and are featurized on the fly
+        self.use_graph_store = atom_features is None and bond_features is None and not any(self.is_reaction_list)
+        # Canonical SMILES under which the molecules are looked up in the graph store, computed once
+        self.store_smiles = None
 
         if data_weight is not None:
             self.data_weight = data_weight
@@ -116,23 +359,15 @@ class MoleculeDatapoint:
             self.features = []
 
             for fg in self.features_generator:
-                features_generator = get_features_generator(fg)
-                for m, reaction in zip(self.mol, self.is_reaction_list):
-                    if not reaction:
-                        if m is not None and m.GetNumHeavyAtoms() > 0:
-                            self.features.extend(features_generator(m))
-                        # for H2
-                        elif m is not None and m.GetNumHeavyAtoms() == 0:
-                            # not all features are equally long, so use methane as dummy molecule to determine length
-                            self.features.extend(np.zeros(len(features_generator(Chem.MolFromSmiles('C')))))                           
-                    else:
-                        if m[0] is not None and m[1] is not None and m[0].GetNumHeavyAtoms() > 0:
-                            self.features.extend(features_generator(m[0]))
-                        elif m[0] is not None and m[1] is not None and m[0].GetNumHeavyAtoms() == 0:
-                            self.features.extend(np.zeros(len(features_generator(Chem.MolFromSmiles('C')))))   
-                    
+                for s, m, reaction, keep_h, add_h in zip(self.smiles, self.mol, self.is_reaction_list,
+                                                         self.is_explicit_h_list, self.is_adding_hs_list):
+                    # Reactions are featurized by their reactants
+                    if reaction:
+                        m = m[0] if m[0] is not None and m[1] is not None else None
+                    if m is not None:
+                        self.features.append(molecule_features(fg, s, m, keep_h, add_h))
 
-            self.features = np.array(self.features)
+            self.features = np.concatenate(self.features) if len(self.features) > 0 else np.array([])
 
         # Fix nans in features
         replace_token = 0
@@ -247,6 +482,8 @@ class MoleculeDataset(Dataset):
         """
         self._data = data
         self._batch_graph = None
+        self._features_tensor = None
+        self._loss_tensors = None
         self._random = Random()
 
     def smiles(self, flatten: bool = False) -> Union[List[str], List[List[str]]]:
@@ -282,7 +519,7 @@ class MoleculeDataset(Dataset):
         """
         return self._data[0].number_of_molecules if len(self._data) > 0 else None
 
-    def batch_graph(self) -> List[BatchMolGraph]:
+    def batch_graph(self, shared_graphs: bool = False) -> List[BatchMolGraph]:
         r"""
         Constructs a :class:`~mixprop.features.BatchMolGraph` with the graph featurization of all the molecules.
 
@@ -292,35 +529,74 @@ class MoleculeDataset(Dataset):
            set of :class:`MoleculeDatapoint`\ s changes, then the returned :class:`~mixprop.features.BatchMolGraph`
            will be incorrect for the underlying data.
 
+        :param shared_graphs: Whether the molecule positions share one graph of their unique molecules, so that a
+                              model with a shared MPN (:code:`mpn_shared`) encodes each molecule once. Only used
+                              the first time the graphs are computed.
         :return: A list of :class:`~mixprop.features.BatchMolGraph` containing the graph featurization of all the
                  molecules in each :class:`MoleculeDatapoint`.
         """
         if self._batch_graph is None:
             self._batch_graph = []
 
-            mol_graphs = []
-            for d in self._data:
-                mol_graphs_list = []
-                for s, m in zip(d.smiles, d.mol):
-                    if s in SMILES_TO_GRAPH:
-                        mol_graph = SMILES_TO_GRAPH[s]
-                    else:
-                        if len(d.smiles) > 1 and (d.atom_features is not None or d.bond_features is not None):
-                            raise NotImplementedError('Atom descriptors are currently only supported with one molecule '
-                                                      'per input (i.e., number_of_molecules = 1).')
+            store = graph_store()
+            # Molecules whose graph only depends on their SMILES are featurized and encoded once per batch,
+            # and their encodings are gathered back to each row by index
+            dedupe = all(d.use_graph_store and d.atom_descriptors is None for d in self._data)
+            shared = shared_graphs and dedupe and self.number_of_molecules > 1
+            num_graph_lists = 1 if shared else self.number_of_molecules
 
-                        mol_graph = MolGraph(m, d.atom_features, d.bond_features,
-                                             overwrite_default_atom_features=d.overwrite_default_atom_features,
-                                             overwrite_default_bond_features=d.overwrite_default_bond_features)
+            mol_graphs = [[] for _ in range(num_graph_lists)]  # unique graphs of each molecule position
+            mol_indices = [[] for _ in range(self.number_of_molecules)]  # index of the graph of each row
+            positions = [{} for _ in range(num_graph_lists)]  # mapping from SMILES to graph index
+            for d in self._data:
+                mols = d.mol
+                for i, (s, m) in enumerate(zip(d.smiles, mols)):
+                    g = 0 if shared else i
+                    if dedupe and s in positions[g]:
+                        mol_indices[i].append(positions[g][s])
+                        continue
+
+                    mol_graph = SMILES_TO_GRAPH.get(s)
+                    if mol_graph is None:
+                        if store is not None and d.use_graph_store and m is not None:
+                            if d.store_smiles is None:
+                                d.store_smiles = [canonical_smiles(x) if x is not None else None for x in mols]
+                            mol_graph = store.get(d.store_smiles[i])
+
+                        if mol_graph is None:
+                            if len(d.smiles) > 1 and (d.atom_features is not None or d.bond_features is not None):
+                                raise NotImplementedError('Atom descriptors are currently only supported with one molecule '
+                                                          'per input (i.e., number_of_molecules = 1).')
+
+                            mol_graph = MolGraph(m, d.atom_features, d.bond_features,
+                                                 overwrite_default_atom_features=d.overwrite_default_atom_features,
+                                                 overwrite_default_bond_features=d.overwrite_default_bond_features)
                         if cache_graph():
                             SMILES_TO_GRAPH[s] = mol_graph
-                    mol_graphs_list.append(mol_graph)
-                mol_graphs.append(mol_graphs_list)
+                    positions[g][s] = len(mol_graphs[g])
+                    mol_indices[i].append(len(mol_graphs[g]))
+                    mol_graphs[g].append(mol_graph)
 
-            self._batch_graph = [BatchMolGraph([g[i] for g in mol_graphs]) for i in range(len(mol_graphs[0]))]
+            if shared:
+                graph = BatchMolGraph(mol_graphs[0])
+                self._batch_graph = [graph.with_mol_index(np.array(index)) for index in mol_indices]
+            else:
+                self._batch_graph = [BatchMolGraph(graphs, np.array(index) if len(graphs) < len(index) else None)
+                                     for graphs, index in zip(mol_graphs, mol_indices)]
 
         return self._batch_graph
 
+    def set_store_smiles(self, canonical: Dict[str, Optional[str]]) -> None:
+        """
+        Sets the canonical SMILES under which the molecules are looked up in the graph store.
+
+        :param canonical: A dictionary mapping SMILES to their canonical SMILES (None if invalid). Datapoints with
+                          SMILES missing from the dictionary compute their canonical SMILES when first looked up.
+        """
+        for d in self._data:
+            if d.use_graph_store and d.store_smiles is None and all(s in canonical for s in d.smiles):
+                d.store_smiles = [canonical[s] for s in d.smiles]
+
     def features(self) -> List[np.ndarray]:
         """
         Returns the features associated with each molecule (if they exist).
@@ -332,6 +608,23 @@ class MoleculeDataset(Dataset):
 
         return [d.features for d in self._data]
 
+    def features_tensor(self) -> Optional[torch.FloatTensor]:
+        """
+        Returns the features associated with each molecule stacked in a tensor.
+
+        The tensor is cached in after the first time it is computed and is reused until the features are changed
+        through this dataset, so that batches which are loaded repeatedly are only converted once.
+
+        :return: A float tensor of shape :code:`(num_molecules, features_size)` or None if there are no features.
+        """
+        if self._features_tensor is None:
+            features = self.features()
+            if features is None:
+                return None
+            self._features_tensor = torch.from_numpy(np.stack(features)).float()
+
+        return self._features_tensor
+
     def phase_features(self) -> List[np.ndarray]:
         """
         Returns the phase features associated with each molecule (if they exist).
@@ -396,6 +689,32 @@ class MoleculeDataset(Dataset):
         """
         return [d.targets for d in self._data]
 
+    def loss_tensors(self) -> Tuple[torch.FloatTensor, torch.BoolTensor, torch.FloatTensor,
+                                    Optional[torch.BoolTensor], Optional[torch.BoolTensor]]:
+        """
+        Returns the targets, the mask of known targets, the data weights and the inequality flags as tensors.
+
+        The tensors are cached in after the first time they are computed and are reused until the targets are
+        changed through this dataset. The batches which a :class:`MoleculeDataLoader` loads from this dataset
+        afterwards take their rows of these tensors instead of building their own.
+
+        :return: A tuple containing a float tensor of shape :code:`(num_molecules, num_tasks)` with the targets,
+                 where unknown targets are 0, a boolean tensor of the same shape which is True for known targets,
+                 a float tensor of shape :code:`(num_molecules, 1)` with the data weights, and boolean tensors of
+                 shape :code:`(num_molecules, num_tasks)` marking "<x" and ">x" inequality targets (or None).
+        """
+        if self._loss_tensors is None:
+            targets = self.targets()
+            mask = torch.tensor([[x is not None for x in tb] for tb in targets], dtype=torch.bool)
+            targets = torch.tensor([[0 if x is None else x for x in tb] for tb in targets])
+            data_weights = torch.tensor(self.data_weights()).unsqueeze(1)
+            lt_targets, gt_targets = self.lt_targets(), self.gt_targets()
+            self._loss_tensors = (targets, mask, data_weights,
+                                  torch.tensor(lt_targets) if lt_targets is not None else None,
+                                  torch.tensor(gt_targets) if gt_targets is not None else None)
+
+        return self._loss_tensors
+
     def gt_targets(self) -> List[np.ndarray]:
         """
 
@@ -483,6 +802,8 @@ class MoleculeDataset(Dataset):
                 (self._data[0].features is None and not scale_bond_features and not scale_atom_descriptors):
             return None
 
+        self._features_tensor = None
+
         if scaler is None:
             if scale_atom_descriptors and not self._data[0].atom_descriptors is None:
                 features = np.vstack([d.raw_atom_descriptors for d in self._data])
@@ -542,11 +863,13 @@ class MoleculeDataset(Dataset):
             )
         for i in range(len(self._data)):
             self._data[i].set_targets(targets[i])
+        self._loss_tensors = None
 
     def reset_features_and_targets(self) -> None:
         """Resets the features (atom, bond, and molecule) and targets to their raw values."""
         for d in self._data:
             d.reset_features_and_targets()
+        self._features_tensor = self._loss_tensors = None
 
     def __len__(self) -> int:
         """
@@ -566,6 +889,542 @@ class MoleculeDataset(Dataset):
         """
         return self._data[item]
 
+    def __getitems__(self, indices: List[int]) -> 'MoleculeDataset':
+        """
+        Gets a batch of datapoints as a dataset, used by :class:`MoleculeDataLoader` in place of single datapoints.
+
+        If the loss tensors of this dataset have been computed, the batch takes its rows of them.
+
+        :param indices: The indices of the datapoints in the batch.
+        :return: A dataset containing the datapoints of the batch.
+        """
+        batch = self.subset(indices)
+        if self._loss_tensors is not None:
+            index = torch.as_tensor(indices, dtype=torch.long)
+            batch._loss_tensors = tuple(tensor[index] if tensor is not None else None for tensor in self._loss_tensors)
+
+        return batch
+
+    def subset(self, indices: List[int]) -> 'MoleculeDataset':
+        r"""
+        Builds a dataset from some of the :class:`MoleculeDatapoint`\ s of this dataset.
+
+        :param indices: The indices of the datapoints, in the order in which they appear in the new dataset.
+        :return: A :class:`MoleculeDataset` sharing the selected datapoints with this dataset.
+        """
+        return MoleculeDataset([self._data[i] for i in indices])
+
+
+class ColumnarMoleculeDataset(MoleculeDataset):
+    r"""
+    A :class:`ColumnarMoleculeDataset` stores a dataset column-wise instead of as :class:`MoleculeDatapoint`\ s.
+
+    Each row refers to its molecules by their index in a table of unique SMILES, and the targets, features and
+    data weights of all rows are held in numpy arrays (missing targets are NaN). It has the same interface as a
+    :class:`MoleculeDataset`. Slices and the batches of a :class:`MoleculeDataLoader` are datasets sharing the table
+    of unique SMILES, and slices are views of the arrays of this dataset. Datasets with extra atom or bond features
+    or atom descriptors cannot be stored column-wise.
+    """
+
+    def __init__(self,
+                 smiles_table: List[str],
+                 smiles_ids: np.ndarray,
+                 targets: np.ndarray,
+                 features: np.ndarray = None,
+                 phase_features: np.ndarray = None,
+                 data_weights: np.ndarray = None,
+                 gt_targets: np.ndarray = None,
+                 lt_targets: np.ndarray = None,
+                 raw_features: np.ndarray = None,
+                 raw_targets: np.ndarray = None):
+        """
+        :param smiles_table: A list of unique SMILES strings.
+        :param smiles_ids: An integer array of shape :code:`(num_rows, number_of_molecules)` containing the index
+                           in :code:`smiles_table` of each molecule of each row.
+        :param targets: A float array of shape :code:`(num_rows, num_tasks)` containing the targets, NaN if unknown.
+        :param features: A float array of shape :code:`(num_rows, features_size)` containing additional features.
+        :param phase_features: An array of shape :code:`(num_rows, num_phases)` containing one-hot phase features.
+        :param data_weights: A float array of shape :code:`(num_rows,)` containing the weight of each row in the loss.
+        :param gt_targets: A boolean array of shape :code:`(num_rows, num_tasks)` marking ">x" inequality targets.
+        :param lt_targets: A boolean array of shape :code:`(num_rows, num_tasks)` marking "<x" inequality targets.
+        :param raw_features: The unscaled features. Defaults to :code:`features`.
+        :param raw_targets: The unscaled targets. Defaults to :code:`targets`.
+        """
+        super(ColumnarMoleculeDataset, self).__init__(data=None)
+        self._smiles_table = smiles_table
+        self._smiles_ids = smiles_ids
+        self._targets = targets
+        self._features = features
+        self._phase_features = phase_features
+        self._data_weights = data_weights
+        self._gt_targets = gt_targets
+        self._lt_targets = lt_targets
+        self._raw_features = raw_features if raw_features is not None else features
+        self._raw_targets = raw_targets if raw_targets is not None else targets
+        self._columns = None
+        # Canonical SMILES under which the molecules of the table are looked up in the graph store, by index,
+        # shared with slices
+        self._store_smiles: Dict[int, str] = {}
+
+        # All SMILES in a column are of the same kind, so the featurization flags are determined by the first row
+        first_row = [smiles_table[i] for i in smiles_ids[0]] if len(smiles_ids) > 0 else []
+        self.is_mol_list = [is_mol(s) for s in first_row]
+        self.is_reaction_list = [is_reaction(x) for x in self.is_mol_list]
+        self.is_explicit_h_list = [is_explicit_h(x) for x in self.is_mol_list]
+        self.is_adding_hs_list = [is_adding_hs(x) for x in self.is_mol_list]
+        self.use_graph_store = not any(self.is_reaction_list)
+
+    @classmethod
+    def from_lists(cls,
+                   smiles: List[List[str]],
+                   targets: List[List[Optional[float]]],
+                   features: np.ndarray = None,
+                   features_generator: List[str] = None,
+                   phase_features: np.ndarray = None,
+                   data_weights: List[float] = None,
+                   gt_targets: List[List[bool]] = None,
+                   lt_targets: List[List[bool]] = None) -> 'ColumnarMoleculeDataset':
+        """
+        Builds a :class:`ColumnarMoleculeDataset` from the SMILES and targets of each row.
+
+        :param smiles: A list of the SMILES strings of the molecules of each row.
+        :param targets: A list of the targets of each row (containing None for unknown targets).
+        :param features: An array of shape :code:`(num_rows, features_size)` containing additional features.
+        :param features_generator: A list of features generators, used in place of :code:`features`.
+        :param phase_features: An array of shape :code:`(num_rows, num_phases)` containing phase features.
+        :param data_weights: The weight of each row in the loss.
+        :param gt_targets: Indicates for each row whether the targets are inequality targets of the form ">x".
+        :param lt_targets: Indicates for each row whether the targets are inequality targets of the form "<x".
+        :return: A :class:`ColumnarMoleculeDataset` containing the rows.
+        """
+        if features is not None and features_generator is not None:
+            raise ValueError('Cannot provide both loaded features and a features generator.')
+
+        index = {}
+        number_of_molecules = len(smiles[0]) if len(smiles) > 0 else 0
+        num_tasks = len(targets[0]) if len(targets) > 0 else 0
+        smiles_ids = np.array([index.setdefault(s, len(index)) for row in smiles for s in row],
+                              dtype=np.int64).reshape(len(smiles), number_of_molecules)
+        data = cls(smiles_table=list(index),
+                   smiles_ids=smiles_ids,
+                   targets=np.array(targets, dtype=np.float64).reshape(len(smiles), num_tasks),
+                   phase_features=np.array(phase_features) if phase_features is not None else None,
+                   data_weights=np.array(data_weights, dtype=np.float64) if data_weights is not None else None,
+                   gt_targets=np.array(gt_targets, dtype=bool) if gt_targets is not None else None,
+                   lt_targets=np.array(lt_targets, dtype=bool) if lt_targets is not None else None)
+
+        if features_generator is not None:
+            features = np.concatenate([data._table_features(fg)[smiles_ids[:, i]]
+                                       for fg in features_generator for i in range(number_of_molecules)], axis=1)
+        if features is not None:
+            features = np.asarray(features, dtype=np.float64)
+            features = np.where(np.isnan(features), 0, features)
+            data._features = data._raw_features = features
+
+        return data
+
+    def _table_columns(self) -> np.ndarray:
+        # Molecule column in which each SMILES of the table appears, which determines how it is featurized
+        if self._columns is None:
+            self._columns = np.zeros(len(self._smiles_table), dtype=np.int64)
+            self._columns[self._smiles_ids.ravel()] = np.tile(np.arange(self._smiles_ids.shape[1]),
+                                                              len(self._smiles_ids))
+
+        return self._columns
+
+    def _table_mols(self, ids: np.ndarray) -> Dict[int, Union[Chem.Mol, Tuple[Chem.Mol, Chem.Mol]]]:
+        # RDKit molecules of the given SMILES of the table, built once per SMILES
+        ids = np.unique(ids).tolist()
+        columns = self._table_columns()[ids].tolist()
+        smiles = [self._smiles_table[i] for i in ids]
+        mols = make_mols(smiles, [self.is_reaction_list[c] for c in columns], [self.is_explicit_h_list[c] for c in columns],
+                         [self.is_adding_hs_list[c] for c in columns])
+        if cache_mol():
+            for s, m in zip(smiles, mols):
+                SMILES_TO_MOL[s] = m
+
+        return dict(zip(ids, mols))
+
+    def _table_features(self, features_generator_name: str) -> np.ndarray:
+        # Features of every SMILES of the table, zeros for invalid molecules
+        columns = self._table_columns().tolist()
+        mols = self._table_mols(np.arange(len(self._smiles_table)))
+        features = []
+        for i, s in enumerate(self._smiles_table):
+            m, column = mols[i], columns[i]
+            # Reactions are featurized by their reactants
+            if self.is_reaction_list[column]:
+                m = m[0] if m[0] is not None and m[1] is not None else None
+            features.append(molecule_features(features_generator_name, s, m, self.is_explicit_h_list[column],
+                                              self.is_adding_hs_list[column]) if m is not None else None)
+
+        size = next((len(f) for f in features if f is not None), None)
+        if size is None:
+            size = len(generate_features(features_generator_name, Chem.MolFromSmiles('C')))
+
+        return np.stack([f if f is not None else np.zeros(size) for f in features]) if len(features) > 0 \
+            else np.zeros((0, size))
+
+    def unique_smiles(self) -> List[str]:
+        """
+        Returns the unique SMILES strings of the molecules of this dataset.
+
+        :return: A list of unique SMILES strings.
+        """
+        return [self._smiles_table[i] for i in np.unique(self._smiles_ids).tolist()]
+
+    def unique_mols(self) -> List[Union[Chem.Mol, Tuple[Chem.Mol, Chem.Mol]]]:
+        """
+        Returns the RDKit molecules of the unique SMILES strings of this dataset.
+
+        :return: A list of RDKit molecules aligned with :meth:`unique_smiles`.
+        """
+        return list(self._table_mols(self._smiles_ids).values())
+
+    def smiles(self, flatten: bool = False) -> Union[List[str], List[List[str]]]:
+        """
+        Returns a list containing the SMILES list associated with each row.
+
+        :param flatten: Whether to flatten the returned SMILES to a list instead of a list of lists.
+        :return: A list of SMILES or a list of lists of SMILES, depending on :code:`flatten`.
+        """
+        if flatten:
+            return [self._smiles_table[i] for i in self._smiles_ids.ravel().tolist()]
+
+        return [[self._smiles_table[i] for i in row] for row in self._smiles_ids.tolist()]
+
+    def mols(self, flatten: bool = False) -> Union[List[Chem.Mol], List[List[Chem.Mol]], List[Tuple[Chem.Mol, Chem.Mol]], List[List[Tuple[Chem.Mol, Chem.Mol]]]]:
+        """
+        Returns a list of the RDKit molecules associated with each row.
+
+        :param flatten: Whether to flatten the returned RDKit molecules to a list instead of a list of lists.
+        :return: A list of RDKit molecules or a list of lists of RDKit molecules, depending on :code:`flatten`.
+        """
+        mols = self._table_mols(self._smiles_ids)
+        if flatten:
+            return [mols[i] for i in self._smiles_ids.ravel().tolist()]
+
+        return [[mols[i] for i in row] for row in self._smiles_ids.tolist()]
+
+    @property
+    def number_of_molecules(self) -> int:
+        """
+        Gets the number of molecules in each row.
+
+        :return: The number of molecules.
+        """
+        return self._smiles_ids.shape[1] if len(self._smiles_ids) > 0 else None
+
+    def batch_graph(self, shared_graphs: bool = False) -> List[BatchMolGraph]:
+        """
+        Constructs a :class:`~mixprop.features.BatchMolGraph` for each molecule column, featurizing each unique
+        molecule once.
+
+        :param shared_graphs: Whether the columns share one graph of their unique molecules, so that a model with a
+                              shared MPN (:code:`mpn_shared`) encodes each molecule once. Only used the first time
+                              the graphs are computed.
+        :return: A list of :class:`~mixprop.features.BatchMolGraph` containing the graph featurization of all the
+                 molecules in each row.
+        """
+        if self._batch_graph is None:
+            if shared_graphs and self.use_graph_store and self.number_of_molecules > 1:
+                # The columns are stacked, so that molecules found in several columns are featurized once
+                mol_graphs, mol_index = self._unique_graphs(self._smiles_ids.T.reshape(-1))
+                graph = BatchMolGraph(mol_graphs)
+                self._batch_graph = [graph.with_mol_index(index)
+                                     for index in mol_index.reshape(self.number_of_molecules, -1)]
+            else:
+                self._batch_graph = []
+                for column in range(self.number_of_molecules):
+                    mol_graphs, mol_index = self._unique_graphs(self._smiles_ids[:, column])
+                    self._batch_graph.append(BatchMolGraph(mol_graphs,
+                                                           mol_index if len(mol_graphs) < len(mol_index) else None))
+
+        return self._batch_graph
+
+    def _unique_graphs(self, smiles_ids: np.ndarray) -> Tuple[List[MolGraph], np.ndarray]:
+        """
+        Looks up or featurizes the graphs of the unique molecules among some molecules of the table.
+
+        :param smiles_ids: The indices into the SMILES table of the molecules.
+        :return: The graphs of the unique molecules in order of their first appearance, and the index of the
+                 graph of each molecule.
+        """
+        store = graph_store() if self.use_graph_store else None
+
+        # Unique molecules are kept in order of their first appearance
+        ids, first, mol_index = np.unique(smiles_ids, return_index=True, return_inverse=True)
+        order = np.argsort(first, kind='stable')
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        ids, mol_index = ids[order], rank[mol_index]
+
+        mols = None
+        mol_graphs = []
+        for i in ids.tolist():
+            s = self._smiles_table[i]
+            mol_graph = SMILES_TO_GRAPH.get(s)
+            if mol_graph is None:
+                if mols is None:
+                    mols = self._table_mols(ids)
+                if store is not None and mols[i] is not None:
+                    if i not in self._store_smiles:
+                        self._store_smiles[i] = canonical_smiles(mols[i])
+                    mol_graph = store.get(self._store_smiles[i])
+                if mol_graph is None:
+                    mol_graph = MolGraph(mols[i])
+                if cache_graph():
+                    SMILES_TO_GRAPH[s] = mol_graph
+            mol_graphs.append(mol_graph)
+
+        return mol_graphs, mol_index
+
+    def set_store_smiles(self, canonical: Dict[str, Optional[str]]) -> None:
+        """
+        Sets the canonical SMILES under which the molecules are looked up in the graph store.
+
+        :param canonical: A dictionary mapping SMILES to their canonical SMILES (None if invalid). Molecules
+                          missing from the dictionary compute their canonical SMILES when first looked up.
+        """
+        for i in np.unique(self._smiles_ids).tolist():
+            c = canonical.get(self._smiles_table[i])
+            if c is not None:
+                self._store_smiles[i] = c
+
+    def features(self) -> List[np.ndarray]:
+        """
+        Returns the features associated with each row (if they exist).
+
+        :return: A list of 1D numpy arrays containing the features for each row or None if there are no features.
+        """
+        if len(self) == 0 or self._features is None:
+            return None
+
+        return list(self._features)
+
+    def phase_features(self) -> List[np.ndarray]:
+        """
+        Returns the phase features associated with each row (if they exist).
+
+        :return: A list of 1D numpy arrays containing the phase features for each row or None if there are no features.
+        """
+        if len(self) == 0 or self._phase_features is None:
+            return None
+
+        return list(self._phase_features)
+
+    def atom_features(self) -> None:
+        """Atom features are not stored column-wise, so this returns None."""
+        return None
+
+    def atom_descriptors(self) -> None:
+        """Atom descriptors are not stored column-wise, so this returns None."""
+        return None
+
+    def bond_features(self) -> None:
+        """Bond features are not stored column-wise, so this returns None."""
+        return None
+
+    def data_weights(self) -> List[float]:
+        """
+        Returns the loss weighting associated with each row.
+        """
+        if self._data_weights is None:
+            return [1. for _ in range(len(self))]
+
+        return self._data_weights.tolist()
+
+    def targets(self) -> List[List[Optional[float]]]:
+        """
+        Returns the targets associated with each row.
+
+        :return: A list of lists of floats (or None) containing the targets.
+        """
+        return np.where(np.isnan(self._targets), None, self._targets).tolist()
+
+    def loss_tensors(self) -> Tuple[torch.FloatTensor, torch.BoolTensor, torch.FloatTensor,
+                                    Optional[torch.BoolTensor], Optional[torch.BoolTensor]]:
+        """
+        Returns the targets, the mask of known targets, the data weights and the inequality flags as tensors.
+
+        :return: A tuple containing a float tensor of shape :code:`(num_rows, num_tasks)` with the targets,
+                 where unknown targets are 0, a boolean tensor of the same shape which is True for known targets,
+                 a float tensor of shape :code:`(num_rows, 1)` with the data weights, and boolean tensors of
+                 shape :code:`(num_rows, num_tasks)` marking "<x" and ">x" inequality targets (or None).
+        """
+        def to_tensor(array: Optional[np.ndarray]) -> Optional[torch.Tensor]:
+            return torch.from_numpy(np.ascontiguousarray(array)) if array is not None else None
+
+        if self._loss_tensors is None:
+            known = ~np.isnan(self._targets)
+            data_weights = self._data_weights if self._data_weights is not None else np.ones(len(self))
+            self._loss_tensors = (to_tensor(np.where(known, self._targets, 0)).float(), to_tensor(known),
+                                  to_tensor(data_weights).float().unsqueeze(1),
+                                  to_tensor(self._lt_targets), to_tensor(self._gt_targets))
+
+        return self._loss_tensors
+
+    def gt_targets(self) -> List[np.ndarray]:
+        """
+        Returns whether the targets of each row are inequality targets of the form ">x", if known.
+        """
+        return self._gt_targets.tolist() if self._gt_targets is not None else None
+
+    def lt_targets(self) -> List[np.ndarray]:
+        """
+        Returns whether the targets of each row are inequality targets of the form "<x", if known.
+        """
+        return self._lt_targets.tolist() if self._lt_targets is not None else None
+
+    def num_tasks(self) -> int:
+        """
+        Returns the number of prediction tasks.
+
+        :return: The number of tasks.
+        """
+        return self._targets.shape[1] if len(self) > 0 else None
+
+    def features_size(self) -> int:
+        """
+        Returns the size of the additional features vector associated with the molecules.
+
+        :return: The size of the additional features vector.
+        """
+        return self._features.shape[1] if len(self) > 0 and self._features is not None else None
+
+    def atom_descriptors_size(self) -> None:
+        return None
+
+    def atom_features_size(self) -> None:
+        return None
+
+    def bond_features_size(self) -> None:
+        return None
+
+    def normalize_features(self, scaler: StandardScaler = None, replace_nan_token: int = 0,
+                           scale_atom_descriptors: bool = False, scale_bond_features: bool = False) -> StandardScaler:
+        """
+        Normalizes the features of the dataset using a :class:`~mixprop.data.StandardScaler`.
+
+        :param scaler: A fitted :class:`~mixprop.data.StandardScaler`. If it is provided it is used,
+                       otherwise a new :class:`~mixprop.data.StandardScaler` is first fitted to this
+                       data and is then used.
+        :param replace_nan_token: A token to use to replace NaN entries in the features.
+        :param scale_atom_descriptors: Atom descriptors are not stored column-wise, so nothing is scaled if True.
+        :param scale_bond_features: Bond features are not stored column-wise, so nothing is scaled if True.
+        :return: A fitted :class:`~mixprop.data.StandardScaler`, or None if there is nothing to scale.
+        """
+        if len(self) == 0 or self._features is None or scale_atom_descriptors or scale_bond_features:
+            return None
+
+        if scaler is None:
+            scaler = StandardScaler(replace_nan_token=replace_nan_token)
+            scaler.fit(self._raw_features)
+
+        self._features = scaler.transform(self._raw_features)
+        self._features_tensor = None
+
+        return scaler
+
+    def normalize_targets(self) -> StandardScaler:
+        """
+        Normalizes the targets of the dataset using a :class:`~mixprop.data.StandardScaler`.
+
+        This should only be used for regression datasets.
+
+        :return: A :class:`~mixprop.data.StandardScaler` fitted to the targets.
+        """
+        scaler = StandardScaler().fit(self._raw_targets)
+        self._targets = np.array(scaler.transform(self._raw_targets), dtype=np.float64)
+        self._loss_tensors = None
+
+        return scaler
+
+    def set_targets(self, targets: List[List[Optional[float]]]) -> None:
+        """
+        Sets the targets for each row in the dataset. Assumes the targets are aligned with the rows.
+
+        :param targets: A list of lists of floats (or None) containing targets for each row. This must be the
+                        same length as the underlying dataset.
+        """
+        if not len(self) == len(targets):
+            raise ValueError(
+                "number of molecules and targets must be of same length! "
+                f"num molecules: {len(self)}, num targets: {len(targets)}"
+            )
+        self._targets = np.array(targets, dtype=np.float64).reshape(len(self), -1)
+        self._loss_tensors = None
+
+    def reset_features_and_targets(self) -> None:
+        """Resets the features and targets to their raw values."""
+        self._features, self._targets = self._raw_features, self._raw_targets
+        self._features_tensor = self._loss_tensors = None
+
+    def __len__(self) -> int:
+        """
+        Returns the length of the dataset (i.e., the number of rows).
+
+        :return: The length of the dataset.
+        """
+        return len(self._smiles_ids)
+
+    def _take(self, item: Union[slice, np.ndarray]) -> 'ColumnarMoleculeDataset':
+        def take(array: Optional[np.ndarray]) -> Optional[np.ndarray]:
+            return array[item] if array is not None else None
+
+        data = ColumnarMoleculeDataset(smiles_table=self._smiles_table,
+                                       smiles_ids=take(self._smiles_ids),
+                                       targets=take(self._targets),
+                                       features=take(self._features),
+                                       phase_features=take(self._phase_features),
+                                       data_weights=take(self._data_weights),
+                                       gt_targets=take(self._gt_targets),
+                                       lt_targets=take(self._lt_targets),
+                                       raw_features=take(self._raw_features),
+                                       raw_targets=take(self._raw_targets))
+        data._store_smiles = self._store_smiles
+
+        return data
+
+    def __getitem__(self, item) -> Union[MoleculeDatapoint, 'ColumnarMoleculeDataset']:
+        r"""
+        Gets a row as a :class:`MoleculeDatapoint` or several rows as a dataset.
+
+        :param item: An index (int) or a slice object.
+        :return: A :class:`MoleculeDatapoint` built from the row if an int is provided or a
+                 :class:`ColumnarMoleculeDataset` whose arrays are views of this dataset if a slice is provided.
+        """
+        if isinstance(item, slice):
+            return self._take(item)
+
+        smiles = [self._smiles_table[i] for i in self._smiles_ids[item]]
+        datapoint = MoleculeDatapoint(
+            smiles=smiles,
+            targets=[None if np.isnan(x) else x for x in self._raw_targets[item].tolist()],
+            data_weight=self._data_weights[item] if self._data_weights is not None else None,
+            gt_targets=self._gt_targets[item].tolist() if self._gt_targets is not None else None,
+            lt_targets=self._lt_targets[item].tolist() if self._lt_targets is not None else None,
+            features=self._raw_features[item] if self._raw_features is not None else None,
+            phase_features=self._phase_features[item] if self._phase_features is not None else None
+        )
+        datapoint.set_features(self._features[item] if self._features is not None else None)
+        datapoint.set_targets([None if np.isnan(x) else x for x in self._targets[item].tolist()])
+
+        return datapoint
+
+    def subset(self, indices: List[int]) -> 'ColumnarMoleculeDataset':
+        """
+        Builds a dataset from some of the rows of this dataset.
+
+        :param indices: The indices of the rows, in the order in which they appear in the new dataset.
+        :return: A :class:`ColumnarMoleculeDataset` sharing the table of unique SMILES with this dataset.
+        """
+        return self._take(np.asarray(indices, dtype=np.int64))
+
+
+# number of batches whose datapoints are sorted by size together when a shuffled MoleculeSampler buckets by size
+BUCKET_POOL_BATCHES = 50
+
 
 class MoleculeSampler(Sampler):
     """A :class:`MoleculeSampler` samples data from a :class:`MoleculeDataset` for a :class:`MoleculeDataLoader`."""
@@ -574,25 +1433,34 @@ class MoleculeSampler(Sampler):
                  dataset: MoleculeDataset,
                  class_balance: bool = False,
                  shuffle: bool = False,
-                 seed: int = 0):
+                 seed: int = 0,
+                 bucket_by_size: bool = False,
+                 batch_size: int = 50):
         """
         :param class_balance: Whether to perform class balancing (i.e., use an equal number of positive
                               and negative molecules). Set shuffle to True in order to get a random
                               subset of the larger class.
         :param shuffle: Whether to shuffle the data.
         :param seed: Random seed. Only needed if :code:`shuffle` is True.
+        :param bucket_by_size: Whether to order the data so that each batch holds molecules of similar size
+                               and maximum degree, which reduces the padding of the batched graphs.
+        :param batch_size: The batch size of the :class:`MoleculeDataLoader`. Only needed if
+                           :code:`bucket_by_size` is True.
         """
         super(Sampler, self).__init__()
 
         self.dataset = dataset
         self.class_balance = class_balance
         self.shuffle = shuffle
+        self.bucket_by_size = bucket_by_size
+        self.batch_size = batch_size
 
         self._random = Random(seed)
+        self._molecule_sizes = None
 
         if self.class_balance:
             indices = np.arange(len(dataset))
-            has_active = np.array([any(target == 1 for target in datapoint.targets) for datapoint in dataset])
+            has_active = np.array([any(target == 1 for target in targets) for targets in dataset.targets()])
 
             self.positive_indices = indices[has_active].tolist()
             self.negative_indices = indices[~has_active].tolist()
@@ -617,25 +1485,118 @@ class MoleculeSampler(Sampler):
             if self.shuffle:
                 self._random.shuffle(indices)
 
+        if self.bucket_by_size:
+            indices = [index for batch in self._bucket(indices) for index in batch]
+
         return iter(indices)
 
     def __len__(self) -> int:
         """Returns the number of indices that will be sampled."""
         return self.length
 
+    def molecule_sizes(self) -> Tuple[List[List[str]], Dict[str, Tuple[int, int, int]]]:
+        """
+        Computes the size of each molecule in the dataset.
+
+        :return: A tuple containing the SMILES strings of each datapoint and a dictionary mapping each
+                 SMILES string to the number of atoms, the number of directed bonds and the maximum degree
+                 of its molecule.
+        """
+        if self._molecule_sizes is None:
+            smiles = self.dataset.smiles()
+            sizes = {}
+            for row_smiles, row_mols in zip(smiles, self.dataset.mols()):
+                for s, mol in zip(row_smiles, row_mols):
+                    if s in sizes:
+                        continue
+                    # The graph of a reaction is built on the atoms of the reactants
+                    mol = mol[0] if isinstance(mol, tuple) else mol
+                    if mol is None:
+                        sizes[s] = (0, 0, 0)
+                    else:
+                        degrees = [atom.GetDegree() for atom in mol.GetAtoms()]
+                        sizes[s] = (len(degrees), sum(degrees), max(degrees, default=0))
+            self._molecule_sizes = (smiles, sizes)
 
-def construct_molecule_batch(data: List[MoleculeDatapoint]) -> MoleculeDataset:
+        return self._molecule_sizes
+
+    def _bucket(self, indices: List[int]) -> List[List[int]]:
+        """
+        Groups indices into batches of datapoints of similar maximum degree and size.
+
+        Shuffled indices are sorted in pools of :code:`BUCKET_POOL_BATCHES` batches and the order of the
+        batches is shuffled, so the batches still change from epoch to epoch. Otherwise all indices are
+        sorted at once.
+
+        :param indices: The indices to sample, in the order they would be sampled without bucketing.
+        :return: A list of batches of indices.
+        """
+        smiles, sizes = self.molecule_sizes()
+        keys = np.array([(max(sizes[s][2] for s in smiles[index]), sum(sizes[s][0] + sizes[s][1] for s in smiles[index]))
+                         for index in indices], dtype=np.int64).reshape(-1, 2)
+
+        pool_size = self.batch_size * BUCKET_POOL_BATCHES if self.shuffle else max(len(indices), 1)
+        batches = []
+        for start in range(0, len(indices), pool_size):
+            pool_keys = keys[start:start + pool_size]
+            # The sort is stable, so datapoints of equal size keep their shuffled order
+            pool = [indices[start + i] for i in np.lexsort((pool_keys[:, 1], pool_keys[:, 0])).tolist()]
+            batches.extend(pool[i:i + self.batch_size] for i in range(0, len(pool), self.batch_size))
+
+        if self.shuffle and len(batches) > 0:
+            # A partial batch stays last so that the DataLoader cuts the same batches
+            num_full = len(batches) if len(batches[-1]) == self.batch_size else len(batches) - 1
+            full_batches = batches[:num_full]
+            self._random.shuffle(full_batches)
+            batches = full_batches + batches[num_full:]
+
+        return batches
+
+    def padding_efficiency(self) -> float:
+        """
+        Computes the fraction of the padded bond index matrices of the batched molecular graphs which
+        holds bonds, for the batches of the next epoch. The random state of the sampler is not changed.
+
+        Each :class:`~mixprop.features.BatchMolGraph` pads the incoming bonds of every atom to the maximum
+        degree in the batch, so the fraction is the number of directed bonds divided by the number of atoms
+        times the maximum degree, summed over the unique molecules of each batch and molecule column.
+
+        :return: The padding efficiency, between 0 and 1.
+        """
+        state = self._random.getstate()
+        indices = list(self)
+        self._random.setstate(state)
+
+        smiles, sizes = self.molecule_sizes()
+        used = allocated = 0
+        for start in range(0, len(indices), self.batch_size):
+            batch_smiles = [smiles[index] for index in indices[start:start + self.batch_size]]
+            for column in zip(*batch_smiles):
+                column_sizes = [sizes[s] for s in set(column)]
+                used += sum(size[1] for size in column_sizes)
+                # The graph has a padding atom, and its bond index matrix has at least one column
+                allocated += (1 + sum(size[0] for size in column_sizes)) * max(1, max(size[2] for size in column_sizes))
+
+        return used / allocated if allocated > 0 else 1.0
+
+
+def construct_molecule_batch(data: Union[List[MoleculeDatapoint], MoleculeDataset],
+                             shared_graphs: bool = False) -> MoleculeDataset:
     r"""
     Constructs a :class:`MoleculeDataset` from a list of :class:`MoleculeDatapoint`\ s.
 
     Additionally, precomputes the :class:`~mixprop.features.BatchMolGraph` for the constructed
     :class:`MoleculeDataset`.
 
-    :param data: A list of :class:`MoleculeDatapoint`\ s.
+    :param data: A list of :class:`MoleculeDatapoint`\ s, or a :class:`MoleculeDataset` for datasets
+                 which build their batches themselves, such as a :class:`ColumnarMoleculeDataset`.
+    :param shared_graphs: Whether the molecule positions share one graph of their unique molecules
+                          (see :meth:`MoleculeDataset.batch_graph`).
     :return: A :class:`MoleculeDataset` containing all the :class:`MoleculeDatapoint`\ s.
     """
-    data = MoleculeDataset(data)
-    data.batch_graph()  # Forces computation and caching of the BatchMolGraph for the molecules
+    if not isinstance(data, MoleculeDataset):
+        data = MoleculeDataset(data)
+    data.batch_graph(shared_graphs)  # Forces computation and caching of the BatchMolGraph for the molecules
 
     return data
 
@@ -649,7 +1610,10 @@ class MoleculeDataLoader(DataLoader):
                  num_workers: int = 8,
                  class_balance: bool = False,
                  shuffle: bool = False,
-                 seed: int = 0):
+                 seed: int = 0,
+                 bucket_by_size: bool = False,
+                 cache_batches: bool = False,
+                 shared_graphs: bool = False):
         """
         :param dataset: The :class:`MoleculeDataset` containing the molecules to load.
         :param batch_size: Batch size.
@@ -660,13 +1624,30 @@ class MoleculeDataLoader(DataLoader):
                               subset of the larger class.
         :param shuffle: Whether to shuffle the data.
         :param seed: Random seed. Only needed if shuffle is True.
-        """
+        :param bucket_by_size: Whether to group molecules of similar size and maximum degree into the same
+                               batches to reduce padding. Without shuffle, the batches are then not in the
+                               order of the dataset (see :meth:`indices`).
+        :param cache_batches: Whether to keep the batches built on the first pass through the data, with their
+                              graphs, features, targets and mask, and to iterate over them on later passes.
+                              Changes to the dataset after the first pass are not seen by the cached batches.
+                              Only available if class balance and shuffle are disabled.
+        :param shared_graphs: Whether the molecule positions of each batch share one graph of their unique
+                              molecules, so that a model with a shared MPN (:code:`mpn_shared`) encodes each
+                              molecule once.
+        """
+        if cache_batches and (class_balance or shuffle):
+            raise ValueError('Cannot cache batches when class balance or shuffle are enabled.')
+
         self._dataset = dataset
         self._batch_size = batch_size
         self._num_workers = num_workers
         self._class_balance = class_balance
         self._shuffle = shuffle
         self._seed = seed
+        self._bucket_by_size = bucket_by_size
+        self._cache_batches = cache_batches
+        self._shared_graphs = shared_graphs
+        self._batches = None
         self._context = None
         self._timeout = 0
         is_main_thread = threading.current_thread() is threading.main_thread()
@@ -678,7 +1659,9 @@ class MoleculeDataLoader(DataLoader):
             dataset=self._dataset,
             class_balance=self._class_balance,
             shuffle=self._shuffle,
-            seed=self._seed
+            seed=self._seed,
+            bucket_by_size=self._bucket_by_size,
+            batch_size=self._batch_size
         )
 
         super(MoleculeDataLoader, self).__init__(
@@ -686,7 +1669,7 @@ class MoleculeDataLoader(DataLoader):
             batch_size=self._batch_size,
             sampler=self._sampler,
             num_workers=self._num_workers,
-            collate_fn=construct_molecule_batch,
+            collate_fn=partial(construct_molecule_batch, shared_graphs=self._shared_graphs),
             multiprocessing_context=self._context,
             timeout=self._timeout
         )
@@ -701,7 +1684,7 @@ class MoleculeDataLoader(DataLoader):
         if self._class_balance or self._shuffle:
             raise ValueError('Cannot safely extract targets when class balance or shuffle are enabled.')
 
-        return [self._dataset[index].targets for index in self._sampler]
+        return self._dataset.targets()
 
     @property
     def gt_targets(self) -> List[List[Optional[bool]]]:
@@ -712,11 +1695,8 @@ class MoleculeDataLoader(DataLoader):
         """
         if self._class_balance or self._shuffle:
             raise ValueError('Cannot safely extract targets when class balance or shuffle are enabled.')
-        
-        if not hasattr(self._dataset[0],'gt_targets'):
-            return None
 
-        return [self._dataset[index].gt_targets for index in self._sampler]
+        return self._dataset.gt_targets()
 
     @property
     def lt_targets(self) -> List[List[Optional[bool]]]:
@@ -728,11 +1708,50 @@ class MoleculeDataLoader(DataLoader):
         if self._class_balance or self._shuffle:
             raise ValueError('Cannot safely extract targets when class balance or shuffle are enabled.')
 
-        if not hasattr(self._dataset[0],'lt_targets'):
-            return None
+        return self._dataset.lt_targets()
 
-        return [self._dataset[index].lt_targets for index in self._sampler]
+    @property
+    def bucket_by_size(self) -> bool:
+        """Whether the batches group molecules of similar size rather than following the order of the dataset."""
+        return self._bucket_by_size
+
+    @property
+    def indices(self) -> List[int]:
+        """
+        Returns the indices of the datapoints in the order in which they are loaded.
 
+        :return: A list of indices into the dataset.
+        """
+        if self._class_balance or self._shuffle:
+            raise ValueError('Cannot safely extract the order of the datapoints when class balance or shuffle are enabled.')
+
+        return list(self._sampler)
+
+    def restore_order(self, outputs: Union[list, np.ndarray], axis: int = 0) -> Union[list, np.ndarray]:
+        """
+        Puts outputs computed batch by batch, such as predictions, back in the order of the dataset.
+
+        Batches bucketed by size are not in the order of the dataset, so their outputs are reordered by
+        :meth:`indices`. Otherwise the outputs are returned unchanged.
+
+        :param outputs: A list or numpy array with an output for each datapoint, in the order in which they
+                        were loaded.
+        :param axis: The axis of the datapoints if :code:`outputs` is a numpy array.
+        :return: The outputs in the order of the dataset.
+        """
+        if not self._bucket_by_size:
+            return outputs
+
+        order = np.argsort(self.indices)
+        if isinstance(outputs, np.ndarray):
+            return np.take(outputs, order, axis=axis)
+
+        return [outputs[i] for i in order.tolist()]
+
+    @property
+    def padding_efficiency(self) -> float:
+        """Returns the fraction of the padded bond index matrices of the next epoch's batches which holds bonds."""
+        return self._sampler.padding_efficiency()
 
     @property
     def iter_size(self) -> int:
@@ -741,8 +1760,22 @@ class MoleculeDataLoader(DataLoader):
 
     def __iter__(self) -> Iterator[MoleculeDataset]:
         r"""Creates an iterator which returns :class:`MoleculeDataset`\ s"""
+        if self._cache_batches:
+            return iter(self._batches) if self._batches is not None else self._collate_and_cache()
+
         return super(MoleculeDataLoader, self).__iter__()
 
+    def _collate_and_cache(self) -> Iterator[MoleculeDataset]:
+        r"""Iterates over newly built :class:`MoleculeDataset`\ s and keeps them once the pass is complete."""
+        batches = []
+        for batch in super(MoleculeDataLoader, self).__iter__():
+            batch.features_tensor()
+            batch.loss_tensors()
+            batches.append(batch)
+            yield batch
+
+        self._batches = batches
+
     
 def make_mols(smiles: List[str], reaction_list: List[bool], keep_h_list: List[bool], add_h_list: List[bool]):
     """
@@ -756,9 +1789,12 @@ def make_mols(smiles: List[str], reaction_list: List[bool], keep_h_list: List[bo
     """
     mol = []
     for s, reaction, keep_h, add_h in zip(smiles, reaction_list, keep_h_list, add_h_list):
-        if reaction:
-            mol.append(SMILES_TO_MOL[s] if s in SMILES_TO_MOL else (make_mol(s.split(">")[0], keep_h, add_h), make_mol(s.split(">")[-1], keep_h, add_h)))
-        else:
-            mol.append(SMILES_TO_MOL[s] if s in SMILES_TO_MOL else make_mol(s, keep_h, add_h))
+        m = SMILES_TO_MOL.get(s)
+        if m is None:
+            if reaction:
+                m = (make_mol(s.split(">")[0], keep_h, add_h), make_mol(s.split(">")[-1], keep_h, add_h))
+            else:
+                m = make_mol(s, keep_h, add_h)
+        mol.append(m)
     return mol
 
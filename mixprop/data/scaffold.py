@@ -124,11 +124,7 @@ def scaffold_split(data: MoleculeDataset,
         log_scaffold_stats(data, index_sets, logger=logger)
 
     # Map from indices to data
-    train = [data[i] for i in train]
-    val = [data[i] for i in val]
-    test = [data[i] for i in test]
-
-    return MoleculeDataset(train), MoleculeDataset(val), MoleculeDataset(test)
+    return data.subset(train), data.subset(val), data.subset(test)
 
 
 def log_scaffold_stats(data: MoleculeDataset,
@@ -155,8 +151,7 @@ def log_scaffold_stats(data: MoleculeDataset,
     stats = []
     index_sets = sorted(index_sets, key=lambda idx_set: len(idx_set), reverse=True)
     for scaffold_num, index_set in enumerate(index_sets[:num_scaffolds]):
-        data_set = [data[i] for i in index_set]
-        targets = np.array([d.targets for d in data_set], dtype=np.float)
+        targets = np.array(data.subset(list(index_set)).targets(), dtype=float)
 
         with warnings.catch_warnings():  # Likely warning of empty slice of target has no values besides NaN
             warnings.simplefilter('ignore', category=RuntimeWarning)
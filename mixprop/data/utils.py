@@ -8,9 +8,11 @@ import os
 
 from rdkit import Chem
 import numpy as np
+import pandas as pd
 from tqdm import tqdm
 
-from .data import MoleculeDatapoint, MoleculeDataset, make_mols
+from .binary_dataset import BinaryDataset, is_binary_dataset
+from .data import ColumnarMoleculeDataset, MoleculeDatapoint, MoleculeDataset, make_mols, precompute_features
 from .scaffold import log_scaffold_stats, scaffold_split
 from mixprop.args import PredictArgs, TrainArgs
 from mixprop.features import load_features, load_valid_atom_or_bond_features, is_mol
@@ -31,7 +33,7 @@ def preprocess_smiles_columns(path: str,
     """
 
     if smiles_columns is None:
-        if os.path.isfile(path):
+        if os.path.isfile(path) or is_binary_dataset(path):
             columns = get_header(path)
             smiles_columns = columns[:number_of_molecules]
         else:
@@ -39,7 +41,7 @@ def preprocess_smiles_columns(path: str,
     else:
         if not isinstance(smiles_columns,list):
             smiles_columns=[smiles_columns]
-        if os.path.isfile(path):
+        if os.path.isfile(path) or is_binary_dataset(path):
             columns = get_header(path)
             if len(smiles_columns) != number_of_molecules:
                 raise ValueError('Length of smiles_columns must match number_of_molecules.')
@@ -88,9 +90,12 @@ def get_header(path: str) -> List[str]:
     """
     Returns the header of a data CSV file.
 
-    :param path: Path to a CSV file.
+    :param path: Path to a CSV file or to a binary dataset, whose header is made of its SMILES and target columns.
     :return: A list of strings containing the strings in the comma-separated header.
     """
+    if is_binary_dataset(path):
+        return BinaryDataset(path).columns
+
     with open(path) as f:
         header = next(csv.reader(f))
 
@@ -139,6 +144,10 @@ def get_smiles(path: str,
     if not isinstance(smiles_columns, list):
         smiles_columns = preprocess_smiles_columns(path=path, smiles_columns=smiles_columns)
 
+    if is_binary_dataset(path):
+        smiles = BinaryDataset(path).smiles(smiles_columns)
+        return [smile for smiles_list in smiles for smile in smiles_list] if flatten else smiles
+
     with open(path) as f:
         if header:
             reader = csv.DictReader(f)
@@ -154,6 +163,86 @@ def get_smiles(path: str,
     return smiles
 
 
+def has_short_rows(path: str, num_fields: int) -> bool:
+    """
+    Checks whether any non-empty line of a CSV file has fewer fields than its header.
+
+    :param path: Path to a CSV file.
+    :param num_fields: The number of fields in the header.
+    :return: True if some row of the file is missing fields.
+    """
+    with open(path, 'rb') as f:
+        content = f.read()
+
+    # Quoted fields can contain delimiters and line breaks, so the rows have to be parsed
+    if b'"' in content:
+        with open(path, newline='') as f:
+            return any(0 < len(row) < num_fields for row in csv.reader(f))
+
+    chars = np.frombuffer(content + b'\n', dtype=np.uint8)
+    line_ends = np.flatnonzero(chars == ord('\n'))
+    num_delimiters = np.diff(np.searchsorted(np.flatnonzero(chars == ord(',')), line_ends), prepend=0)
+    line_lengths = np.diff(line_ends, prepend=-1) - 1
+    blank = (line_lengths == 0) | ((line_lengths == 1) & (chars[line_ends - 1] == ord('\r')))
+
+    return bool(np.any((num_delimiters < num_fields - 1) & ~blank))
+
+
+def read_csv_columns(path: str,
+                     smiles_columns: List[str],
+                     target_columns: List[str],
+                     store_row: bool = False) -> Optional[Tuple[List[List[str]], np.ndarray, np.ndarray, np.ndarray,
+                                                                 Optional[List[dict]]]]:
+    """
+    Reads the SMILES and target columns of a data CSV file in bulk.
+
+    Target values are parsed one column at a time rather than one row at a time, as in :func:`get_data`. Files
+    which cannot be parsed this way, such as files with duplicate column names, rows with missing or extra fields
+    or targets which are not numbers, are not read so that they can be read row by row instead.
+
+    :param path: Path to a CSV file.
+    :param smiles_columns: The names of the columns containing SMILES.
+    :param target_columns: The names of the columns containing target values.
+    :param store_row: Whether to return the raw CSV rows.
+    :return: A tuple containing the SMILES of each row, an object array of shape :code:`(num_rows, num_tasks)`
+             of the targets (None for unknown targets), boolean arrays of the same shape marking inequality targets
+             of the form ">x" and "<x", and the raw CSV rows if :code:`store_row` is True. None if the file could
+             not be read in bulk.
+    """
+    header = get_header(path)
+    if len(set(header)) != len(header) or has_short_rows(path, len(header)):
+        return None
+
+    try:
+        # Without a header, rows with extra fields are an error rather than index columns
+        table = pd.read_csv(path, header=None, dtype=str, keep_default_na=False)
+    except ValueError:
+        return None
+    if len(table) == 0 or table.iloc[0].tolist() != header:
+        return None
+    table = table.iloc[1:]
+    table.columns = header
+
+    num_rows = len(table)
+    targets = np.full((num_rows, len(target_columns)), None, dtype=object)
+    gt_targets = np.zeros((num_rows, len(target_columns)), dtype=bool)
+    lt_targets = np.zeros((num_rows, len(target_columns)), dtype=bool)
+    for i, column in enumerate(target_columns):
+        values = table[column]
+        gt_targets[:, i] = values.str.contains('>', regex=False)
+        lt_targets[:, i] = values.str.contains('<', regex=False)
+        known = ~values.isin(['', 'nan']).to_numpy()
+        try:
+            targets[known, i] = values[known].str.strip('<>').to_numpy(dtype=object).astype(np.float64)
+        except ValueError:
+            return None
+
+    smiles = table[smiles_columns].values.tolist()
+    rows = table.to_dict('records') if store_row else None
+
+    return smiles, targets, gt_targets, lt_targets, rows
+
+
 def filter_invalid_smiles(data: MoleculeDataset) -> MoleculeDataset:
     """
     Filters out invalid SMILES.
@@ -161,6 +250,14 @@ def filter_invalid_smiles(data: MoleculeDataset) -> MoleculeDataset:
     :param data: A :class:`~mixprop.data.MoleculeDataset`.
     :return: A :class:`~mixprop.data.MoleculeDataset` with only the valid molecules.
     """
+    if isinstance(data, ColumnarMoleculeDataset):
+        # Each unique molecule is checked once
+        valid = {s: s != '' and m is not None and (m[0].GetNumHeavyAtoms() + m[1].GetNumHeavyAtoms() > 0
+                                                    if isinstance(m, tuple) else m.GetNumHeavyAtoms() > 0)
+                 for s, m in zip(data.unique_smiles(), data.unique_mols())}
+
+        return data.subset([i for i, smiles in enumerate(data.smiles()) if all(valid[s] for s in smiles)])
+
     return MoleculeDataset([datapoint for datapoint in tqdm(data)
                             if all(s != '' for s in datapoint.smiles) and all(m is not None for m in datapoint.mol)
                             and all(m.GetNumHeavyAtoms() > 0 for m in datapoint.mol if not isinstance(m, tuple))
@@ -236,11 +333,12 @@ def get_data(path: str,
              store_row: bool = False,
              logger: Logger = None,
              loss_function: str = None,
-             skip_none_targets: bool = False) -> MoleculeDataset:
+             skip_none_targets: bool = False,
+             columnar: bool = None) -> MoleculeDataset:
     """
-    Gets SMILES and target values from a CSV file.
+    Gets SMILES and target values from a CSV file or from a binary dataset.
 
-    :param path: Path to a CSV file.
+    :param path: Path to a CSV file or to a binary dataset saved by :func:`~mixprop.data.save_binary_dataset`.
     :param smiles_columns: The names of the columns containing SMILES.
                            By default, uses the first :code:`number_of_molecules` columns.
     :param target_columns: Name of the columns containing target values. By default, uses all columns
@@ -249,7 +347,7 @@ def get_data(path: str,
     :param skip_invalid_smiles: Whether to skip and filter out invalid smiles using :func:`filter_invalid_smiles`.
     :param args: Arguments, either :class:`~mixprop.args.TrainArgs` or :class:`~mixprop.args.PredictArgs`.
     :param data_weights_path: A path to a file containing weights for each molecule in the loss function.
-    :param features_path: A list of paths to files containing features. If provided, it is used
+    :param features_path: A list of paths to files or binary datasets containing features. If provided, it is used
                           in place of :code:`args.features_path`.
     :param features_generator: A list of features generators to use. If provided, it is used
                                in place of :code:`args.features_generator`.
@@ -262,11 +360,16 @@ def get_data(path: str,
     :param skip_none_targets: Whether to skip targets that are all 'None'. This is mostly relevant when --target_columns
                               are passed in, so only a subset of tasks are examined.
     :param loss_function: The loss function to be used in training.
+    :param columnar: Whether to store the data in a :class:`~mixprop.data.ColumnarMoleculeDataset`. If provided,
+                     it is used in place of :code:`args.columnar_data`.
     :return: A :class:`~mixprop.data.MoleculeDataset` containing SMILES and target values along
              with other info such as additional features when desired.
     """
     debug = logger.debug if logger is not None else print
 
+    if columnar is None:
+        columnar = args.columnar_data if args is not None else False
+
     if args is not None:
         # Prefer explicit function arguments but default to args if not provided
         smiles_columns = smiles_columns if smiles_columns is not None else args.smiles_columns
@@ -287,11 +390,21 @@ def get_data(path: str,
 
     max_data_size = max_data_size or float('inf')
 
+    # Binary datasets are read as memory-mapped arrays instead of being parsed
+    binary = BinaryDataset(path) if is_binary_dataset(path) else None
+
     # Load features
     if features_path is not None:
         features_data = []
         for feat_path in features_path:
-            features_data.append(load_features(feat_path))  # each is num_data x num_features
+            # each is num_data x num_features
+            if is_binary_dataset(feat_path):
+                binary_features = BinaryDataset(feat_path).features
+                if binary_features is None:
+                    raise ValueError(f'The binary dataset {feat_path} given as a features path does not contain features.')
+                features_data.append(np.asarray(binary_features))
+            else:
+                features_data.append(load_features(feat_path))
         features_data = np.concatenate(features_data, axis=1)
     else:
         features_data = None
@@ -323,81 +436,159 @@ def get_data(path: str,
             ignore_columns=ignore_columns,
         )
 
+    # Columns of CSV files are parsed in bulk, unless the file is too irregular to be parsed that way
+    columns = read_csv_columns(path, smiles_columns, target_columns, store_row) if binary is None else None
+    if columns is not None:
+        csv_smiles, csv_targets, csv_gt_targets, csv_lt_targets, csv_rows = columns
+    if columns is not None and loss_function != 'bounded_mse' and (csv_gt_targets | csv_lt_targets).any():
+        raise ValueError('Inequality found in target data. To use inequality targets (> or <), the regression loss function bounded_mse must be used.')
+
     # Find targets provided as inequalities
     if loss_function == 'bounded_mse':
-        gt_targets, lt_targets = get_inequality_targets(path=path, target_columns=target_columns)
+        if binary is not None:
+            # Binary datasets only hold value targets
+            gt_targets = lt_targets = [[False] * len(target_columns)] * binary.num_rows
+        elif columns is not None:
+            if (csv_gt_targets & csv_lt_targets).any():
+                raise ValueError(f'A target value in csv file {path} contains both ">" and "<" symbols. Inequality targets must be on one edge and not express a range.')
+            gt_targets, lt_targets = csv_gt_targets.tolist(), csv_lt_targets.tolist()
+        else:
+            gt_targets, lt_targets = get_inequality_targets(path=path, target_columns=target_columns)
     else:
         gt_targets, lt_targets = None, None
 
     # Load data
-    with open(path) as f:
-        reader = csv.DictReader(f)
+    all_smiles, all_targets, all_rows, all_features, all_phase_features, all_weights, all_gt, all_lt = [], [], [], [], [], [], [], []
+    if binary is not None or columns is not None:
+        if binary is not None:
+            missing_columns = [c for c in target_columns if c not in binary.target_columns]
+            if len(missing_columns) > 0:
+                raise ValueError(f'Target columns {missing_columns} are not in binary dataset {path}.')
+
+            values = np.asarray(binary.targets)[:, [binary.target_columns.index(c) for c in target_columns]]
+            targets = np.where(np.isnan(values), None, values)
+        else:
+            targets = csv_targets
+
+        indices = np.arange(len(targets))
+        # Check whether all targets are None and skip if so
+        if skip_none_targets:
+            indices = indices[~np.all(np.equal(targets, None), axis=1)]
+        if len(indices) > max_data_size:
+            indices = indices[:int(max_data_size)]
+
+        all_targets = targets[indices].tolist()
+        if features_data is not None:
+            all_features = features_data[indices]
+        if phase_features is not None:
+            all_phase_features = phase_features[indices]
+        if data_weights is not None:
+            all_weights = [data_weights[i] for i in indices]
+        if gt_targets is not None:
+            all_gt = [gt_targets[i] for i in indices]
+        if lt_targets is not None:
+            all_lt = [lt_targets[i] for i in indices]
+
+        if binary is not None:
+            all_smiles = [[binary.smiles_table[j] for j in row] for row in
+                          binary.smiles_ids[indices][:, [binary.smiles_columns.index(c) for c in smiles_columns]].tolist()]
+            if store_row:
+                all_rows = [OrderedDict(zip(binary.columns, [binary.smiles_table[j] for j in row_ids]
+                                            + ['' if np.isnan(x) else x for x in row_targets]))
+                            for row_ids, row_targets in zip(binary.smiles_ids[indices].tolist(),
+                                                            binary.targets[indices].tolist())]
+        else:
+            all_smiles = [csv_smiles[i] for i in indices]
+            if store_row:
+                all_rows = [csv_rows[i] for i in indices]
+    else:
+        with open(path) as f:
+            reader = csv.DictReader(f)
 
-        all_smiles, all_targets, all_rows, all_features, all_phase_features, all_weights, all_gt, all_lt = [], [], [], [], [], [], [], []
-        for i, row in enumerate(tqdm(reader)):
-            smiles = [row[c] for c in smiles_columns]
-
-            targets = []
-            for column in target_columns:
-                value = row[column]
-                if value in ['','nan']:
-                    targets.append(None)
-                elif '>' in value or '<' in value:
-                    if loss_function == 'bounded_mse':
-                        targets.append(float(value.strip('<>')))
+            for i, row in enumerate(tqdm(reader)):
+                smiles = [row[c] for c in smiles_columns]
+
+                targets = []
+                for column in target_columns:
+                    value = row[column]
+                    if value in ['','nan']:
+                        targets.append(None)
+                    elif '>' in value or '<' in value:
+                        if loss_function == 'bounded_mse':
+                            targets.append(float(value.strip('<>')))
+                        else:
+                            raise ValueError('Inequality found in target data. To use inequality targets (> or <), the regression loss function bounded_mse must be used.')
                     else:
-                        raise ValueError('Inequality found in target data. To use inequality targets (> or <), the regression loss function bounded_mse must be used.')
-                else:
-                    targets.append(float(value))
+                        targets.append(float(value))
 
-            # Check whether all targets are None and skip if so
-            if skip_none_targets and all(x is None for x in targets):
-                continue
+                # Check whether all targets are None and skip if so
+                if skip_none_targets and all(x is None for x in targets):
+                    continue
 
-            all_smiles.append(smiles)
-            all_targets.append(targets)
+                all_smiles.append(smiles)
+                all_targets.append(targets)
 
-            if features_data is not None:
-                all_features.append(features_data[i])
-            
-            if phase_features is not None:
-                all_phase_features.append(phase_features[i])
+                if features_data is not None:
+                    all_features.append(features_data[i])
+                
+                if phase_features is not None:
+                    all_phase_features.append(phase_features[i])
 
-            if data_weights is not None:
-                all_weights.append(data_weights[i])
+                if data_weights is not None:
+                    all_weights.append(data_weights[i])
 
-            if gt_targets is not None:
-                all_gt.append(gt_targets[i])
+                if gt_targets is not None:
+                    all_gt.append(gt_targets[i])
 
-            if lt_targets is not None:
-                all_lt.append(lt_targets[i])
+                if lt_targets is not None:
+                    all_lt.append(lt_targets[i])
 
-            if store_row:
-                all_rows.append(row)
-
-            if len(all_smiles) >= max_data_size:
-                break
-
-        atom_features = None
-        atom_descriptors = None
-        if args is not None and args.atom_descriptors is not None:
-            try:
-                descriptors = load_valid_atom_or_bond_features(atom_descriptors_path, [x[0] for x in all_smiles])
-            except Exception as e:
-                raise ValueError(f'Failed to load or validate custom atomic descriptors or features: {e}')
-
-            if args.atom_descriptors == 'feature':
-                atom_features = descriptors
-            elif args.atom_descriptors == 'descriptor':
-                atom_descriptors = descriptors
-
-        bond_features = None
-        if args is not None and args.bond_features_path is not None:
-            try:
-                bond_features = load_valid_atom_or_bond_features(bond_features_path, [x[0] for x in all_smiles])
-            except Exception as e:
-                raise ValueError(f'Failed to load or validate custom bond features: {e}')
+                if store_row:
+                    all_rows.append(row)
+
+                if len(all_smiles) >= max_data_size:
+                    break
 
+    atom_features = None
+    atom_descriptors = None
+    if args is not None and args.atom_descriptors is not None:
+        try:
+            descriptors = load_valid_atom_or_bond_features(atom_descriptors_path, [x[0] for x in all_smiles])
+        except Exception as e:
+            raise ValueError(f'Failed to load or validate custom atomic descriptors or features: {e}')
+
+        if args.atom_descriptors == 'feature':
+            atom_features = descriptors
+        elif args.atom_descriptors == 'descriptor':
+            atom_descriptors = descriptors
+
+    bond_features = None
+    if args is not None and args.bond_features_path is not None:
+        try:
+            bond_features = load_valid_atom_or_bond_features(bond_features_path, [x[0] for x in all_smiles])
+        except Exception as e:
+            raise ValueError(f'Failed to load or validate custom bond features: {e}')
+
+    if features_generator is not None:
+        precompute_features([s for smiles in all_smiles for s in smiles], features_generator,
+                            num_workers=args.featurization_workers if args is not None else 0,
+                            chunk_size=args.featurization_chunk_size if args is not None else 1000)
+
+    if columnar:
+        if store_row or atom_features is not None or atom_descriptors is not None or bond_features is not None:
+            raise ValueError('Columnar datasets cannot store CSV rows, atom descriptors or atom and bond features.')
+
+        data = ColumnarMoleculeDataset.from_lists(
+            smiles=all_smiles,
+            targets=all_targets,
+            features=np.array(all_features) if features_data is not None else None,
+            features_generator=features_generator,
+            phase_features=np.array(all_phase_features) if phase_features is not None else None,
+            data_weights=all_weights if data_weights is not None else None,
+            gt_targets=all_gt if gt_targets is not None else None,
+            lt_targets=all_lt if lt_targets is not None else None
+        )
+    else:
         data = MoleculeDataset([
             MoleculeDatapoint(
                 smiles=smiles,
@@ -444,6 +635,9 @@ def get_data_from_smiles(smiles: List[List[str]],
     """
     debug = logger.debug if logger is not None else print
 
+    if features_generator is not None:
+        precompute_features([s for smile in smiles for s in smile], features_generator)
+
     data = MoleculeDataset([
         MoleculeDatapoint(
             smiles=smile,
@@ -528,9 +722,9 @@ def split_data(data: MoleculeDataset,
             for index in index_set[split]:
                 with open(os.path.join(args.crossval_index_dir, f'{index}.pkl'), 'rb') as rf:
                     split_indices.extend(pickle.load(rf))
-            data_split.append([data[i] for i in split_indices])
+            data_split.append(split_indices)
         train, val, test = tuple(data_split)
-        return MoleculeDataset(train), MoleculeDataset(val), MoleculeDataset(test)
+        return data.subset(train), data.subset(val), data.subset(test)
 
     elif split_type in {'cv', 'cv-no-test'}:
         if num_folds <= 1 or num_folds > len(data):
@@ -544,15 +738,15 @@ def split_data(data: MoleculeDataset,
         val_index = (seed + 1) % num_folds
 
         train, val, test = [], [], []
-        for d, index in zip(data, indices):
+        for i, index in enumerate(indices):
             if index == test_index and split_type != 'cv-no-test':
-                test.append(d)
+                test.append(i)
             elif index == val_index:
-                val.append(d)
+                val.append(i)
             else:
-                train.append(d)
+                train.append(i)
 
-        return MoleculeDataset(train), MoleculeDataset(val), MoleculeDataset(test)
+        return data.subset(train), data.subset(val), data.subset(test)
 
     elif split_type == 'index_predetermined':
         split_indices = args.crossval_index_sets[args.seed]
@@ -562,9 +756,9 @@ def split_data(data: MoleculeDataset,
 
         data_split = []
         for split in range(3):
-            data_split.append([data[i] for i in split_indices[split]])
+            data_split.append(split_indices[split])
         train, val, test = tuple(data_split)
-        return MoleculeDataset(train), MoleculeDataset(val), MoleculeDataset(test)
+        return data.subset(train), data.subset(val), data.subset(test)
 
     elif split_type == 'predetermined':
         if not val_fold_index and sizes[2] != 0:
@@ -585,7 +779,7 @@ def split_data(data: MoleculeDataset,
 
         log_scaffold_stats(data, all_fold_indices, logger=logger)
 
-        folds = [[data[i] for i in fold_indices] for fold_indices in all_fold_indices]
+        folds = [list(fold_indices) for fold_indices in all_fold_indices]
 
         test = folds[test_fold_index]
         if val_fold_index is not None:
@@ -604,7 +798,7 @@ def split_data(data: MoleculeDataset,
             train = train_val[:train_size]
             val = train_val[train_size:]
 
-        return MoleculeDataset(train), MoleculeDataset(val), MoleculeDataset(test)
+        return data.subset(train), data.subset(val), data.subset(test)
 
     elif split_type == 'scaffold_balanced':
         return scaffold_split(data, sizes=sizes, balanced=True, key_molecule_index=key_molecule_index, seed=seed, logger=logger)
@@ -626,11 +820,8 @@ def split_data(data: MoleculeDataset,
                 val += index_set
             else:
                 test += index_set
-        train = [data[i] for i in train]
-        val = [data[i] for i in val]
-        test = [data[i] for i in test]
 
-        return MoleculeDataset(train), MoleculeDataset(val), MoleculeDataset(test)
+        return data.subset(train), data.subset(val), data.subset(test)
 
     elif split_type == 'random':
         indices = list(range(len(data)))
@@ -639,11 +830,11 @@ def split_data(data: MoleculeDataset,
         train_size = int(sizes[0] * len(data))
         train_val_size = int((sizes[0] + sizes[1]) * len(data))
 
-        train = [data[i] for i in indices[:train_size]]
-        val = [data[i] for i in indices[train_size:train_val_size]]
-        test = [data[i] for i in indices[train_val_size:]]
+        train = indices[:train_size]
+        val = indices[train_size:train_val_size]
+        test = indices[train_val_size:]
 
-        return MoleculeDataset(train), MoleculeDataset(val), MoleculeDataset(test)
+        return data.subset(train), data.subset(val), data.subset(test)
 
     else:
         raise ValueError(f'split_type "{split_type}" not supported.')
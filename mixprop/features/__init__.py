@@ -1,12 +1,15 @@
-from .features_generators import get_available_features_generators, get_features_generator, \
+from .features_generators import generate_features, get_available_features_generators, get_features_generator, \
     morgan_binary_features_generator, morgan_counts_features_generator, rdkit_2d_features_generator, \
     rdkit_2d_normalized_features_generator, register_features_generator
 from .featurization import atom_features, bond_features, BatchMolGraph, get_atom_fdim, get_bond_fdim, mol2graph, \
     MolGraph, onek_encoding_unk, set_extra_atom_fdim, set_extra_bond_fdim, set_reaction, set_explicit_h, \
     set_adding_hs, is_reaction, is_explicit_h, is_adding_hs, is_mol, reset_featurization_parameters
+from .features_store import features_generator_hash, FeaturesStore
+from .graph_store import GraphStore
 from .utils import load_features, save_features, load_valid_atom_or_bond_features
 
 __all__ = [
+    'generate_features',
     'get_available_features_generators',
     'get_features_generator',
     'morgan_binary_features_generator',
@@ -29,6 +32,9 @@ __all__ = [
     'is_mol',
     'mol2graph',
     'MolGraph',
+    'features_generator_hash',
+    'FeaturesStore',
+    'GraphStore',
     'onek_encoding_unk',
     'load_features',
     'save_features',
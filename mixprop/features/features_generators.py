@@ -45,6 +45,31 @@ def get_available_features_generators() -> List[str]:
     return list(FEATURES_GENERATOR_REGISTRY.keys())
 
 
+# Number of features of each features generator, measured on methane
+FEATURES_GENERATOR_SIZES = {}
+
+
+def generate_features(features_generator_name: str, mol: Chem.Mol) -> np.ndarray:
+    """
+    Generates the features of a molecule with a registered features generator.
+
+    Molecules without heavy atoms (e.g. H2) cannot be featurized by all generators, so they get a vector of zeros
+    of the length of the features of methane.
+
+    :param features_generator_name: The name of the features generator.
+    :param mol: An RDKit molecule.
+    :return: A 1D float64 numpy array containing the features.
+    """
+    features_generator = get_features_generator(features_generator_name)
+    if mol.GetNumHeavyAtoms() > 0:
+        return np.asarray(features_generator(mol), dtype=np.float64)
+
+    if features_generator_name not in FEATURES_GENERATOR_SIZES:
+        FEATURES_GENERATOR_SIZES[features_generator_name] = len(features_generator(Chem.MolFromSmiles('C')))
+
+    return np.zeros(FEATURES_GENERATOR_SIZES[features_generator_name])
+
+
 MORGAN_RADIUS = 2
 MORGAN_NUM_BITS = 2048
 
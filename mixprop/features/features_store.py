@@ -0,0 +1,144 @@
+import hashlib
+import inspect
+import os
+from typing import Dict, List
+
+import numpy as np
+import rdkit
+
+from .features_generators import get_features_generator
+from .graph_store import store_lock
+
+# Size of the header of the features file, which holds the number of features per row
+HEADER_BYTES = 8
+
+
+def features_generator_hash(features_generator_name: str) -> str:
+    """
+    Computes a hash of a features generator and its parameters.
+
+    :param features_generator_name: The name of a registered features generator.
+    :return: A hex digest of the name, the default parameters of the generator and the RDKit version.
+    """
+    signature = inspect.signature(get_features_generator(features_generator_name))
+    params = [(name, repr(param.default)) for name, param in signature.parameters.items()
+              if param.default is not inspect.Parameter.empty]
+
+    return hashlib.sha1(repr((features_generator_name, params, rdkit.__version__)).encode()).hexdigest()
+
+
+class FeaturesStore:
+    """
+    A :class:`FeaturesStore` holds the output of a single features generator for many molecules in an
+    append-only, memory-mapped file of float64 rows together with a text file listing the canonical SMILES
+    of each row. The file starts with the number of features per row, which is set by the first write.
+
+    Writes hold a lock on the directory and read the rows appended by other writers first, so several
+    stores, threads and processes can share a directory.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: Directory in which the features are stored.
+        """
+        self.path = path
+        self.features_path = os.path.join(path, 'features.bin')
+        self.smiles_path = os.path.join(path, 'smiles.txt')
+        os.makedirs(path, exist_ok=True)
+
+        self.index: Dict[str, int] = {}
+        self.num_features = None
+        self.num_rows = 0
+        self.smiles_offset = 0
+        self.features = None
+        with store_lock(path):
+            self._sync()
+
+    def _sync(self) -> None:
+        # Reads the SMILES appended since the last call. Rows are written before their SMILES, so an interrupted
+        # write leaves a partial header, extra rows or a partial line of SMILES, which are discarded. Only called
+        # with the lock held, so that the rows of an active writer are never discarded.
+        size = os.path.getsize(self.features_path) if os.path.exists(self.features_path) else 0
+        if self.num_features is None and size >= HEADER_BYTES:
+            with open(self.features_path, 'rb') as f:
+                self.num_features = int(np.frombuffer(f.read(HEADER_BYTES), dtype=np.int64)[0])
+        data_rows = (size - HEADER_BYTES) // (8 * self.num_features) if self.num_features else 0
+
+        with open(self.smiles_path, 'ab+') as f:
+            f.seek(self.smiles_offset)
+            # The last element is a partial line, or empty if the file ends with a complete line
+            lines = f.read().split(b'\n')[:-1][:max(data_rows - self.num_rows, 0)]
+            self.smiles_offset += sum(len(line) + 1 for line in lines)
+            if f.tell() != self.smiles_offset:
+                f.truncate(self.smiles_offset)
+
+        added = {}
+        for i, line in enumerate(lines):
+            smi = line.decode('utf-8').rstrip('\r')
+            if smi not in self.index and smi not in added:
+                added[smi] = self.num_rows + i
+        self.num_rows += len(lines)
+        expected_size = HEADER_BYTES + 8 * self.num_features * self.num_rows if self.num_features is not None else 0
+        if size != expected_size:
+            os.truncate(self.features_path, expected_size)
+
+        # The rows are mapped before they are indexed, so that concurrent lookups only see mapped rows
+        self._open()
+        self.index.update(added)
+
+    def _open(self) -> None:
+        if self.num_rows > 0:
+            self.features = np.memmap(self.features_path, dtype=np.float64, mode='r', offset=HEADER_BYTES,
+                                      shape=(self.num_rows, self.num_features))
+        else:
+            self.features = None
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, smiles: str) -> bool:
+        return smiles in self.index
+
+    def get(self, smiles: str) -> np.ndarray:
+        """
+        Looks up the features of a molecule.
+
+        :param smiles: A canonical SMILES string.
+        :return: The features of the molecule, or None if it is not stored.
+        """
+        row = self.index.get(smiles)
+        if row is None:
+            return None
+
+        return np.array(self.features[row])
+
+    def add(self, smiles: List[str], features: List[np.ndarray]) -> None:
+        """
+        Appends features to the store, skipping molecules which are already stored by any writer.
+
+        :param smiles: A list of canonical SMILES strings.
+        :param features: The features of each molecule, all of the same length.
+        """
+        with store_lock(self.path):
+            self._sync()
+            new = {}
+            for smi, f in zip(smiles, features):
+                if smi not in self.index and smi not in new:
+                    new[smi] = f
+            if len(new) == 0:
+                return
+
+            rows = np.ascontiguousarray(np.stack(list(new.values())), dtype=np.float64)
+            if self.num_features is not None and rows.shape[1] != self.num_features:
+                raise ValueError(f'Features of length {rows.shape[1]} cannot be added to a store of features '
+                                 f'of length {self.num_features}.')
+
+            # The header is written with the first rows, so the number of features is set once
+            header = np.array([rows.shape[1]], dtype=np.int64).tobytes() if self.num_features is None else b''
+            with open(self.features_path, 'ab') as f:
+                f.write(header + rows.tobytes())
+            with open(self.smiles_path, 'ab') as f:
+                f.write(''.join(smi + '\n' for smi in new).encode('utf-8'))
+
+            # The new rows are indexed from the sizes of the files, after any rows appended by other writers
+            self._sync()
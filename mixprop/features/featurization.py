@@ -1,6 +1,8 @@
-from typing import List, Tuple, Union
+from typing import Any, Callable, Iterator, List, Optional, Tuple, Union
+import copy
 from itertools import zip_longest
 import logging
+from multiprocessing import Pool
 
 from rdkit import Chem
 import torch
@@ -64,6 +66,16 @@ def reset_featurization_parameters(logger: logging.Logger = None) -> None:
     PARAMS = Featurization_parameters()
 
 
+def set_featurization_parameters(params: Featurization_parameters) -> None:
+    """
+    Replaces the featurization parameters, e.g. to pass the parameters of the main process to a worker process.
+
+    :param params: A :class:`Featurization_parameters` object.
+    """
+    global PARAMS
+    PARAMS = params
+
+
 def get_atom_fdim(overwrite_default_atom: bool = False, is_reaction: bool = False) -> int:
     """
     Gets the dimensionality of the atom feature vector.
@@ -250,6 +262,20 @@ def bond_features(bond: Chem.rdchem.Bond) -> List[Union[bool, int, float]]:
     return fbond
 
 
+def feature_array(features: List[List[Union[bool, int, float]]], fdim: int) -> np.ndarray:
+    """
+    Converts a list of feature vectors to a float32 array.
+
+    :param features: A list of feature vectors of length :code:`fdim`.
+    :param fdim: The dimensionality of the feature vectors, used to shape empty arrays.
+    :return: A numpy array of shape :code:`(len(features), fdim)`.
+    """
+    if len(features) == 0:
+        return np.zeros((0, fdim), dtype=np.float32)
+
+    return np.array(features, dtype=np.float32)
+
+
 def map_reac_to_prod(mol_reac: Chem.Mol, mol_prod: Chem.Mol):
     """
     Build a dictionary of mapping atom indices in the reactants to the products.
@@ -291,11 +317,13 @@ class MolGraph:
 
     * :code:`n_atoms`: The number of atoms in the molecule.
     * :code:`n_bonds`: The number of bonds in the molecule.
-    * :code:`f_atoms`: A mapping from an atom index to a list of atom features.
-    * :code:`f_bonds`: A mapping from a bond index to a list of bond features.
-    * :code:`a2b`: A mapping from an atom index to a list of incoming bond indices.
-    * :code:`b2a`: A mapping from a bond index to the index of the atom the bond originates from.
-    * :code:`b2revb`: A mapping from a bond index to the index of the reverse bond.
+    * :code:`f_atoms`: A numpy array of shape :code:`(n_atoms, atom_fdim)` containing the atom features.
+    * :code:`f_bonds`: A numpy array of shape :code:`(n_bonds, bond_fdim)` containing the bond features.
+    * :code:`a2b_offsets`: A numpy array of shape :code:`(n_atoms + 1,)` such that the incoming bonds of atom
+      :code:`a` are :code:`a2b_indices[a2b_offsets[a]:a2b_offsets[a + 1]]` (CSR format).
+    * :code:`a2b_indices`: A numpy array of shape :code:`(n_bonds,)` containing the incoming bond indices of each atom.
+    * :code:`b2a`: A numpy array mapping a bond index to the index of the atom the bond originates from.
+    * :code:`b2revb`: A numpy array mapping a bond index to the index of the reverse bond.
     * :code:`overwrite_default_atom_features`: A boolean to overwrite default atom descriptors.
     * :code:`overwrite_default_bond_features`: A boolean to overwrite default bond descriptors.
     * :code:`is_mol`: A boolean whether the input is a molecule.
@@ -332,66 +360,50 @@ class MolGraph:
 
         self.n_atoms = 0  # number of atoms
         self.n_bonds = 0  # number of bonds
-        self.f_atoms = []  # mapping from atom index to atom features
-        self.f_bonds = []  # mapping from bond index to concat(in_atom, bond) features
-        self.a2b = []  # mapping from atom index to incoming bond indices
-        self.b2a = []  # mapping from bond index to the index of the atom the bond is coming from
-        self.b2revb = []  # mapping from bond index to the index of the reverse bond
         self.overwrite_default_atom_features = overwrite_default_atom_features
         self.overwrite_default_bond_features = overwrite_default_bond_features
 
-
         if not self.is_reaction:
             # Get atom features
-            self.f_atoms = [atom_features(atom) for atom in mol.GetAtoms()]
+            f_atoms = feature_array([atom_features(atom) for atom in mol.GetAtoms()], PARAMS.ATOM_FDIM)
             if atom_features_extra is not None:
+                if len(atom_features_extra) != len(f_atoms):
+                    raise ValueError(f'The number of atoms in {Chem.MolToSmiles(mol)} is different from the length of '
+                                     f'the extra atom features')
+                atom_features_extra = np.asarray(atom_features_extra, dtype=np.float32)
                 if overwrite_default_atom_features:
-                    self.f_atoms = [descs.tolist() for descs in atom_features_extra]
+                    f_atoms = atom_features_extra
                 else:
-                    self.f_atoms = [f_atoms + descs.tolist() for f_atoms, descs in zip(self.f_atoms, atom_features_extra)]
-
-            self.n_atoms = len(self.f_atoms)
-            if atom_features_extra is not None and len(atom_features_extra) != self.n_atoms:
-                raise ValueError(f'The number of atoms in {Chem.MolToSmiles(mol)} is different from the length of '
-                                 f'the extra atom features')
-
-            # Initialize atom to bond mapping for each atom
-            for _ in range(self.n_atoms):
-                self.a2b.append([])
-
-            # Get bond features
-            for a1 in range(self.n_atoms):
-                for a2 in range(a1 + 1, self.n_atoms):
-                    bond = mol.GetBondBetweenAtoms(a1, a2)
-
-                    if bond is None:
-                        continue
-
-                    f_bond = bond_features(bond)
-                    if bond_features_extra is not None:
-                        descr = bond_features_extra[bond.GetIdx()].tolist()
-                        if overwrite_default_bond_features:
-                            f_bond = descr
-                        else:
-                            f_bond += descr
-
-                    self.f_bonds.append(self.f_atoms[a1] + f_bond)
-                    self.f_bonds.append(self.f_atoms[a2] + f_bond)
+                    f_atoms = np.concatenate((f_atoms, atom_features_extra), axis=1)
+            self.n_atoms = len(f_atoms)
 
-                    # Update index mappings
-                    b1 = self.n_bonds
-                    b2 = b1 + 1
-                    self.a2b[a2].append(b1)  # b1 = a1 --> a2
-                    self.b2a.append(a1)
-                    self.a2b[a1].append(b2)  # b2 = a2 --> a1
-                    self.b2a.append(a2)
-                    self.b2revb.append(b2)
-                    self.b2revb.append(b1)
-                    self.n_bonds += 2
-
-            if bond_features_extra is not None and len(bond_features_extra) != self.n_bonds / 2:
+            # Enumerate bonds ordered by their (lower, higher) atom indices
+            bonds = sorted(mol.GetBonds(), key=lambda bond: sorted((bond.GetBeginAtomIdx(), bond.GetEndAtomIdx())))
+            if bond_features_extra is not None and len(bond_features_extra) != len(bonds):
                 raise ValueError(f'The number of bonds in {Chem.MolToSmiles(mol)} is different from the length of '
                                  f'the extra bond features')
+            a1 = np.array([min(bond.GetBeginAtomIdx(), bond.GetEndAtomIdx()) for bond in bonds], dtype=np.int64)
+            a2 = np.array([max(bond.GetBeginAtomIdx(), bond.GetEndAtomIdx()) for bond in bonds], dtype=np.int64)
+
+            # Get bond features
+            f_bond = feature_array([bond_features(bond) for bond in bonds], PARAMS.BOND_FDIM)
+            if bond_features_extra is not None:
+                bond_features_extra = np.asarray(bond_features_extra, dtype=np.float32)
+                descr = bond_features_extra[[bond.GetIdx() for bond in bonds]]
+                if overwrite_default_bond_features:
+                    f_bond = descr
+                else:
+                    f_bond = np.concatenate((f_bond, descr), axis=1)
+
+            # Bond 2i = a1 --> a2 and bond 2i + 1 = a2 --> a1, each featurized as concat(in_atom, bond)
+            self.n_bonds = 2 * len(bonds)
+            self.f_bonds = np.empty((self.n_bonds, f_atoms.shape[1] + f_bond.shape[1]), dtype=np.float32)
+            self.f_bonds[0::2, :f_atoms.shape[1]] = f_atoms[a1]
+            self.f_bonds[1::2, :f_atoms.shape[1]] = f_atoms[a2]
+            self.f_bonds[:, f_atoms.shape[1]:] = np.repeat(f_bond, 2, axis=0)
+            self.f_atoms = f_atoms
+            self.b2a = np.stack((a1, a2), axis=1).reshape(-1)
+            self.b2revb = np.arange(self.n_bonds, dtype=np.int64) ^ 1
 
         else: # Reaction mode
             if atom_features_extra is not None:
@@ -424,17 +436,15 @@ class MolGraph:
             if self.reaction_mode in ['reac_diff', 'prod_diff', 'reac_diff_balance', 'prod_diff_balance']:
                 f_atoms_diff = [list(map(lambda x, y: x - y, ii, jj)) for ii, jj in zip(f_atoms_prod, f_atoms_reac)]
             if self.reaction_mode in ['reac_prod', 'reac_prod_balance']:
-                self.f_atoms = [x+y[PARAMS.MAX_ATOMIC_NUM+1:] for x,y in zip(f_atoms_reac, f_atoms_prod)]
+                f_atoms = [x+y[PARAMS.MAX_ATOMIC_NUM+1:] for x,y in zip(f_atoms_reac, f_atoms_prod)]
             elif self.reaction_mode in ['reac_diff', 'reac_diff_balance']:
-                self.f_atoms = [x+y[PARAMS.MAX_ATOMIC_NUM+1:] for x,y in zip(f_atoms_reac, f_atoms_diff)]
+                f_atoms = [x+y[PARAMS.MAX_ATOMIC_NUM+1:] for x,y in zip(f_atoms_reac, f_atoms_diff)]
             elif self.reaction_mode in ['prod_diff', 'prod_diff_balance']:
-                self.f_atoms = [x+y[PARAMS.MAX_ATOMIC_NUM+1:] for x,y in zip(f_atoms_prod, f_atoms_diff)]
-            self.n_atoms = len(self.f_atoms)
+                f_atoms = [x+y[PARAMS.MAX_ATOMIC_NUM+1:] for x,y in zip(f_atoms_prod, f_atoms_diff)]
+            self.n_atoms = len(f_atoms)
             n_atoms_reac = mol_reac.GetNumAtoms()
 
-            # Initialize atom to bond mapping for each atom
-            for _ in range(self.n_atoms):
-                self.a2b.append([])
+            f_bonds, b2a, b2revb = [], [], []
 
             # Get bond features
             for a1 in range(self.n_atoms):
@@ -477,19 +487,78 @@ class MolGraph:
                         f_bond = f_bond_reac + f_bond_diff
                     elif self.reaction_mode in ['prod_diff', 'prod_diff_balance']:
                         f_bond = f_bond_prod + f_bond_diff
-                    self.f_bonds.append(self.f_atoms[a1] + f_bond)
-                    self.f_bonds.append(self.f_atoms[a2] + f_bond)
+                    f_bonds.append(f_atoms[a1] + f_bond)
+                    f_bonds.append(f_atoms[a2] + f_bond)
 
                     # Update index mappings
                     b1 = self.n_bonds
                     b2 = b1 + 1
-                    self.a2b[a2].append(b1)  # b1 = a1 --> a2
-                    self.b2a.append(a1)
-                    self.a2b[a1].append(b2)  # b2 = a2 --> a1
-                    self.b2a.append(a2)
-                    self.b2revb.append(b2)
-                    self.b2revb.append(b1)
-                    self.n_bonds += 2                
+                    b2a.append(a1)  # b1 = a1 --> a2
+                    b2a.append(a2)  # b2 = a2 --> a1
+                    b2revb.append(b2)
+                    b2revb.append(b1)
+                    self.n_bonds += 2
+
+            self.f_atoms = feature_array(f_atoms, get_atom_fdim(is_reaction=True))
+            self.f_bonds = feature_array(f_bonds, get_bond_fdim(is_reaction=True))
+            self.b2a = np.array(b2a, dtype=np.int64)
+            self.b2revb = np.array(b2revb, dtype=np.int64)
+
+        # Group the incoming bonds of each atom in CSR format, keeping bonds in increasing index order
+        b2target = self.b2a[self.b2revb]  # bond a1 --> a2 points to the atom its reverse bond originates from
+        self.a2b_indices = np.argsort(b2target, kind='stable')
+        self.a2b_offsets = np.zeros(self.n_atoms + 1, dtype=np.int64)
+        np.cumsum(np.bincount(b2target, minlength=self.n_atoms), out=self.a2b_offsets[1:])
+
+    @classmethod
+    def from_arrays(cls,
+                    f_atoms: np.ndarray,
+                    f_bonds: np.ndarray,
+                    a2b_offsets: np.ndarray,
+                    a2b_indices: np.ndarray,
+                    b2a: np.ndarray,
+                    b2revb: np.ndarray) -> 'MolGraph':
+        """
+        Builds a :class:`MolGraph` of a molecule (not a reaction) with default features from precomputed arrays.
+
+        :param f_atoms: A numpy array of shape :code:`(n_atoms, atom_fdim)` containing the atom features.
+        :param f_bonds: A numpy array of shape :code:`(n_bonds, bond_fdim)` containing the bond features.
+        :param a2b_offsets: A numpy array of shape :code:`(n_atoms + 1,)` containing the CSR offsets of :code:`a2b_indices`.
+        :param a2b_indices: A numpy array of shape :code:`(n_bonds,)` containing the incoming bond indices of each atom.
+        :param b2a: A numpy array mapping a bond index to the index of the atom the bond originates from.
+        :param b2revb: A numpy array mapping a bond index to the index of the reverse bond.
+        :return: A :class:`MolGraph` holding the given arrays.
+        """
+        mol_graph = cls.__new__(cls)
+        mol_graph.is_mol = True
+        mol_graph.is_reaction = False
+        mol_graph.is_explicit_h = is_explicit_h(True)
+        mol_graph.is_adding_hs = is_adding_hs(True)
+        mol_graph.reaction_mode = reaction_mode()
+        mol_graph.overwrite_default_atom_features = False
+        mol_graph.overwrite_default_bond_features = False
+        mol_graph.n_atoms = len(f_atoms)
+        mol_graph.n_bonds = len(f_bonds)
+        mol_graph.f_atoms = f_atoms
+        mol_graph.f_bonds = f_bonds
+        mol_graph.a2b_offsets = a2b_offsets
+        mol_graph.a2b_indices = a2b_indices
+        mol_graph.b2a = b2a
+        mol_graph.b2revb = b2revb
+
+        return mol_graph
+
+    @property
+    def a2b(self) -> List[np.ndarray]:
+        """A mapping from an atom index to an array of incoming bond indices."""
+        return np.split(self.a2b_indices, self.a2b_offsets[1:-1])
+
+    @property
+    def nbytes(self) -> int:
+        """The memory used by the arrays of the graph in bytes."""
+        return sum(array.nbytes for array in [self.f_atoms, self.f_bonds, self.a2b_offsets,
+                                              self.a2b_indices, self.b2a, self.b2revb])
+
 
 class BatchMolGraph:
     """
@@ -504,59 +573,67 @@ class BatchMolGraph:
     * :code:`max_num_bonds`: The maximum number of bonds neighboring an atom in this batch.
     * :code:`b2b`: (Optional) A mapping from a bond index to incoming bond indices.
     * :code:`a2a`: (Optional): A mapping from an atom index to neighboring atom indices.
+    * :code:`mol_index`: (Optional): A mapping from each molecule of the batch to the index of its graph, used when
+      several molecules of the batch share a graph so that it is only encoded once.
     """
 
-    def __init__(self, mol_graphs: List[MolGraph]):
+    def __init__(self, mol_graphs: List[MolGraph], mol_index: np.ndarray = None):
         r"""
         :param mol_graphs: A list of :class:`MolGraph`\ s from which to construct the :class:`BatchMolGraph`.
+        :param mol_index: For each molecule of the batch, the index of its graph in :code:`mol_graphs`.
+                          If None, :code:`mol_graphs` contains one graph per molecule.
         """
-        self.overwrite_default_atom_features = mol_graphs[0].overwrite_default_atom_features
-        self.overwrite_default_bond_features = mol_graphs[0].overwrite_default_bond_features
-        self.is_reaction = mol_graphs[0].is_reaction
+        # An empty batch only holds the padding atom and bond
+        self.overwrite_default_atom_features = len(mol_graphs) > 0 and mol_graphs[0].overwrite_default_atom_features
+        self.overwrite_default_bond_features = len(mol_graphs) > 0 and mol_graphs[0].overwrite_default_bond_features
+        self.is_reaction = len(mol_graphs) > 0 and mol_graphs[0].is_reaction
         self.atom_fdim = get_atom_fdim(overwrite_default_atom=self.overwrite_default_atom_features,
                                        is_reaction=self.is_reaction)
         self.bond_fdim = get_bond_fdim(overwrite_default_bond=self.overwrite_default_bond_features,
                                       overwrite_default_atom=self.overwrite_default_atom_features,
                                       is_reaction=self.is_reaction)
 
-        # Start n_atoms and n_bonds at 1 b/c zero padding
-        self.n_atoms = 1  # number of atoms (start at 1 b/c need index 0 as padding)
-        self.n_bonds = 1  # number of bonds (start at 1 b/c need index 0 as padding)
-        self.a_scope = []  # list of tuples indicating (start_atom_index, num_atoms) for each molecule
-        self.b_scope = []  # list of tuples indicating (start_bond_index, num_bonds) for each molecule
+        n_atoms = np.array([mol_graph.n_atoms for mol_graph in mol_graphs], dtype=np.int64)
+        n_bonds = np.array([mol_graph.n_bonds for mol_graph in mol_graphs], dtype=np.int64)
+
+        # Start n_atoms and n_bonds at 1 b/c need index 0 as padding
+        atom_starts = 1 + np.cumsum(n_atoms) - n_atoms
+        bond_starts = 1 + np.cumsum(n_bonds) - n_bonds
+        self.n_atoms = 1 + int(n_atoms.sum())  # number of atoms
+        self.n_bonds = 1 + int(n_bonds.sum())  # number of bonds
+        self.a_scope = list(zip(atom_starts.tolist(), n_atoms.tolist()))  # (start_atom_index, num_atoms) for each molecule
+        self.b_scope = list(zip(bond_starts.tolist(), n_bonds.tolist()))  # (start_bond_index, num_bonds) for each molecule
 
         # All start with zero padding so that indexing with zero padding returns zeros
-        f_atoms = [[0] * self.atom_fdim]  # atom features
-        f_bonds = [[0] * self.bond_fdim]  # combined atom/bond features
-        a2b = [[]]  # mapping from atom index to incoming bond indices
-        b2a = [0]  # mapping from bond index to the index of the atom the bond is coming from
-        b2revb = [0]  # mapping from bond index to the index of the reverse bond
-        for mol_graph in mol_graphs:
-            f_atoms.extend(mol_graph.f_atoms)
-            f_bonds.extend(mol_graph.f_bonds)
-
-            for a in range(mol_graph.n_atoms):
-                a2b.append([b + self.n_bonds for b in mol_graph.a2b[a]])
-
-            for b in range(mol_graph.n_bonds):
-                b2a.append(self.n_atoms + mol_graph.b2a[b])
-                b2revb.append(self.n_bonds + mol_graph.b2revb[b])
-
-            self.a_scope.append((self.n_atoms, mol_graph.n_atoms))
-            self.b_scope.append((self.n_bonds, mol_graph.n_bonds))
-            self.n_atoms += mol_graph.n_atoms
-            self.n_bonds += mol_graph.n_bonds
-
-        self.max_num_bonds = max(1, max(
-            len(in_bonds) for in_bonds in a2b))  # max with 1 to fix a crash in rare case of all single-heavy-atom mols
-
-        self.f_atoms = torch.FloatTensor(f_atoms)
-        self.f_bonds = torch.FloatTensor(f_bonds)
-        self.a2b = torch.LongTensor([a2b[a] + [0] * (self.max_num_bonds - len(a2b[a])) for a in range(self.n_atoms)])
-        self.b2a = torch.LongTensor(b2a)
-        self.b2revb = torch.LongTensor(b2revb)
+        f_atoms = np.zeros((self.n_atoms, self.atom_fdim), dtype=np.float32)  # atom features
+        f_bonds = np.zeros((self.n_bonds, self.bond_fdim), dtype=np.float32)  # combined atom/bond features
+        b2a = np.zeros(self.n_bonds, dtype=np.int64)  # mapping from bond index to the index of the atom the bond is coming from
+        b2revb = np.zeros(self.n_bonds, dtype=np.int64)  # mapping from bond index to the index of the reverse bond
+        num_in_bonds = in_bonds = np.zeros(0, dtype=np.int64)
+        if len(mol_graphs) > 0:
+            np.concatenate([mol_graph.f_atoms for mol_graph in mol_graphs], out=f_atoms[1:])
+            np.concatenate([mol_graph.f_bonds for mol_graph in mol_graphs], out=f_bonds[1:])
+            b2a[1:] = np.concatenate([mol_graph.b2a for mol_graph in mol_graphs]) + np.repeat(atom_starts, n_bonds)
+            b2revb[1:] = np.concatenate([mol_graph.b2revb for mol_graph in mol_graphs]) + np.repeat(bond_starts, n_bonds)
+            num_in_bonds = np.concatenate([np.diff(mol_graph.a2b_offsets) for mol_graph in mol_graphs])
+            in_bonds = np.concatenate([mol_graph.a2b_indices for mol_graph in mol_graphs]) + np.repeat(bond_starts, n_bonds)
+
+        # Scatter the incoming bonds of each atom from CSR format into rows padded with zeros
+        self.max_num_bonds = max(1, int(num_in_bonds.max(initial=0)))  # max with 1 to fix a crash in rare case of all single-heavy-atom mols
+        rows = np.repeat(np.arange(1, self.n_atoms), num_in_bonds)
+        cols = np.arange(len(in_bonds)) - np.repeat(np.cumsum(num_in_bonds) - num_in_bonds, num_in_bonds)
+        a2b = np.zeros((self.n_atoms, self.max_num_bonds), dtype=np.int64)  # mapping from atom index to incoming bond indices
+        a2b[rows, cols] = in_bonds
+
+        self.f_atoms = torch.from_numpy(f_atoms)
+        self.f_bonds = torch.from_numpy(f_bonds)
+        self.a2b = torch.from_numpy(a2b)
+        self.b2a = torch.from_numpy(b2a)
+        self.b2revb = torch.from_numpy(b2revb)
         self.b2b = None  # try to avoid computing b2b b/c O(n_atoms^3)
         self.a2a = None  # only needed if using atom messages
+        self.a2mol = None  # only needed if using scatter message passing
+        self.mol_index = torch.from_numpy(mol_index).long() if mol_index is not None else None
 
     def get_components(self, atom_messages: bool = False) -> Tuple[torch.FloatTensor, torch.FloatTensor,
                                                                    torch.LongTensor, torch.LongTensor, torch.LongTensor,
@@ -617,6 +694,72 @@ class BatchMolGraph:
 
         return self.a2a
 
+    def get_a2mol(self) -> torch.LongTensor:
+        """
+        Computes (if necessary) and returns a mapping from each atom index, except the padding atom 0,
+        to the index of the molecule containing the atom.
+
+        :return: A PyTorch tensor of shape :code:`(n_atoms - 1,)` containing the molecule index of each atom.
+        """
+        if self.a2mol is None:
+            a_sizes = torch.tensor([a_size for _, a_size in self.a_scope], dtype=torch.long)
+            self.a2mol = torch.repeat_interleave(torch.arange(len(self.a_scope)), a_sizes)
+
+        return self.a2mol
+
+    def with_mol_index(self, mol_index: Union[np.ndarray, torch.LongTensor]) -> 'BatchMolGraph':
+        """
+        Returns a :class:`BatchMolGraph` which shares the graphs of this batch but maps its molecules to them
+        with another index, e.g. for molecule positions which share their graphs.
+
+        :param mol_index: For each molecule, the index of its graph in this batch.
+        :return: A shallow copy of this :class:`BatchMolGraph` with the new :code:`mol_index`.
+        """
+        batch = copy.copy(self)
+        batch.mol_index = torch.as_tensor(mol_index).long()
+
+        return batch
+
+    def shares_graphs(self, other: 'BatchMolGraph') -> bool:
+        """Whether this :class:`BatchMolGraph` and another one hold the same graphs (see :meth:`with_mol_index`)."""
+        return self.f_atoms is other.f_atoms and self.mol_index is not None and other.mol_index is not None
+
+
+def mol_graph_from_smiles(smiles: str) -> Optional[MolGraph]:
+    """
+    Featurizes a molecule given by a SMILES string.
+
+    :param smiles: A SMILES string.
+    :return: A :class:`MolGraph`, or None if the SMILES is invalid.
+    """
+    mol = make_mol(smiles, is_explicit_h(), is_adding_hs())
+
+    return MolGraph(mol) if mol is not None else None
+
+
+def map_smiles(function: Callable[[str], Any],
+               smiles: List[str],
+               num_workers: int = 0,
+               chunk_size: int = 1000) -> Iterator[Any]:
+    """
+    Applies a featurization function to SMILES strings, optionally in a pool of worker processes.
+
+    The workers use the featurization parameters of the calling process, so the results are the
+    same as when the function is applied serially.
+
+    :param function: A picklable function which takes a SMILES string, e.g. :meth:`mol_graph_from_smiles`.
+    :param smiles: A list of SMILES strings.
+    :param num_workers: Number of worker processes. If 0, the function is applied in the calling process.
+    :param chunk_size: Number of SMILES sent to a worker at once.
+    :return: An iterator over the results of the function for each SMILES, in order.
+    """
+    if num_workers == 0 or len(smiles) <= chunk_size:
+        yield from map(function, smiles)
+        return
+
+    with Pool(processes=num_workers, initializer=set_featurization_parameters, initargs=(PARAMS,)) as pool:
+        yield from pool.imap(function, smiles, chunksize=chunk_size)
+
 
 def mol2graph(mols: Union[List[str], List[Chem.Mol], List[Tuple[Chem.Mol, Chem.Mol]]],
               atom_features_batch: List[np.array] = (None,),
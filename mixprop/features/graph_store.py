@@ -0,0 +1,246 @@
+from contextlib import contextmanager
+import hashlib
+import os
+import threading
+from typing import Dict, Iterator, List, Optional, Union
+
+import numpy as np
+from rdkit import Chem
+
+import mixprop.features.featurization as featurization
+from .featurization import MolGraph
+from mixprop.rdkit import make_mol
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Without fcntl (on Windows), stores are only locked between the threads of a process
+STORE_THREAD_LOCK = threading.Lock()
+
+
+@contextmanager
+def store_lock(path: str) -> Iterator[None]:
+    """
+    Holds an exclusive lock on a store directory while its files are checked or appended to.
+
+    The lock is a :code:`flock` on a lock file in the directory, which excludes other threads and
+    processes writing to the same directory, including through other store objects.
+
+    :param path: The directory of the store.
+    """
+    if fcntl is None:
+        with STORE_THREAD_LOCK:
+            yield
+        return
+
+    with open(os.path.join(path, '.lock'), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def canonical_smiles(mol: Union[str, Chem.Mol]) -> str:
+    """
+    Converts a SMILES string or an RDKit molecule to a canonical SMILES string.
+
+    :param mol: A SMILES string or an RDKit molecule.
+    :return: The canonical SMILES, or the input string itself if it cannot be parsed.
+    """
+    if isinstance(mol, str):
+        parsed = Chem.MolFromSmiles(mol)
+        return Chem.MolToSmiles(parsed) if parsed is not None else mol
+
+    return Chem.MolToSmiles(mol)
+
+
+def canonical_smiles_from_smiles(smiles: str) -> Optional[str]:
+    """
+    Parses a SMILES string with the current featurization parameters and converts it to a canonical SMILES string.
+
+    :param smiles: A SMILES string.
+    :return: The canonical SMILES of the molecule as it is featurized, or None if the SMILES is invalid.
+    """
+    mol = make_mol(smiles, featurization.is_explicit_h(), featurization.is_adding_hs())
+
+    return canonical_smiles(mol) if mol is not None else None
+
+
+def featurization_hash(overwrite_default_atom_features: bool = False,
+                       overwrite_default_bond_features: bool = False) -> str:
+    """
+    Computes a hash of the current molecule featurization parameters.
+
+    :param overwrite_default_atom_features: Whether default atom features are overwritten.
+    :param overwrite_default_bond_features: Whether default bond features are overwritten.
+    :return: A hex digest of the featurization parameters.
+    """
+    params = sorted((key, repr(value)) for key, value in vars(featurization.PARAMS).items())
+    params.append(('overwrite', (overwrite_default_atom_features, overwrite_default_bond_features)))
+
+    return hashlib.sha1(repr(params).encode()).hexdigest()
+
+
+class GraphStore:
+    """
+    A :class:`GraphStore` holds the :class:`~mixprop.features.featurization.MolGraph` of molecules in append-only,
+    memory-mapped files so that featurization is computed once and shared across runs and DataLoader workers.
+
+    The atom features, bond features and graph structure of all molecules are packed into one file each,
+    together with an index of the atom and bond ranges of each molecule and a text file listing the canonical
+    SMILES of each molecule. A store only holds graphs of a single set of featurization parameters. Writes hold a
+    lock on the directory and read the graphs appended by other writers first, so several stores and processes
+    can share a directory. Graphs with extra atom or bond features and reactions are not stored.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: Directory in which the graphs are stored.
+        """
+        self.path = path
+        self.atom_fdim = featurization.PARAMS.ATOM_FDIM
+        self.bond_fdim = featurization.PARAMS.ATOM_FDIM + featurization.PARAMS.BOND_FDIM
+        self.files = {
+            'f_atoms': (np.float32, (self.atom_fdim,)),  # atom features
+            'f_bonds': (np.float32, (self.bond_fdim,)),  # combined atom/bond features
+            'num_in_bonds': (np.int32, ()),  # number of incoming bonds of each atom
+            'a2b': (np.int32, ()),  # incoming bond indices of each atom, grouped by atom
+            'b2a': (np.int32, ()),  # index of the atom each bond is coming from
+            'b2revb': (np.int32, ()),  # index of the reverse bond of each bond
+            'index': (np.int64, (4,))  # (start_atom_index, num_atoms, start_bond_index, num_bonds) of each molecule
+        }
+        self.smiles_path = os.path.join(path, 'smiles.txt')
+        os.makedirs(path, exist_ok=True)
+
+        self.index: Dict[str, int] = {}
+        self.num_mols = 0
+        self.smiles_offset = 0
+        with store_lock(path):
+            self._sync()
+
+    def _sync(self) -> None:
+        # Reads the SMILES appended since the last call. Arrays are written before the index and the index before
+        # the SMILES, so an interrupted write leaves extra rows or a partial line of SMILES, which are discarded.
+        # Only called with the lock held, so that the rows of an active writer are never discarded.
+        num_rows = self._num_rows('index')
+        with open(self.smiles_path, 'ab+') as f:
+            f.seek(self.smiles_offset)
+            # The last element is a partial line, or empty if the file ends with a complete line
+            lines = f.read().split(b'\n')[:-1][:max(num_rows - self.num_mols, 0)]
+            self.smiles_offset += sum(len(line) + 1 for line in lines)
+            if f.tell() != self.smiles_offset:
+                f.truncate(self.smiles_offset)
+
+        added = {}
+        for i, line in enumerate(lines):
+            smi = line.decode('utf-8').rstrip('\r')
+            if smi not in self.index and smi not in added:
+                added[smi] = self.num_mols + i
+        self.num_mols += len(lines)
+
+        num_atoms = num_bonds = 0
+        if self.num_mols > 0:
+            last = np.fromfile(self._file_path('index'), dtype=np.int64, count=4, offset=(self.num_mols - 1) * 32)
+            num_atoms, num_bonds = int(last[0] + last[1]), int(last[2] + last[3])
+        for name, num_rows in [('f_atoms', num_atoms), ('num_in_bonds', num_atoms), ('f_bonds', num_bonds),
+                               ('a2b', num_bonds), ('b2a', num_bonds), ('b2revb', num_bonds), ('index', self.num_mols)]:
+            if self._num_rows(name) != num_rows:
+                with open(self._file_path(name), 'ab') as f:
+                    f.truncate(num_rows * self._row_bytes(name))
+
+        # The rows are mapped before they are indexed, so that concurrent lookups only see mapped rows
+        self._open()
+        self.index.update(added)
+
+    def _file_path(self, name: str) -> str:
+        return os.path.join(self.path, f'{name}.bin')
+
+    def _row_bytes(self, name: str) -> int:
+        dtype, shape = self.files[name]
+        return np.dtype(dtype).itemsize * int(np.prod(shape))
+
+    def _num_rows(self, name: str) -> int:
+        path = self._file_path(name)
+        return os.path.getsize(path) // self._row_bytes(name) if os.path.exists(path) else 0
+
+    def _open(self) -> None:
+        self.arrays: Dict[str, np.ndarray] = {}
+        for name, (dtype, shape) in self.files.items():
+            num_rows = self._num_rows(name)
+            if num_rows > 0:
+                self.arrays[name] = np.memmap(self._file_path(name), dtype=dtype, mode='r', shape=(num_rows, *shape))
+            else:
+                self.arrays[name] = np.zeros((0, *shape), dtype=dtype)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, smiles: str) -> bool:
+        return smiles in self.index
+
+    def get(self, smiles: str) -> MolGraph:
+        """
+        Looks up the graph of a molecule.
+
+        :param smiles: A canonical SMILES string.
+        :return: A :class:`~mixprop.features.featurization.MolGraph` whose arrays are views into the store,
+                 or None if the molecule is not stored.
+        """
+        row = self.index.get(smiles)
+        if row is None:
+            return None
+
+        atom_start, num_atoms, bond_start, num_bonds = self.arrays['index'][row].tolist()
+        atoms, bonds = slice(atom_start, atom_start + num_atoms), slice(bond_start, bond_start + num_bonds)
+        a2b_offsets = np.zeros(num_atoms + 1, dtype=np.int64)
+        np.cumsum(self.arrays['num_in_bonds'][atoms], out=a2b_offsets[1:])
+
+        return MolGraph.from_arrays(f_atoms=self.arrays['f_atoms'][atoms],
+                                    f_bonds=self.arrays['f_bonds'][bonds],
+                                    a2b_offsets=a2b_offsets,
+                                    a2b_indices=self.arrays['a2b'][bonds],
+                                    b2a=self.arrays['b2a'][bonds],
+                                    b2revb=self.arrays['b2revb'][bonds])
+
+    def add(self, smiles: List[str], mol_graphs: List[MolGraph]) -> None:
+        r"""
+        Appends graphs to the store, skipping molecules which are already stored by any writer.
+
+        :param smiles: A list of canonical SMILES strings.
+        :param mol_graphs: The :class:`~mixprop.features.featurization.MolGraph`\ s of the molecules.
+        """
+        with store_lock(self.path):
+            self._sync()
+            new = {}
+            for smi, mol_graph in zip(smiles, mol_graphs):
+                if smi not in self.index and smi not in new:
+                    new[smi] = mol_graph
+            if len(new) == 0:
+                return
+            smiles, mol_graphs = list(new.keys()), list(new.values())
+
+            # Atom and bond ranges start at the ends of the files, after any rows appended by other writers
+            num_atoms = np.array([mol_graph.n_atoms for mol_graph in mol_graphs], dtype=np.int64)
+            num_bonds = np.array([mol_graph.n_bonds for mol_graph in mol_graphs], dtype=np.int64)
+            index = np.stack((self._num_rows('f_atoms') + np.cumsum(num_atoms) - num_atoms, num_atoms,
+                              self._num_rows('f_bonds') + np.cumsum(num_bonds) - num_bonds, num_bonds), axis=1)
+            arrays = {
+                'f_atoms': [mol_graph.f_atoms for mol_graph in mol_graphs],
+                'num_in_bonds': [np.diff(mol_graph.a2b_offsets) for mol_graph in mol_graphs],
+                'f_bonds': [mol_graph.f_bonds for mol_graph in mol_graphs],
+                'a2b': [mol_graph.a2b_indices for mol_graph in mol_graphs],
+                'b2a': [mol_graph.b2a for mol_graph in mol_graphs],
+                'b2revb': [mol_graph.b2revb for mol_graph in mol_graphs],
+                'index': [index]
+            }
+            for name, values in arrays.items():
+                dtype, _ = self.files[name]
+                with open(self._file_path(name), 'ab') as f:
+                    f.write(np.concatenate(values).astype(dtype, copy=False).tobytes())
+            with open(self.smiles_path, 'ab') as f:
+                f.write(''.join(smi + '\n' for smi in smiles).encode('utf-8'))
+
+            self._sync()
@@ -2,6 +2,7 @@ import csv
 import os
 import pickle
 from typing import List
+import warnings
 
 import numpy as np
 import pandas as pd
@@ -44,10 +45,17 @@ def load_features(path: str) -> np.ndarray:
     elif extension == '.npy':
         features = np.load(path)
     elif extension in ['.csv', '.txt']:
-        with open(path) as f:
-            reader = csv.reader(f)
-            next(reader)  # skip header
-            features = np.array([[float(value) for value in row] for row in reader])
+        try:
+            # Values are parsed in bulk by numpy, which accepts the same numbers as float()
+            with warnings.catch_warnings():
+                warnings.simplefilter('error')  # files without rows warn and are read row by row
+                features = np.loadtxt(path, delimiter=',', skiprows=1, ndmin=2, comments=None)
+        except (ValueError, UserWarning):
+            # Files which cannot be parsed in bulk are read row by row
+            with open(path) as f:
+                reader = csv.reader(f)
+                next(reader)  # skip header
+                features = np.array([[float(value) for value in row] for row in reader])
     elif extension in ['.pkl', '.pckl', '.pickle']:
         with open(path, 'rb') as f:
             features = np.array([np.squeeze(np.array(feat.todense())) for feat in pickle.load(f)])
@@ -1,7 +1,11 @@
+from .embedding_cache import EmbeddingCache
+from .ensemble import MoleculeEnsemble
 from .model import MoleculeModel
 from .mpn import MPN, MPNEncoder
 
 __all__ = [
+    'EmbeddingCache',
+    'MoleculeEnsemble',
     'MoleculeModel',
     'MPN',
     'MPNEncoder'
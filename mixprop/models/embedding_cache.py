@@ -0,0 +1,253 @@
+from collections import OrderedDict
+import hashlib
+import os
+import threading
+from typing import Dict, List, Union
+
+import numpy as np
+from rdkit import Chem
+import torch
+import torch.nn as nn
+
+from mixprop.features import mol2graph
+from mixprop.features.graph_store import canonical_smiles, featurization_hash, store_lock
+
+
+def encoder_hash(encoder: nn.Module) -> str:
+    """
+    Computes a hash of the weights of an encoder, which identifies the checkpoint it was loaded from.
+
+    :param encoder: A :class:`~mixprop.models.mpn.MPNEncoder`.
+    :return: A hex digest of the encoder weights.
+    """
+    digest = hashlib.sha1()
+    for name, tensor in sorted(encoder.state_dict().items()):
+        digest.update(name.encode())
+        digest.update(tensor.detach().cpu().numpy().tobytes())
+
+    return digest.hexdigest()
+
+
+class EmbeddingStore:
+    """
+    An :class:`EmbeddingStore` holds the embeddings computed by a single encoder in an append-only,
+    memory-mapped file of float32 rows together with a text file listing the SMILES of each row.
+
+    Writes hold a lock on the directory and read the rows appended by other writers first, so several
+    stores, threads and processes can share a directory.
+    """
+
+    def __init__(self, path: str, hidden_size: int):
+        """
+        :param path: Directory in which the embeddings are stored.
+        :param hidden_size: Dimension of the embeddings.
+        """
+        self.path = path
+        self.hidden_size = hidden_size
+        self.row_bytes = 4 * hidden_size
+        self.data_path = os.path.join(path, 'embeddings.bin')
+        self.smiles_path = os.path.join(path, 'smiles.txt')
+        os.makedirs(path, exist_ok=True)
+
+        self.index: Dict[str, int] = {}
+        self.num_rows = 0
+        self.smiles_offset = 0
+        self.data = None
+        with store_lock(path):
+            self._sync()
+
+    def _sync(self) -> None:
+        # Reads the SMILES appended since the last call. Rows are written before their SMILES, so an interrupted
+        # write leaves extra rows or a partial line of SMILES, which are discarded. Only called with the lock
+        # held, so that the rows of an active writer are never discarded.
+        data_rows = os.path.getsize(self.data_path) // self.row_bytes if os.path.exists(self.data_path) else 0
+        with open(self.smiles_path, 'ab+') as f:
+            f.seek(self.smiles_offset)
+            # The last element is a partial line, or empty if the file ends with a complete line
+            lines = f.read().split(b'\n')[:-1][:max(data_rows - self.num_rows, 0)]
+            self.smiles_offset += sum(len(line) + 1 for line in lines)
+            if f.tell() != self.smiles_offset:
+                f.truncate(self.smiles_offset)
+
+        added = {}
+        for i, line in enumerate(lines):
+            smi = line.decode('utf-8').rstrip('\r')
+            if smi not in self.index and smi not in added:
+                added[smi] = self.num_rows + i
+        self.num_rows += len(lines)
+        if os.path.exists(self.data_path) and os.path.getsize(self.data_path) != self.num_rows * self.row_bytes:
+            os.truncate(self.data_path, self.num_rows * self.row_bytes)
+
+        # The rows are mapped before they are indexed, so that concurrent lookups only see mapped rows
+        self._open()
+        self.index.update(added)
+
+    def _open(self) -> None:
+        if self.num_rows > 0:
+            self.data = np.memmap(self.data_path, dtype=np.float32, mode='r', shape=(self.num_rows, self.hidden_size))
+        else:
+            self.data = None
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def get(self, smiles: str) -> np.ndarray:
+        """
+        Looks up the embedding of a molecule.
+
+        :param smiles: A canonical SMILES string.
+        :return: The embedding of the molecule, or None if it is not stored.
+        """
+        row = self.index.get(smiles)
+        if row is None:
+            return None
+
+        return np.array(self.data[row])
+
+    def add(self, smiles: List[str], embeddings: np.ndarray) -> None:
+        """
+        Appends embeddings to the store, skipping molecules which are already stored by any writer.
+
+        :param smiles: A list of canonical SMILES strings.
+        :param embeddings: A numpy array of shape :code:`(len(smiles), hidden_size)`.
+        """
+        with store_lock(self.path):
+            self._sync()
+            new = {}
+            for smi, embedding in zip(smiles, embeddings):
+                if smi not in self.index and smi not in new:
+                    new[smi] = embedding
+            if len(new) == 0:
+                return
+
+            with open(self.data_path, 'ab') as f:
+                f.write(np.ascontiguousarray(np.stack(list(new.values())), dtype=np.float32).tobytes())
+            with open(self.smiles_path, 'ab') as f:
+                f.write(''.join(smi + '\n' for smi in new).encode('utf-8'))
+
+            # The new rows are indexed from the sizes of the files, after any rows appended by other writers
+            self._sync()
+
+
+class EmbeddingCache:
+    """
+    An :class:`EmbeddingCache` stores the encodings of individual molecules so that molecules which have
+    already been seen skip message passing entirely.
+
+    Embeddings are keyed by a hash of the encoder weights, a hash of the featurization parameters and the
+    canonical SMILES of the molecule. Recently used embeddings are kept in memory and, if :code:`cache_dir`
+    is given, all embeddings are also written to memory-mapped files so that they persist across processes.
+    A cache can be used by several threads at once.
+
+    A cache stays attached to a model until it is detached with :code:`set_embedding_cache(None)`, so a
+    model which is shared between callers keeps using the cache of whichever caller attached it.
+    """
+
+    def __init__(self, cache_dir: str = None, max_size: int = 100000):
+        """
+        :param cache_dir: Directory of the on-disk store. If None, embeddings are only cached in memory.
+        :param max_size: Maximum number of embeddings kept in memory.
+        """
+        self.cache_dir = os.path.abspath(cache_dir) if cache_dir is not None else None
+        self.max_size = max_size
+        self.memory = OrderedDict()
+        self.canonical: Dict[str, str] = {}
+        self.stores: Dict[str, EmbeddingStore] = {}
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        # Guards the in-memory embeddings, the canonical SMILES, the stores and the counters
+        self.lock = threading.Lock()
+
+    def store(self, key: str, hidden_size: int) -> EmbeddingStore:
+        """
+        Returns the on-disk store for an encoder key, opening it if necessary.
+
+        :param key: The key identifying the encoder and featurization parameters.
+        :param hidden_size: Dimension of the embeddings.
+        :return: An :class:`EmbeddingStore`, or None if the cache only lives in memory.
+        """
+        if self.cache_dir is None:
+            return None
+        with self.lock:
+            if key not in self.stores:
+                self.stores[key] = EmbeddingStore(os.path.join(self.cache_dir, key), hidden_size)
+
+            return self.stores[key]
+
+    def clear(self) -> None:
+        """Clears the in-memory embeddings. The on-disk store is left untouched."""
+        with self.lock:
+            self.memory.clear()
+            self.canonical.clear()
+
+    def canonical_smiles(self, mol: Union[str, Chem.Mol]) -> str:
+        """
+        Converts a molecule to the canonical SMILES used as its key, memoizing the result for SMILES strings.
+
+        :param mol: A SMILES string or an RDKit molecule.
+        :return: The canonical SMILES of the molecule.
+        """
+        if not isinstance(mol, str):
+            return canonical_smiles(mol)
+
+        with self.lock:
+            smiles = self.canonical.get(mol)
+        if smiles is None:
+            smiles = canonical_smiles(mol)
+            with self.lock:
+                if len(self.canonical) >= self.max_size:
+                    self.canonical.clear()
+                self.canonical[mol] = smiles
+
+        return smiles
+
+    def encode(self,
+               encoder: nn.Module,
+               key: str,
+               mols: List[Union[str, Chem.Mol]]) -> torch.FloatTensor:
+        """
+        Encodes a list of molecules, running message passing only for molecules which are not cached.
+
+        :param encoder: The :class:`~mixprop.models.mpn.MPNEncoder` used for molecules which are not cached.
+        :param key: The key identifying the encoder and featurization parameters.
+        :param mols: A list of SMILES strings or RDKit molecules.
+        :return: A PyTorch tensor of shape :code:`(len(mols), hidden_size)` containing the encoding of each molecule.
+        """
+        store = self.store(key, encoder.hidden_size)
+        smiles = [self.canonical_smiles(mol) for mol in mols]
+
+        embeddings = {}
+        missing = {}
+        with self.lock:
+            for smi, mol in zip(smiles, mols):
+                if smi in embeddings or smi in missing:
+                    continue
+                embedding = self.memory.get((key, smi))
+                if embedding is not None:
+                    self.memory.move_to_end((key, smi))
+                    self.hits += 1
+                elif store is not None:
+                    embedding = store.get(smi)
+                    if embedding is not None:
+                        self.disk_hits += 1
+                if embedding is None:
+                    missing[smi] = mol
+                    self.misses += 1
+                else:
+                    embeddings[smi] = embedding
+
+        # Message passing runs without the lock, molecules missed by several threads at once are stored once
+        if len(missing) > 0:
+            new_embeddings = encoder(mol2graph(list(missing.values()))).data.cpu().numpy()
+            embeddings.update(zip(missing.keys(), new_embeddings))
+            if store is not None:
+                store.add(list(missing.keys()), new_embeddings)
+
+        with self.lock:
+            for smi, embedding in embeddings.items():
+                self.memory[(key, smi)] = embedding
+            while len(self.memory) > self.max_size:
+                self.memory.popitem(last=False)
+
+        return torch.from_numpy(np.stack([embeddings[smi] for smi in smiles])).float().to(encoder.device)
@@ -0,0 +1,69 @@
+import copy
+import threading
+from typing import List, Tuple, Union
+
+import numpy as np
+from rdkit import Chem
+import torch
+from torch.func import functional_call, stack_module_state, vmap
+
+from .model import MoleculeModel
+from mixprop.features import BatchMolGraph
+
+
+class MoleculeEnsemble:
+    r"""
+    A :class:`MoleculeEnsemble` evaluates an ensemble of identically shaped :class:`MoleculeModel`\ s
+    in a single batched forward pass by stacking the parameters of its members.
+    """
+
+    def __init__(self, models: List[MoleculeModel]):
+        r"""
+        :param models: A list of :class:`MoleculeModel`\ s with the same architecture.
+        """
+        shapes = {name: tensor.shape for name, tensor in models[0].state_dict().items()}
+        for model in models[1:]:
+            if {name: tensor.shape for name, tensor in model.state_dict().items()} != shapes:
+                raise ValueError('All models of a stacked ensemble must have the same architecture.')
+
+        self.num_models = len(models)
+        self.params, self.buffers = stack_module_state(models)
+
+        # The base model only provides the architecture, its parameters are replaced by the stacked parameters
+        self.base_model = copy.deepcopy(models[0]).to('meta')
+        self.base_model.encoder.device = models[0].encoder.device
+        self.base_model.eval()
+
+        # functional_call swaps the stacked parameters into the shared base model, so calls run one at a time
+        self.lock = threading.Lock()
+
+    @property
+    def nbytes(self) -> int:
+        """The memory used by the stacked parameters and buffers in bytes."""
+        return sum(tensor.numel() * tensor.element_size()
+                   for tensor in list(self.params.values()) + list(self.buffers.values()))
+
+    def __call__(self,
+                 batch: Union[List[List[str]], List[List[Chem.Mol]], List[List[Tuple[Chem.Mol, Chem.Mol]]], List[BatchMolGraph]],
+                 features_batch: List[np.ndarray] = None,
+                 atom_descriptors_batch: List[np.ndarray] = None,
+                 atom_features_batch: List[np.ndarray] = None,
+                 bond_features_batch: List[np.ndarray] = None) -> torch.FloatTensor:
+        """
+        Runs every member of the ensemble on the same batch of molecules.
+
+        :param batch: A list of list of SMILES, a list of list of RDKit molecules, or a
+                      list of :class:`~mixprop.features.featurization.BatchMolGraph`.
+        :param features_batch: A list of numpy arrays containing additional features.
+        :param atom_descriptors_batch: A list of numpy arrays containing additional atom descriptors.
+        :param atom_features_batch: A list of numpy arrays containing additional atom features.
+        :param bond_features_batch: A list of numpy arrays containing additional bond features.
+        :return: A PyTorch tensor of shape :code:`(num_models, num_molecules, num_tasks)` containing
+                 the predictions of each member of the ensemble.
+        """
+        def member_forward(params, buffers):
+            return functional_call(self.base_model, (params, buffers),
+                                   (batch, features_batch, atom_descriptors_batch, atom_features_batch, bond_features_batch))
+
+        with self.lock:
+            return vmap(member_forward)(self.params, self.buffers)
@@ -5,6 +5,7 @@ from rdkit import Chem
 import torch
 import torch.nn as nn
 
+from .embedding_cache import EmbeddingCache
 from .mpn import MPN
 from mixprop.args import TrainArgs
 from mixprop.features import BatchMolGraph
@@ -37,6 +38,8 @@ class MoleculeModel(nn.Module):
         if self.multiclass:
             self.multiclass_softmax = nn.Softmax(dim=2)
 
+        self.hidden_size = args.hidden_size
+
         self.create_encoder(args)
         self.create_ffn(args)
 
@@ -75,7 +78,8 @@ class MoleculeModel(nn.Module):
             else:
                 first_linear_dim = args.hidden_size * args.number_of_molecules
             if args.use_input_features:
-                first_linear_dim += args.features_size
+                # The mole fraction scales the embeddings instead of being concatenated, so only the temperature is appended
+                first_linear_dim += args.features_size - 1
 
         if args.atom_descriptors == 'descriptor':
             first_linear_dim += args.atom_descriptors_size
@@ -92,7 +96,7 @@ class MoleculeModel(nn.Module):
         else:
             ffn = [
                 dropout,
-                nn.Linear(601, args.ffn_hidden_size) #first_linear_dim, args.ffn_hidden_size) #first_linear_dim, args.ffn_hidden_size)
+                nn.Linear(first_linear_dim, args.ffn_hidden_size)
             ]
             for _ in range(args.ffn_num_layers - 2):
                 ffn.extend([
@@ -128,6 +132,15 @@ class MoleculeModel(nn.Module):
                     print('FREEZING PARAM:',param)
                     param.requires_grad=False
 
+    def set_embedding_cache(self, embedding_cache: EmbeddingCache = None) -> None:
+        """
+        Attaches an :class:`~mixprop.models.embedding_cache.EmbeddingCache` to the encoder so that the
+        embeddings of molecules which have already been encoded are reused during evaluation.
+
+        :param embedding_cache: The cache to attach, or None to detach the current cache.
+        """
+        self.encoder.set_embedding_cache(embedding_cache)
+
     def fingerprint(self,
                   batch: Union[List[List[str]], List[List[Chem.Mol]], List[List[Tuple[Chem.Mol, Chem.Mol]]], List[BatchMolGraph]],
                   features_batch: List[np.ndarray] = None,
@@ -154,28 +167,13 @@ class MoleculeModel(nn.Module):
         elif fingerprint_type == 'last_FFN':
             
             
-            embedding_combined = self.encoder(batch, features_batch, atom_descriptors_batch,
-                               atom_features_batch, bond_features_batch)
-
-            ### Obtain swapped output:
-            # Obtain mol_frac1 and mol_frac2:
-            T = embedding_combined[0:50,-1].view(-1,1) 
-            mol_frac1 = embedding_combined[0:50,-2].view(-1,1)
-            
-            if torch.cuda.is_available():
-                mol_frac2 = torch.ones(np.shape(mol_frac1),device='cuda')-mol_frac1
-            else:
-                mol_frac2 = torch.ones(np.shape(mol_frac1),device='cpu')-mol_frac1
-
-            # Assign embeddings:
-            embedding_shape = (50,300)
+            embedding1, embedding2, mol_frac1, T = self.mixture_embeddings(batch, features_batch, atom_descriptors_batch,
+                                                                           atom_features_batch, bond_features_batch)
+            mol_frac2 = 1 - mol_frac1
 
-            embedding1 = embedding_combined[0:embedding_shape[0],0:embedding_shape[1]]
-            embedding2 = embedding_combined[0:embedding_shape[0],embedding_shape[1]:-2]
-            
             embedding_combined = torch.concat((embedding1*mol_frac1,embedding2*mol_frac2,T),axis=1)
-            embedding_combined_swapped = torch.concat((embedding2*mol_frac2,embedding1*mol_frac1,T),axis=1)            
-            
+            embedding_combined_swapped = torch.concat((embedding2*mol_frac2,embedding1*mol_frac1,T),axis=1)
+
             fp12 = self.ffn[:-1](embedding_combined)
             fp21 = self.ffn[:-1](embedding_combined_swapped)
             
@@ -189,6 +187,68 @@ class MoleculeModel(nn.Module):
         else:
             raise ValueError(f'Unsupported fingerprint type {fingerprint_type}.')
 
+    def mixture_embeddings(self,
+                           batch: Union[List[List[str]], List[List[Chem.Mol]], List[List[Tuple[Chem.Mol, Chem.Mol]]], List[BatchMolGraph]],
+                           features_batch: List[np.ndarray] = None,
+                           atom_descriptors_batch: List[np.ndarray] = None,
+                           atom_features_batch: List[np.ndarray] = None,
+                           bond_features_batch: List[np.ndarray] = None) -> Tuple[torch.FloatTensor, torch.FloatTensor,
+                                                                                  torch.FloatTensor, torch.FloatTensor]:
+        """
+        Encodes a batch of mixtures and splits the encoder output into its mixture components.
+
+        The features file MUST contain the mole fraction of the first molecule in the first column and
+        the temperature in the second column.
+
+        :param batch: A list of list of SMILES, a list of list of RDKit molecules, or a
+                      list of :class:`~mixprop.features.featurization.BatchMolGraph`.
+        :param features_batch: A list of numpy arrays containing the mole fraction and temperature.
+        :param atom_descriptors_batch: A list of numpy arrays containing additional atom descriptors.
+        :param atom_features_batch: A list of numpy arrays containing additional atom features.
+        :param bond_features_batch: A list of numpy arrays containing additional bond features.
+        :return: A tuple containing the embeddings of the first and second molecules and the
+                 :code:`(num_molecules, 1)` mole fraction and temperature columns.
+        """
+        embedding_combined = self.encoder(batch, features_batch, atom_descriptors_batch,
+                                          atom_features_batch, bond_features_batch)
+
+        T = embedding_combined[:,-1:]
+        mol_frac1 = embedding_combined[:,-2:-1]
+
+        embedding1 = embedding_combined[:,0:self.hidden_size]
+        embedding2 = embedding_combined[:,self.hidden_size:2*self.hidden_size]
+
+        return embedding1, embedding2, mol_frac1, T
+
+    def mixture_ffn(self,
+                    embedding1: torch.FloatTensor,
+                    embedding2: torch.FloatTensor,
+                    mol_frac1: torch.FloatTensor,
+                    T: torch.FloatTensor) -> torch.FloatTensor:
+        """
+        Runs the feed-forward layers on precomputed molecule embeddings.
+
+        The prediction is symmetrized by averaging the outputs for both orderings of the two molecules.
+        Since the embeddings do not depend on composition or temperature, the same embeddings can be
+        broadcast over any number of :code:`(mol_frac1, T)` points.
+
+        :param embedding1: A tensor of shape :code:`(num_points, hidden_size)` with the first molecule embeddings.
+        :param embedding2: A tensor of shape :code:`(num_points, hidden_size)` with the second molecule embeddings.
+        :param mol_frac1: A tensor of shape :code:`(num_points, 1)` with the mole fraction of the first molecule.
+        :param T: A tensor of shape :code:`(num_points, 1)` with the temperature.
+        :return: A tensor of shape :code:`(num_points, 1)` containing the predictions.
+        """
+        mol_frac2 = 1 - mol_frac1
+
+        # Mult Mod: (Must change ffn shape)
+        embedding_combined = torch.concat((embedding1*mol_frac1,embedding2*mol_frac2,T),axis=1)
+        embedding_combined_swapped = torch.concat((embedding2*mol_frac2,embedding1*mol_frac1,T),axis=1)
+
+        output = self.ffn(embedding_combined)
+        output_swapped = self.ffn(embedding_combined_swapped)
+
+        return torch.mean(torch.concat((output,output_swapped),axis=1),axis=1).view(-1,1)
+
     def forward(self,
                 batch: Union[List[List[str]], List[List[Chem.Mol]], List[List[Tuple[Chem.Mol, Chem.Mol]]], List[BatchMolGraph]],
                 features_batch: List[np.ndarray] = None,
@@ -209,41 +269,11 @@ class MoleculeModel(nn.Module):
         :return: The output of the :class:`MoleculeModel`, containing a list of property predictions
         """
 
-        embedding_combined = self.encoder(batch, features_batch, atom_descriptors_batch,
-                                       atom_features_batch, bond_features_batch)
+        embedding1, embedding2, mol_frac1, T = self.mixture_embeddings(batch, features_batch, atom_descriptors_batch,
+                                                                       atom_features_batch, bond_features_batch)
+        output_combined = self.mixture_ffn(embedding1, embedding2, mol_frac1, T)
+        output = output_combined
 
-        ## Format: A features file MUST be included containing mole fraction in the first column and temperature in the second column
-        # Batch is also hard-coded here at 50,embedding size at 300
-        # ffn size has been changed
-        
-        ### Obtain swapped output:
-        # Obtain mol_frac1 and mol_frac2:
-        T = embedding_combined[0:50,-1].view(-1,1) 
-        mol_frac1 = embedding_combined[0:50,-2].view(-1,1) 
-        if torch.cuda.is_available():
-            mol_frac2 = torch.ones(np.shape(mol_frac1),device='cuda')-mol_frac1
-        else:
-            mol_frac2 = torch.ones(np.shape(mol_frac1),device='cpu')-mol_frac1
-        
-        # Assign embeddings:
-        embedding_shape = (50,300)
-        
-        embedding1 = embedding_combined[0:embedding_shape[0],0:embedding_shape[1]]
-        embedding2 = embedding_combined[0:embedding_shape[0],embedding_shape[1]:-2]
-        
-#         # Chas Mod: (Make sure ffn shape is default)
-#         embedding_combined = torch.concat((embedding1,embedding2,mol_frac1),axis=1)
-#         embedding_combined_swapped = torch.concat((embedding2,embedding1,mol_frac2),axis=1)
-        
-        # Mult Mod: (Must change ffn shape)
-        embedding_combined = torch.concat((embedding1*mol_frac1,embedding2*mol_frac2,T),axis=1)
-        embedding_combined_swapped = torch.concat((embedding2*mol_frac2,embedding1*mol_frac1,T),axis=1)
-        
-        output = self.ffn(embedding_combined)
-        output_swapped = self.ffn(embedding_combined_swapped)
-        
-        output_combined = torch.mean(torch.concat((output,output_swapped),axis=1),axis=1).view(-1,1)
-               
         # Don't apply sigmoid during training when using BCEWithLogitsLoss
         if self.classification and not (self.training and self.no_training_normalization):
             output = self.sigmoid(output)
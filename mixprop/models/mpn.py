@@ -8,7 +8,8 @@ import torch.nn as nn
 
 from mixprop.args import TrainArgs
 from mixprop.features import BatchMolGraph, get_atom_fdim, get_bond_fdim, mol2graph
-from mixprop.nn_utils import index_select_ND, get_activation_function
+from .embedding_cache import EmbeddingCache, encoder_hash, featurization_hash
+from mixprop.nn_utils import index_select_ND, get_activation_function, scatter_sum
 
 
 class MPNEncoder(nn.Module):
@@ -34,6 +35,7 @@ class MPNEncoder(nn.Module):
         self.dropout = args.dropout
         self.layers_per_message = 1
         self.undirected = args.undirected
+        self.scatter_message_passing = args.scatter_message_passing
         self.device = args.device
         self.aggregation = args.aggregation
         self.aggregation_norm = args.aggregation_norm
@@ -88,6 +90,11 @@ class MPNEncoder(nn.Module):
         if self.atom_messages:
             a2a = mol_graph.get_a2a().to(self.device)
 
+        if self.scatter_message_passing:
+            # Bond b = a1 --> a2 is an incoming bond of a2, which is the atom its reverse bond originates from
+            b_target = b2a[b2revb][1:]
+            num_padding = (a2b.size(1) - torch.bincount(b_target, minlength=a2b.size(0))).unsqueeze(1).to(f_bonds.dtype)
+
         # Input
         if self.atom_messages:
             input = self.W_i(f_atoms)  # num_atoms x hidden_size
@@ -100,7 +107,9 @@ class MPNEncoder(nn.Module):
             if self.undirected:
                 message = (message + message[b2revb]) / 2
 
-            if self.atom_messages:
+            if self.atom_messages and self.scatter_message_passing:
+                message = scatter_sum(torch.cat((message[b2a], f_bonds), dim=1), b_target, num_padding)  # num_atoms x hidden + bond_fdim
+            elif self.atom_messages:
                 nei_a_message = index_select_ND(message, a2a)  # num_atoms x max_num_bonds x hidden
                 nei_f_bonds = index_select_ND(f_bonds, a2b)  # num_atoms x max_num_bonds x bond_fdim
                 nei_message = torch.cat((nei_a_message, nei_f_bonds), dim=2)  # num_atoms x max_num_bonds x hidden + bond_fdim
@@ -108,8 +117,11 @@ class MPNEncoder(nn.Module):
             else:
                 # m(a1 -> a2) = [sum_{a0 \in nei(a1)} m(a0 -> a1)] - m(a2 -> a1)
                 # message      a_message = sum(nei_a_message)      rev_message
-                nei_a_message = index_select_ND(message, a2b)  # num_atoms x max_num_bonds x hidden
-                a_message = nei_a_message.sum(dim=1)  # num_atoms x hidden
+                if self.scatter_message_passing:
+                    a_message = scatter_sum(message, b_target, num_padding)  # num_atoms x hidden
+                else:
+                    nei_a_message = index_select_ND(message, a2b)  # num_atoms x max_num_bonds x hidden
+                    a_message = nei_a_message.sum(dim=1)  # num_atoms x hidden
                 rev_message = message[b2revb]  # num_bonds x hidden
                 message = a_message[b2a] - rev_message  # num_bonds x hidden
 
@@ -117,9 +129,12 @@ class MPNEncoder(nn.Module):
             message = self.act_func(input + message)  # num_bonds x hidden_size
             message = self.dropout_layer(message)  # num_bonds x hidden
 
-        a2x = a2a if self.atom_messages else a2b
-        nei_a_message = index_select_ND(message, a2x)  # num_atoms x max_num_bonds x hidden
-        a_message = nei_a_message.sum(dim=1)  # num_atoms x hidden
+        if self.scatter_message_passing:
+            a_message = scatter_sum(message[b2a] if self.atom_messages else message, b_target, num_padding)  # num_atoms x hidden
+        else:
+            a2x = a2a if self.atom_messages else a2b
+            nei_a_message = index_select_ND(message, a2x)  # num_atoms x max_num_bonds x hidden
+            a_message = nei_a_message.sum(dim=1)  # num_atoms x hidden
         a_input = torch.cat([f_atoms, a_message], dim=1)  # num_atoms x (atom_fdim + hidden)
         atom_hiddens = self.act_func(self.W_o(a_input))  # num_atoms x hidden
         atom_hiddens = self.dropout_layer(atom_hiddens)  # num_atoms x hidden
@@ -134,22 +149,36 @@ class MPNEncoder(nn.Module):
             atom_hiddens = self.dropout_layer(atom_hiddens)                             # num_atoms x (hidden + descriptor size)
 
         # Readout
-        mol_vecs = []
-        for i, (a_start, a_size) in enumerate(a_scope):
-            if a_size == 0:
-                mol_vecs.append(self.cached_zero_vector)
-            else:
-                cur_hiddens = atom_hiddens.narrow(0, a_start, a_size)
-                mol_vec = cur_hiddens  # (num_atoms, hidden_size)
-                if self.aggregation == 'mean':
-                    mol_vec = mol_vec.sum(dim=0) / a_size
-                elif self.aggregation == 'sum':
-                    mol_vec = mol_vec.sum(dim=0)
-                elif self.aggregation == 'norm':
-                    mol_vec = mol_vec.sum(dim=0) / self.aggregation_norm
-                mol_vecs.append(mol_vec)
-
-        mol_vecs = torch.stack(mol_vecs, dim=0)  # (num_molecules, hidden_size)
+        if self.scatter_message_passing:
+            # Sum the atoms of each molecule in a single segment reduction, empty molecules are zero vectors
+            a_sizes = torch.tensor([a_size for _, a_size in a_scope], dtype=atom_hiddens.dtype, device=self.device)
+            mol_vecs = atom_hiddens.new_zeros((len(a_scope), atom_hiddens.size(1)))
+            mol_vecs = mol_vecs.index_add(0, mol_graph.get_a2mol().to(self.device), atom_hiddens[1:])
+            if self.aggregation == 'mean':
+                mol_vecs = mol_vecs / a_sizes.clamp(min=1).unsqueeze(1)
+            elif self.aggregation == 'norm':
+                mol_vecs = mol_vecs / self.aggregation_norm
+        else:
+            mol_vecs = []
+            for i, (a_start, a_size) in enumerate(a_scope):
+                if a_size == 0:
+                    mol_vecs.append(self.cached_zero_vector)
+                else:
+                    cur_hiddens = atom_hiddens.narrow(0, a_start, a_size)
+                    mol_vec = cur_hiddens  # (num_atoms, hidden_size)
+                    if self.aggregation == 'mean':
+                        mol_vec = mol_vec.sum(dim=0) / a_size
+                    elif self.aggregation == 'sum':
+                        mol_vec = mol_vec.sum(dim=0)
+                    elif self.aggregation == 'norm':
+                        mol_vec = mol_vec.sum(dim=0) / self.aggregation_norm
+                    mol_vecs.append(mol_vec)
+
+            mol_vecs = torch.stack(mol_vecs, dim=0)  # (num_molecules, hidden_size)
+
+        # Gather the encodings of molecules which share a graph
+        if mol_graph.mol_index is not None:
+            mol_vecs = mol_vecs[mol_graph.mol_index.to(self.device)]
 
         return mol_vecs  # num_molecules x hidden
 
@@ -181,6 +210,7 @@ class MPN(nn.Module):
         self.atom_descriptors = args.atom_descriptors
         self.overwrite_default_atom_features = args.overwrite_default_atom_features
         self.overwrite_default_bond_features = args.overwrite_default_bond_features
+        self.embedding_cache = None
 
         if self.features_only:
             return
@@ -203,9 +233,33 @@ class MPN(nn.Module):
             self.encoder_solvent = MPNEncoder(args, self.atom_fdim_solvent, self.bond_fdim_solvent,
                                                args.hidden_size_solvent, args.bias_solvent, args.depth_solvent)
 
+    def set_embedding_cache(self, embedding_cache: EmbeddingCache = None) -> None:
+        """
+        Attaches an :class:`~mixprop.models.embedding_cache.EmbeddingCache` which is used in evaluation mode
+        when molecules are passed as SMILES or RDKit molecules. The cache keys are computed from the current
+        weights, so the cache should be attached after the weights are loaded.
+
+        :param embedding_cache: The cache to attach, or None to detach the current cache.
+        """
+        self.embedding_cache = embedding_cache
+        if embedding_cache is not None:
+            feat_hash = featurization_hash(self.overwrite_default_atom_features, self.overwrite_default_bond_features)
+            self.embedding_cache_keys = [encoder_hash(enc) + '_' + feat_hash for enc in self.encoder]
+
+    def use_embedding_cache(self,
+                            batch: Union[List[List[str]], List[List[Chem.Mol]], List[List[Tuple[Chem.Mol, Chem.Mol]]], List[BatchMolGraph]],
+                            atom_descriptors_batch: List[np.ndarray] = None,
+                            atom_features_batch: List[np.ndarray] = None,
+                            bond_features_batch: List[np.ndarray] = None) -> bool:
+        """Whether the embedding cache can be used for a batch, which requires molecule inputs without extra atom or bond features."""
+        return (self.embedding_cache is not None and not self.training
+                and not self.features_only and not self.reaction and not self.reaction_solvent
+                and type(batch[0]) != BatchMolGraph and self.atom_descriptors is None
+                and atom_descriptors_batch is None and atom_features_batch is None and bond_features_batch is None)
+
     def forward(self,
                 batch: Union[List[List[str]], List[List[Chem.Mol]], List[List[Tuple[Chem.Mol, Chem.Mol]]], List[BatchMolGraph]],
-                features_batch: List[np.ndarray] = None,
+                features_batch: Union[List[np.ndarray], torch.FloatTensor] = None,
                 atom_descriptors_batch: List[np.ndarray] = None,
                 atom_features_batch: List[np.ndarray] = None,
                 bond_features_batch: List[np.ndarray] = None) -> torch.FloatTensor:
@@ -216,12 +270,15 @@ class MPN(nn.Module):
                       list of :class:`~mixprop.features.featurization.BatchMolGraph`.
                       The outer list or BatchMolGraph is of length :code:`num_molecules` (number of datapoints in batch),
                       the inner list is of length :code:`number_of_molecules` (number of molecules per datapoint).
-        :param features_batch: A list of numpy arrays containing additional features.
+        :param features_batch: A list of numpy arrays or a tensor containing additional features.
         :param atom_descriptors_batch: A list of numpy arrays containing additional atom descriptors.
         :param atom_features_batch: A list of numpy arrays containing additional atom features.
         :param bond_features_batch: A list of numpy arrays containing additional bond features.
         :return: A PyTorch tensor of shape :code:`(num_molecules, hidden_size)` containing the encoding of each molecule.
         """
+        use_embedding_cache = self.use_embedding_cache(batch, atom_descriptors_batch,
+                                                       atom_features_batch, bond_features_batch)
+
         if type(batch[0]) != BatchMolGraph:
             # Group first molecules, second molecules, etc for mol2graph
             batch = [[mols[i] for mols in batch] for i in range(len(batch[0]))]
@@ -256,11 +313,14 @@ class MPN(nn.Module):
                     )
                     for b in batch
                 ]
-            else:
+            elif not use_embedding_cache:
                 batch = [mol2graph(b) for b in batch]
 
         if self.use_input_features:
-            features_batch = torch.from_numpy(np.stack(features_batch)).float().to(self.device)
+            # Batches which are loaded repeatedly hold their features as a tensor already
+            if not isinstance(features_batch, torch.Tensor):
+                features_batch = torch.from_numpy(np.stack(features_batch))
+            features_batch = features_batch.float().to(self.device)
 
             if self.features_only:
                 return features_batch
@@ -271,6 +331,16 @@ class MPN(nn.Module):
                                           'per input (i.e., number_of_molecules = 1).')
 
             encodings = [enc(ba, atom_descriptors_batch) for enc, ba in zip(self.encoder, batch)]
+        elif use_embedding_cache:
+            # Only molecules missing from the cache are featurized and encoded
+            encodings = [self.embedding_cache.encode(enc, key, mols)
+                         for enc, key, mols in zip(self.encoder, self.embedding_cache_keys, batch)]
+        elif not self.reaction_solvent and len(batch) > 1 and all(enc is self.encoder[0] for enc in self.encoder) \
+                and all(ba.shares_graphs(batch[0]) for ba in batch[1:]):
+            # Molecule positions which share their graphs are encoded once by the shared encoder
+            num_molecules = len(batch[0].mol_index)
+            mol_index = torch.cat([ba.mol_index for ba in batch])
+            encodings = self.encoder[0](batch[0].with_mol_index(mol_index)).split(num_molecules)
         else:
             if not self.reaction_solvent:
                  encodings = [enc(ba) for enc, ba in zip(self.encoder, batch)]
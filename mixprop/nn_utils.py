@@ -47,6 +47,23 @@ def param_count_all(model: nn.Module) -> int:
     return sum(param.numel() for param in model.parameters())
 
 
+def scatter_sum(source: torch.Tensor, index: torch.Tensor, num_padding: torch.Tensor) -> torch.Tensor:
+    """
+    Sums the message features of the bonds of :code:`source` into the atoms given by :code:`index`.
+
+    This is equivalent to selecting the features with :meth:`index_select_ND` on a zero-padded
+    neighbor index tensor and summing over the neighbors, including the padding row of :code:`source`
+    which is summed once for every padded neighbor slot of an atom.
+
+    :param source: A tensor of shape :code:`(num_bonds, hidden_size)` containing message features,
+                   where row 0 is the padding row.
+    :param index: A tensor of shape :code:`(num_bonds - 1,)` containing the atom index of each bond except the padding bond.
+    :param num_padding: A tensor of shape :code:`(num_atoms, 1)` containing the number of padded neighbor slots of each atom.
+    :return: A tensor of shape :code:`(num_atoms, hidden_size)` containing the summed message features of each atom.
+    """
+    return (num_padding * source[0]).index_add(0, index, source[1:])
+
+
 def index_select_ND(source: torch.Tensor, index: torch.Tensor) -> torch.Tensor:
     """
     Selects the message features from source corresponding to the atom or bond indices in :code:`index`.
@@ -6,8 +6,9 @@ from .cross_validate import mixprop_train, cross_validate, TRAIN_LOGGER_NAME
 from .evaluate import evaluate, evaluate_predictions
 from .make_predictions import mixprop_predict, make_predictions, load_model
 from .molecule_fingerprint import mixprop_fingerprint, model_fingerprint
-from .predict import predict
+from .predict import predict, predict_ensemble
 from .run_training import run_training
+from .screen import mixprop_screen, run_screen, screen_pairs
 from .train import train
 
 __all__ = [
@@ -21,7 +22,11 @@ __all__ = [
     'make_predictions',
     'load_model',
     'predict',
+    'predict_ensemble',
     'run_training',
+    'mixprop_screen',
+    'run_screen',
+    'screen_pairs',
     'train',
     'get_metric_func',
     'prc_auc',
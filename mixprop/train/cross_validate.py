@@ -2,17 +2,21 @@ from collections import defaultdict
 import csv
 import json
 from logging import Logger
+from multiprocessing import get_context
+from multiprocessing.queues import SimpleQueue
 import os
 import sys
 from typing import Callable, Dict, List, Tuple
 import subprocess
 import numpy as np
 import pandas as pd
+import torch
 
 from .run_training import run_training
 from mixprop.args import TrainArgs
 from mixprop.constants import TEST_SCORES_FILE_NAME, TRAIN_LOGGER_NAME
-from mixprop.data import get_data, get_task_names, MoleculeDataset, validate_dataset_type
+from mixprop.data import get_data, get_task_names, MoleculeDataset, validate_dataset_type, set_cache_graph, \
+    precompute_graphs
 from mixprop.utils import create_logger, makedirs, timeit
 from mixprop.features import set_extra_atom_fdim, set_extra_bond_fdim, set_explicit_h, set_adding_hs, set_reaction, reset_featurization_parameters
 
@@ -97,24 +101,17 @@ def cross_validate(args: TrainArgs,
         raise ValueError('The number of provided target weights must match the number and order of the prediction tasks')
 
     # Run training on different random seeds for each fold
-    all_scores = defaultdict(list)
-    for fold_num in range(args.num_folds):
-        info(f'Fold {fold_num}')
-        args.seed = init_seed + fold_num
-        args.save_dir = os.path.join(save_dir, f'fold_{fold_num}')
-        makedirs(args.save_dir)
-        data.reset_features_and_targets()
-
-        # If resuming experiment, load results from trained models
-        test_scores_path = os.path.join(args.save_dir, 'test_scores.json')
-        if args.resume_experiment and os.path.exists(test_scores_path):
-            print('Loading scores')
-            with open(test_scores_path) as f:
-                model_scores = json.load(f)
-        # Otherwise, train the models
-        else:
-            model_scores = train_func(args, data, logger)
+    fold_args = (args, data, train_func, init_seed, save_dir, logger)
+    if args.fold_workers > 0:
+        # Molecules are featurized once, here, and the fold processes inherit the cached graphs
+        set_cache_graph(len(data) <= args.cache_cutoff)
+        precompute_graphs(data, num_workers=args.featurization_workers, chunk_size=args.featurization_chunk_size)
+        all_fold_scores = run_folds_in_parallel(fold_args, args.num_folds, args.fold_workers)
+    else:
+        all_fold_scores = [run_fold(fold_num, *fold_args) for fold_num in range(args.num_folds)]
 
+    all_scores = defaultdict(list)
+    for model_scores in all_fold_scores:
         for metric, scores in model_scores.items():
             all_scores[metric].append(scores)
     all_scores = dict(all_scores)
@@ -185,6 +182,102 @@ def cross_validate(args: TrainArgs,
     return mean_score, std_score
 
 
+def run_fold(fold_num: int,
+             args: TrainArgs,
+             data: MoleculeDataset,
+             train_func: Callable[[TrainArgs, MoleculeDataset, Logger], Dict[str, List[float]]],
+             init_seed: int,
+             save_dir: str,
+             logger: Logger = None) -> Dict[str, List[float]]:
+    """
+    Trains and tests the models of one cross-validation fold, or loads their scores when resuming an experiment.
+
+    :param fold_num: The index of the fold.
+    :param args: A :class:`~mixprop.args.TrainArgs` object containing arguments for
+                 loading data and training the mixprop model. Its seed and save directory are set for the fold.
+    :param data: A :class:`~mixprop.data.MoleculeDataset` containing the data.
+    :param train_func: Function which runs training.
+    :param init_seed: The seed of the first fold.
+    :param save_dir: The directory in which the directory of each fold is created.
+    :param logger: A logger to record output.
+    :return: A dictionary mapping each metric in :code:`args.metrics` to a list of test scores for each task.
+    """
+    info = logger.info if logger is not None else print
+
+    info(f'Fold {fold_num}')
+    args.seed = init_seed + fold_num
+    args.save_dir = os.path.join(save_dir, f'fold_{fold_num}')
+    makedirs(args.save_dir)
+    data.reset_features_and_targets()
+
+    # If resuming experiment, load results from trained models
+    test_scores_path = os.path.join(args.save_dir, 'test_scores.json')
+    if args.resume_experiment and os.path.exists(test_scores_path):
+        print('Loading scores')
+        with open(test_scores_path) as f:
+            model_scores = json.load(f)
+    # Otherwise, train the models
+    else:
+        model_scores = train_func(args, data, logger)
+
+    return model_scores
+
+
+# Arguments of run_fold, inherited by the forked processes which train folds in parallel
+FOLD_ARGS = None
+
+
+def _init_fold_worker(cpu_groups: SimpleQueue) -> None:
+    # Each worker takes a group of CPUs from the queue, which holds one group per worker, and runs one PyTorch
+    # thread per CPU. The workers of a pool live as long as the pool, so their groups stay distinct
+    cpus = cpu_groups.get()
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+    torch.set_num_threads(len(cpus))
+
+
+def _run_fold_in_worker(fold_num: int) -> Dict[str, List[float]]:
+    return run_fold(fold_num, *FOLD_ARGS)
+
+
+def run_folds_in_parallel(fold_args: Tuple,
+                          num_folds: int,
+                          num_workers: int) -> List[Dict[str, List[float]]]:
+    """
+    Runs cross-validation folds concurrently in forked worker processes.
+
+    The worker processes inherit the data and the featurized molecules from this process, so they are shared
+    rather than copied. The CPUs available to this process are divided into contiguous groups, one per worker,
+    and each worker is restricted to its group and uses one PyTorch thread per CPU of the group.
+
+    :param fold_args: The arguments of :func:`run_fold` after :code:`fold_num`.
+    :param num_folds: The number of folds.
+    :param num_workers: The number of worker processes.
+    :return: A list with the test scores of each fold, in the order of the folds.
+    """
+    global FOLD_ARGS
+
+    num_workers = min(num_workers, num_folds)
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count() or 1))
+
+    # With fewer CPUs than workers, the workers share all CPUs
+    cpu_groups = [cpus[i * len(cpus) // num_workers:(i + 1) * len(cpus) // num_workers] or cpus
+                  for i in range(num_workers)]
+
+    context = get_context('fork')
+    free_cpu_groups = context.SimpleQueue()
+    for cpu_group in cpu_groups:
+        free_cpu_groups.put(cpu_group)
+
+    FOLD_ARGS = fold_args
+    try:
+        with context.Pool(processes=num_workers, initializer=_init_fold_worker,
+                          initargs=(free_cpu_groups,)) as pool:
+            return pool.map(_run_fold_in_worker, range(num_folds), chunksize=1)
+    finally:
+        FOLD_ARGS = None
+
+
 def mixprop_train() -> None:
     """Parses mixprop training arguments and trains (cross-validates) a mixprop model.
 
@@ -1,17 +1,18 @@
 from collections import OrderedDict
 import csv
-from typing import List, Optional, Union, Tuple
+from typing import Iterator, List, Optional, Union, Tuple
 
 import numpy as np
 from tqdm import tqdm
 
-from .predict import predict
+from .predict import predict, predict_ensemble
 from mixprop.spectra_utils import normalize_spectra, roundrobin_sid
 from mixprop.args import PredictArgs, TrainArgs
-from mixprop.data import get_data, get_data_from_smiles, MoleculeDataLoader, MoleculeDataset, StandardScaler
+from mixprop.data import get_data, get_data_from_smiles, MoleculeDataLoader, MoleculeDataset, StandardScaler, \
+    precompute_graphs
 from mixprop.utils import load_args, load_checkpoint, load_scalers, makedirs, timeit, update_prediction_args
 from mixprop.features import set_extra_atom_fdim, set_extra_bond_fdim, set_reaction, set_explicit_h, set_adding_hs, reset_featurization_parameters
-from mixprop.models import MoleculeModel
+from mixprop.models import MoleculeEnsemble, MoleculeModel
 
 
 def load_model(args: PredictArgs, generator: bool = False):
@@ -66,20 +67,24 @@ def load_data(args: PredictArgs, smiles: List[List[str]]):
     print('Validating SMILES')
     full_to_valid_indices = {}
     valid_index = 0
-    for full_index in range(len(full_data)):
-        if all(mol is not None for mol in full_data[full_index].mol):
+    for full_index, mols in enumerate(full_data.mols()):
+        if all(mol is not None for mol in mols):
             full_to_valid_indices[full_index] = valid_index
             valid_index += 1
 
-    test_data = MoleculeDataset([full_data[i] for i in sorted(full_to_valid_indices.keys())])
+    test_data = full_data.subset(sorted(full_to_valid_indices.keys()))
 
     print(f'Test size = {len(test_data):,}')
+    precompute_graphs(test_data, num_workers=args.featurization_workers, chunk_size=args.featurization_chunk_size)
 
     # Create data loader
     test_data_loader = MoleculeDataLoader(
         dataset=test_data,
         batch_size=args.batch_size,
-        num_workers=args.num_workers
+        num_workers=args.num_workers,
+        bucket_by_size=args.bucket_by_size,
+        cache_batches=args.cache_batches,
+        shared_graphs=args.mpn_shared
     )
 
     return full_data, test_data, test_data_loader, full_to_valid_indices
@@ -110,6 +115,91 @@ def set_features(args: PredictArgs, train_args: TrainArgs):
         set_reaction(True, train_args.reaction_mode)
 
 
+def normalize_test_features(args: PredictArgs, train_args: TrainArgs, test_data: MoleculeDataset,
+                            scaler_list: List[StandardScaler]):
+    """
+    Function to normalize the features of the test data with the scalers of a model.
+
+    :param args: A :class:`~mixprop.args.PredictArgs` object containing arguments for
+                 loading data and a model and making predictions.
+    :param train_args: A :class:`~mixprop.args.TrainArgs` object containing arguments for training the model.
+    :param test_data: A :class:`~mixprop.data.MoleculeDataset` containing valid datapoints.
+    :param scaler_list: The scalers of the model as returned by :meth:`~mixprop.utils.load_scalers`.
+    """
+    scaler, features_scaler, atom_descriptor_scaler, bond_feature_scaler = scaler_list
+
+    if args.features_scaling or train_args.atom_descriptor_scaling or train_args.bond_feature_scaling:
+        test_data.reset_features_and_targets()
+        if args.features_scaling:
+            test_data.normalize_features(features_scaler)
+        if train_args.atom_descriptor_scaling and args.atom_descriptors is not None:
+            test_data.normalize_features(atom_descriptor_scaler, scale_atom_descriptors=True)
+        if train_args.bond_feature_scaling and args.bond_features_size > 0:
+            test_data.normalize_features(bond_feature_scaler, scale_bond_features=True)
+
+
+def ensemble_predictions(args: PredictArgs, train_args: TrainArgs, test_data: MoleculeDataset,
+                         test_data_loader: MoleculeDataLoader, models: List[MoleculeModel],
+                         scalers: List[List[StandardScaler]]) -> Iterator[List[List[float]]]:
+    r"""
+    Function to predict with each model of an ensemble in turn.
+
+    :param args: A :class:`~mixprop.args.PredictArgs` object containing arguments for
+                 loading data and a model and making predictions.
+    :param train_args: A :class:`~mixprop.args.TrainArgs` object containing arguments for training the model.
+    :param test_data: A :class:`~mixprop.data.MoleculeDataset` containing valid datapoints.
+    :param test_data_loader: A :class:`~mixprop.data.MoleculeDataLoader` to load the test data.
+    :param models: A list or generator object of :class:`~mixprop.models.MoleculeModel`\ s.
+    :param scalers: A list or generator object of :class:`~mixprop.features.scaler.StandardScaler` objects.
+    :return: A generator of the predictions of each model.
+    """
+    for model, scaler_list in zip(models, scalers):
+        # Normalize features
+        normalize_test_features(args, train_args, test_data, scaler_list)
+
+        # Make predictions
+        yield predict(
+            model=model,
+            data_loader=test_data_loader,
+            scaler=scaler_list[0]
+        )
+
+
+def stacked_ensemble_predictions(args: PredictArgs, train_args: TrainArgs, test_data: MoleculeDataset,
+                                 test_data_loader: MoleculeDataLoader, models: List[MoleculeModel],
+                                 scalers: List[List[StandardScaler]]) -> Iterator[List[List[float]]]:
+    r"""
+    Function to predict with all models of an ensemble in a single batched forward pass.
+
+    :param args: A :class:`~mixprop.args.PredictArgs` object containing arguments for
+                 loading data and a model and making predictions.
+    :param train_args: A :class:`~mixprop.args.TrainArgs` object containing arguments for training the model.
+    :param test_data: A :class:`~mixprop.data.MoleculeDataset` containing valid datapoints.
+    :param test_data_loader: A :class:`~mixprop.data.MoleculeDataLoader` to load the test data.
+    :param models: A list or generator object of :class:`~mixprop.models.MoleculeModel`\ s.
+    :param scalers: A list or generator object of :class:`~mixprop.features.scaler.StandardScaler` objects.
+    :return: A generator of the predictions of each model.
+    """
+    models, scalers = list(models), list(scalers)
+
+    # All models see the same inputs, so their feature scalers must agree
+    for scaler_list in scalers[1:]:
+        for scaler, first_scaler in zip(scaler_list[1:], scalers[0][1:]):
+            if (scaler is None) != (first_scaler is None) or (scaler is not None and not (
+                    np.array_equal(scaler.means, first_scaler.means, equal_nan=True)
+                    and np.array_equal(scaler.stds, first_scaler.stds, equal_nan=True))):
+                raise ValueError('A stacked ensemble requires all models to use the same feature scalers.')
+    normalize_test_features(args, train_args, test_data, scalers[0])
+
+    all_model_preds = predict_ensemble(
+        ensemble=MoleculeEnsemble(models),
+        data_loader=test_data_loader,
+        scalers=[scaler_list[0] for scaler_list in scalers]
+    )
+    for model_preds in all_model_preds:
+        yield model_preds.tolist()
+
+
 def predict_and_save(args: PredictArgs, train_args: TrainArgs, test_data: MoleculeDataset,
                      task_names: List[str], num_tasks: int, test_data_loader: MoleculeDataLoader, full_data: MoleculeDataset,
                      full_to_valid_indices: dict, models: List[MoleculeModel], scalers: List[List[StandardScaler]],
@@ -144,25 +234,12 @@ def predict_and_save(args: PredictArgs, train_args: TrainArgs, test_data: Molecu
 
     # Partial results for variance robust calculation.
     print(f'Predicting with an ensemble of {len(args.checkpoint_paths)} models')
-    for index, (model, scaler_list) in enumerate(tqdm(zip(models, scalers), total=len(args.checkpoint_paths))):
-        scaler, features_scaler, atom_descriptor_scaler, bond_feature_scaler = scaler_list
-
-        # Normalize features
-        if args.features_scaling or train_args.atom_descriptor_scaling or train_args.bond_feature_scaling:
-            test_data.reset_features_and_targets()
-            if args.features_scaling:
-                test_data.normalize_features(features_scaler)
-            if train_args.atom_descriptor_scaling and args.atom_descriptors is not None:
-                test_data.normalize_features(atom_descriptor_scaler, scale_atom_descriptors=True)
-            if train_args.bond_feature_scaling and args.bond_features_size > 0:
-                test_data.normalize_features(bond_feature_scaler, scale_bond_features=True)
+    if args.stacked_ensemble:
+        model_preds_iter = stacked_ensemble_predictions(args, train_args, test_data, test_data_loader, models, scalers)
+    else:
+        model_preds_iter = ensemble_predictions(args, train_args, test_data, test_data_loader, models, scalers)
 
-        # Make predictions
-        model_preds = predict(
-            model=model,
-            data_loader=test_data_loader,
-            scaler=scaler
-        )
+    for index, model_preds in enumerate(tqdm(model_preds_iter, total=len(args.checkpoint_paths))):
         if args.dataset_type == 'spectra':
             model_preds = normalize_spectra(
                 spectra=model_preds,
@@ -200,8 +277,9 @@ def predict_and_save(args: PredictArgs, train_args: TrainArgs, test_data: Molecu
         task_names = [f'{name}_class_{i}' for name in task_names for i in range(args.multiclass_num_classes)]
         num_tasks = num_tasks * args.multiclass_num_classes
 
-    # Copy predictions over to full_data
-    for full_index, datapoint in enumerate(full_data):
+    # Copy predictions over to full_data, whose datapoints are built once if it is stored column-wise
+    datapoints = list(full_data)
+    for full_index, datapoint in enumerate(datapoints):
         valid_index = full_to_valid_indices.get(full_index, None)
         preds = avg_preds[valid_index] if valid_index is not None else ['Invalid SMILES'] * num_tasks
         if args.ensemble_variance:
@@ -244,10 +322,10 @@ def predict_and_save(args: PredictArgs, train_args: TrainArgs, test_data: Molecu
 
     # Save
     with open(args.preds_path, 'w') as f:
-        writer = csv.DictWriter(f, fieldnames=full_data[0].row.keys())
+        writer = csv.DictWriter(f, fieldnames=datapoints[0].row.keys())
         writer.writeheader()
 
-        for datapoint in full_data:
+        for datapoint in datapoints:
             writer.writerow(datapoint.row)
 
     # Return predicted values
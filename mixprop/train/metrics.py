@@ -5,8 +5,7 @@ import torch
 import numpy as np
 import torch.nn as nn
 
-from sklearn.metrics import auc, mean_absolute_error, mean_squared_error, precision_recall_curve, r2_score,\
-    roc_auc_score, accuracy_score, log_loss, f1_score, matthews_corrcoef
+# scikit-learn is imported inside the metric functions since it is slow to import and not needed for predictions
 
 
 def get_metric_func(metric: str) -> Callable[[Union[List[int], List[float]], List[float]], float]:
@@ -30,6 +29,8 @@ def get_metric_func(metric: str) -> Callable[[Union[List[int], List[float]], Lis
     :param metric: Metric name.
     :return: A metric function which takes as arguments a list of targets and a list of predictions and returns.
     """
+    from sklearn.metrics import log_loss, mean_absolute_error, mean_squared_error, r2_score, roc_auc_score
+
     if metric == 'auc':
         return roc_auc_score
 
@@ -89,6 +90,8 @@ def prc_auc(targets: List[int], preds: List[float]) -> float:
     :param preds: A list of prediction probabilities.
     :return: The computed prc-auc.
     """
+    from sklearn.metrics import auc, precision_recall_curve
+
     precision, recall, _ = precision_recall_curve(targets, preds)
     return auc(recall, precision)
 
@@ -116,6 +119,8 @@ def rmse(targets: List[float], preds: List[float]) -> float:
     :param preds: A list of predictions.
     :return: The computed rmse.
     """
+    from sklearn.metrics import mean_squared_error
+
     return mean_squared_error(targets, preds, squared=False)
 
 
@@ -129,6 +134,8 @@ def bounded_rmse(targets: List[float], preds: List[float], gt_targets: List[bool
     :param lt_targets: A list of booleans indicating whether the target is a <target inequality.
     :return: The computed rmse.
     """
+    from sklearn.metrics import mean_squared_error
+
     # When the target is a greater-than-inequality and the prediction is greater than the target,
     # replace the prediction with the target. Analogous for less-than-inequalities.
     preds = np.where(
@@ -154,6 +161,8 @@ def bounded_mse(targets: List[float], preds: List[float], gt_targets: List[bool]
     :param lt_targets: A list of booleans indicating whether the target is a <target inequality.
     :return: The computed mse.
     """
+    from sklearn.metrics import mean_squared_error
+
     # When the target is a greater-than-inequality and the prediction is greater than the target,
     # replace the prediction with the target. Analogous for less-than-inequalities.
     preds = np.where(
@@ -179,6 +188,8 @@ def bounded_mae(targets: List[float], preds: List[float], gt_targets: List[bool]
     :param lt_targets: A list of booleans indicating whether the target is a <target inequality.
     :return: The computed mse.
     """
+    from sklearn.metrics import mean_absolute_error
+
     # When the target is a greater-than-inequality and the prediction is greater than the target,
     # replace the prediction with the target. Analogous for less-than-inequalities.
     preds = np.where(
@@ -205,6 +216,8 @@ def accuracy(targets: List[int], preds: Union[List[float], List[List[float]]], t
     :param threshold: The threshold above which a prediction is a 1 and below which (inclusive) a prediction is a 0.
     :return: The computed accuracy.
     """
+    from sklearn.metrics import accuracy_score
+
     if type(preds[0]) == list:  # multiclass
         hard_preds = [p.index(max(p)) for p in preds]
     else:
@@ -224,6 +237,8 @@ def f1_metric(targets: List[int], preds: Union[List[float], List[List[float]]],
     :param threshold: The threshold above which a prediction is a 1 and below which (inclusive) a prediction is a 0.
     :return: The computed f1 score.
     """
+    from sklearn.metrics import f1_score
+
     if type(preds[0]) == list:  # multiclass
         hard_preds = [p.index(max(p)) for p in preds]
         score = f1_score(targets, hard_preds, average='micro')
@@ -245,6 +260,8 @@ def mcc_metric(targets: List[int], preds: Union[List[float], List[List[float]]],
     :param threshold: The threshold above which a prediction is a 1 and below which (inclusive) a prediction is a 0.
     :return: The computed accuracy.
     """
+    from sklearn.metrics import matthews_corrcoef
+
     if type(preds[0]) == list:  # multiclass
         hard_preds = [p.index(max(p)) for p in preds]
     else:
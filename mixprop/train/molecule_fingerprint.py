@@ -6,7 +6,7 @@ import numpy as np
 from tqdm import tqdm
 
 from mixprop.args import FingerprintArgs, TrainArgs
-from mixprop.data import get_data, get_data_from_smiles, MoleculeDataLoader, MoleculeDataset
+from mixprop.data import get_data, get_data_from_smiles, MoleculeDataLoader, MoleculeDataset, precompute_graphs
 from mixprop.utils import load_args, load_checkpoint, makedirs, timeit, load_scalers, update_prediction_args
 from mixprop.data import MoleculeDataLoader, MoleculeDataset
 from mixprop.features import set_reaction, set_explicit_h, set_adding_hs, reset_featurization_parameters, set_extra_atom_fdim, set_extra_bond_fdim
@@ -58,29 +58,33 @@ def molecule_fingerprint(args: FingerprintArgs, smiles: List[List[str]] = None)
         )
     else:
         full_data = get_data(path=args.test_path, smiles_columns=args.smiles_columns, target_columns=[], ignore_columns=[], skip_invalid_smiles=False,
-                             args=args, store_row=True)
+                             args=args, store_row=True, columnar=False)
 
     print('Validating SMILES')
     full_to_valid_indices = {}
     valid_index = 0
-    for full_index in range(len(full_data)):
-        if all(mol is not None for mol in full_data[full_index].mol):
+    for full_index, mols in enumerate(full_data.mols()):
+        if all(mol is not None for mol in mols):
             full_to_valid_indices[full_index] = valid_index
             valid_index += 1
 
-    test_data = MoleculeDataset([full_data[i] for i in sorted(full_to_valid_indices.keys())])
+    test_data = full_data.subset(sorted(full_to_valid_indices.keys()))
 
     # Edge case if empty list of smiles is provided
     if len(test_data) == 0:
         return [None] * len(full_data)
 
     print(f'Test size = {len(test_data):,}')
+    precompute_graphs(test_data, num_workers=args.featurization_workers, chunk_size=args.featurization_chunk_size)
 
     # Create data loader
     test_data_loader = MoleculeDataLoader(
         dataset=test_data,
         batch_size=args.batch_size,
-        num_workers=args.num_workers
+        num_workers=args.num_workers,
+        bucket_by_size=args.bucket_by_size,
+        cache_batches=args.cache_batches,
+        shared_graphs=args.mpn_shared
     )
 
     # Set fingerprint size
@@ -195,7 +199,7 @@ def model_fingerprint(model: MoleculeModel,
         # Prepare batch
         batch: MoleculeDataset
         mol_batch, features_batch, atom_descriptors_batch, atom_features_batch, bond_features_batch = \
-            batch.batch_graph(), batch.features(), batch.atom_descriptors(), batch.atom_features(), batch.bond_features()
+            batch.batch_graph(), batch.features_tensor(), batch.atom_descriptors(), batch.atom_features(), batch.bond_features()
 
         # Make predictions
         with torch.no_grad():
@@ -207,6 +211,9 @@ def model_fingerprint(model: MoleculeModel,
 
         fingerprints.extend(batch_fp)
 
+    if isinstance(data_loader, MoleculeDataLoader):
+        fingerprints = data_loader.restore_order(fingerprints)
+
     return fingerprints
 
 def mixprop_fingerprint() -> None:
@@ -1,10 +1,11 @@
 from typing import List
 
+import numpy as np
 import torch
 from tqdm import tqdm
 
 from mixprop.data import MoleculeDataLoader, MoleculeDataset, StandardScaler
-from mixprop.models import MoleculeModel
+from mixprop.models import MoleculeEnsemble, MoleculeModel
 
 
 def predict(model: MoleculeModel,
@@ -27,8 +28,14 @@ def predict(model: MoleculeModel,
     for batch in tqdm(data_loader, disable=disable_progress_bar, leave=False):
         # Prepare batch
         batch: MoleculeDataset
-        mol_batch, features_batch, atom_descriptors_batch, atom_features_batch, bond_features_batch = \
-            batch.batch_graph(), batch.features(), batch.atom_descriptors(), batch.atom_features(), batch.bond_features()
+        features_batch, atom_descriptors_batch, atom_features_batch, bond_features_batch = \
+            batch.features_tensor(), batch.atom_descriptors(), batch.atom_features(), batch.bond_features()
+
+        # The embedding cache looks molecules up by SMILES, so it is passed the molecules instead of their graphs
+        if model.encoder.embedding_cache is not None:
+            mol_batch = batch.mols()
+        else:
+            mol_batch = batch.batch_graph()
 
 
         # Make predictions
@@ -46,4 +53,50 @@ def predict(model: MoleculeModel,
         batch_preds = batch_preds.tolist()
         preds.extend(batch_preds)
 
+    if isinstance(data_loader, MoleculeDataLoader):
+        preds = data_loader.restore_order(preds)
+
+    return preds
+
+
+def predict_ensemble(ensemble: MoleculeEnsemble,
+                     data_loader: MoleculeDataLoader,
+                     disable_progress_bar: bool = False,
+                     scalers: List[StandardScaler] = None) -> np.ndarray:
+    """
+    Makes predictions on a dataset with every member of a stacked ensemble in a single pass over the data.
+
+    :param ensemble: A :class:`~mixprop.models.ensemble.MoleculeEnsemble`.
+    :param data_loader: A :class:`~mixprop.data.data.MoleculeDataLoader`.
+    :param disable_progress_bar: Whether to disable the progress bar.
+    :param scalers: A list with the :class:`~mixprop.features.scaler.StandardScaler` fit on the training targets
+                    of each member of the ensemble.
+    :return: A numpy array of shape :code:`(num_models, num_molecules, num_tasks)` containing the predictions
+             of each member of the ensemble.
+    """
+    preds = []
+
+    for batch in tqdm(data_loader, disable=disable_progress_bar, leave=False):
+        # Prepare batch
+        batch: MoleculeDataset
+        mol_batch, features_batch, atom_descriptors_batch, atom_features_batch, bond_features_batch = \
+            batch.batch_graph(), batch.features_tensor(), batch.atom_descriptors(), batch.atom_features(), batch.bond_features()
+
+        # Make predictions
+        with torch.no_grad():
+            batch_preds = ensemble(mol_batch, features_batch, atom_descriptors_batch,
+                                   atom_features_batch, bond_features_batch)
+
+        preds.append(batch_preds.data.cpu().numpy())
+
+    preds = np.concatenate(preds, axis=1)
+
+    if isinstance(data_loader, MoleculeDataLoader):
+        preds = data_loader.restore_order(preds, axis=1)
+
+    # Inverse scale if regression
+    if scalers is not None:
+        preds = np.array([scaler.inverse_transform(model_preds) if scaler is not None else model_preds
+                          for scaler, model_preds in zip(scalers, preds)])
+
     return preds
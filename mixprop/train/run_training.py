@@ -1,11 +1,11 @@
 import json
 from logging import Logger
+from multiprocessing import get_context
 import os
-from typing import Dict, List
+from typing import Callable, Dict, List, Optional, Tuple
 
 import numpy as np
 import pandas as pd
-from tensorboardX import SummaryWriter
 import torch
 from tqdm import trange
 from torch.optim.lr_scheduler import ExponentialLR
@@ -17,7 +17,8 @@ from .loss_functions import get_loss_func
 from mixprop.spectra_utils import normalize_spectra, load_phase_mask
 from mixprop.args import TrainArgs
 from mixprop.constants import MODEL_FILE_NAME
-from mixprop.data import get_class_sizes, get_data, MoleculeDataLoader, MoleculeDataset, set_cache_graph, split_data
+from mixprop.data import get_class_sizes, get_data, MoleculeDataLoader, MoleculeDataset, set_cache_graph, split_data, \
+    precompute_graphs, StandardScaler
 from mixprop.models import MoleculeModel
 from mixprop.nn_utils import param_count, param_count_all
 from mixprop.utils import build_optimizer, build_lr_scheduler, load_checkpoint, makedirs, \
@@ -182,6 +183,16 @@ def run_training(args: TrainArgs,
         set_cache_graph(False)
         num_workers = args.num_workers
 
+    # Ensemble members and folds trained in parallel run in daemonic processes, which cannot start processes
+    # of their own, so DataLoader workers are not used and folds featurize molecules in their own process
+    if args.ensemble_workers > 0 or args.fold_workers > 0:
+        num_workers = 0
+    featurization_workers = args.featurization_workers if args.fold_workers == 0 else 0
+
+    # Featurize the unique molecules once, before any DataLoader workers are started
+    for dataset in (train_data, val_data, test_data):
+        precompute_graphs(dataset, num_workers=featurization_workers, chunk_size=args.featurization_chunk_size)
+
     # Create data loaders
     train_data_loader = MoleculeDataLoader(
         dataset=train_data,
@@ -189,151 +200,45 @@ def run_training(args: TrainArgs,
         num_workers=num_workers,
         class_balance=args.class_balance,
         shuffle=True,
-        seed=args.seed
+        seed=args.seed,
+        bucket_by_size=args.bucket_by_size,
+        shared_graphs=args.mpn_shared
     )
     val_data_loader = MoleculeDataLoader(
         dataset=val_data,
         batch_size=args.batch_size,
-        num_workers=num_workers
+        num_workers=num_workers,
+        bucket_by_size=args.bucket_by_size,
+        cache_batches=args.cache_batches,
+        shared_graphs=args.mpn_shared
     )
     test_data_loader = MoleculeDataLoader(
         dataset=test_data,
         batch_size=args.batch_size,
-        num_workers=num_workers
+        num_workers=num_workers,
+        bucket_by_size=args.bucket_by_size,
+        cache_batches=args.cache_batches,
+        shared_graphs=args.mpn_shared
     )
 
     if args.class_balance:
         debug(f'With class_balance, effective train size = {train_data_loader.iter_size:,}')
 
-    # Train ensemble of models
-    for model_idx in range(args.ensemble_size):
-        # Tensorboard writer
-        save_dir = os.path.join(args.save_dir, f'model_{model_idx}')
-        makedirs(save_dir)
-        try:
-            writer = SummaryWriter(log_dir=save_dir)
-        except:
-            writer = SummaryWriter(logdir=save_dir)
-
-        # Load/build model
-        if args.checkpoint_paths is not None:
-            debug(f'Loading model {model_idx} from {args.checkpoint_paths[model_idx]}')
-            model = load_checkpoint(args.checkpoint_paths[model_idx], logger=logger)
-        else:
-            debug(f'Building model {model_idx}')
-            model = MoleculeModel(args)
-            
-        # Optionally, overwrite weights:
-        if args.checkpoint_frzn is not None:
-            debug(f'Loading and freezing parameters from {args.checkpoint_frzn}.')
-            model = load_frzn_model(model=model,path=args.checkpoint_frzn, current_args=args, logger=logger)     
-        
-        debug(model)
-        
-        if args.checkpoint_frzn is not None:
-            debug(f'Number of unfrozen parameters = {param_count(model):,}')
-            debug(f'Total number of parameters = {param_count_all(model):,}')
-        else:
-            debug(f'Number of parameters = {param_count_all(model):,}')
-        
-        if args.cuda:
-            debug('Moving model to cuda')
-        model = model.to(args.device)
-
-        # Ensure that model is saved in correct location for evaluation if 0 epochs
-        save_checkpoint(os.path.join(save_dir, MODEL_FILE_NAME), model, scaler,
-                        features_scaler, atom_descriptor_scaler, bond_feature_scaler, args)
-
-        # Optimizers
-        optimizer = build_optimizer(model, args)
-
-        # Learning rate schedulers
-        scheduler = build_lr_scheduler(optimizer, args)
-
-        # Run training
-        best_score = float('inf') if args.minimize_score else -float('inf')
-        best_epoch, n_iter = 0, 0
-        for epoch in trange(args.epochs):
-            debug(f'Epoch {epoch}')
-            n_iter = train(
-                model=model,
-                data_loader=train_data_loader,
-                loss_func=loss_func,
-                optimizer=optimizer,
-                scheduler=scheduler,
-                args=args,
-                n_iter=n_iter,
-                logger=logger,
-                writer=writer
-            )
-            if isinstance(scheduler, ExponentialLR):
-                scheduler.step()
-            val_scores = evaluate(
-                model=model,
-                data_loader=val_data_loader,
-                num_tasks=args.num_tasks,
-                metrics=args.metrics,
-                dataset_type=args.dataset_type,
-                scaler=scaler,
-                logger=logger
-            )
+    if args.bucket_by_size:
+        debug(f'Padding efficiency of the training batches = {train_data_loader.padding_efficiency:.1%}')
 
-            for metric, scores in val_scores.items():
-                # Average validation score
-                avg_val_score = np.nanmean(scores)
-                debug(f'Validation {metric} = {avg_val_score:.6f}')
-                writer.add_scalar(f'validation_{metric}', avg_val_score, n_iter)
-
-                if args.show_individual_scores:
-                    # Individual validation scores
-                    for task_name, val_score in zip(args.task_names, scores):
-                        debug(f'Validation {task_name} {metric} = {val_score:.6f}')
-                        writer.add_scalar(f'validation_{task_name}_{metric}', val_score, n_iter)
-
-            # Save model checkpoint if improved validation score
-            avg_val_score = np.nanmean(val_scores[args.metric])
-            if args.minimize_score and avg_val_score < best_score or \
-                    not args.minimize_score and avg_val_score > best_score:
-                best_score, best_epoch = avg_val_score, epoch
-                save_checkpoint(os.path.join(save_dir, MODEL_FILE_NAME), model, scaler, features_scaler,
-                                atom_descriptor_scaler, bond_feature_scaler, args)
-
-        # Evaluate on test set using model with best validation score
-        info(f'Model {model_idx} best validation {args.metric} = {best_score:.6f} on epoch {best_epoch}')
-        model = load_checkpoint(os.path.join(save_dir, MODEL_FILE_NAME), device=args.device, logger=logger)
-
-        test_preds = predict(
-            model=model,
-            data_loader=test_data_loader,
-            scaler=scaler
-        )
-        test_scores = evaluate_predictions(
-            preds=test_preds,
-            targets=test_targets,
-            num_tasks=args.num_tasks,
-            metrics=args.metrics,
-            dataset_type=args.dataset_type,
-            gt_targets=test_data.gt_targets(),
-            lt_targets=test_data.lt_targets(),
-            logger=logger
-        )
+    # Train ensemble of models
+    member_args = (args, train_data_loader, val_data_loader, test_data_loader, test_data, test_targets, loss_func,
+                   scaler, features_scaler, atom_descriptor_scaler, bond_feature_scaler, logger)
+    if args.ensemble_workers > 0:
+        all_test_preds = train_ensemble_members_in_parallel(member_args, args.ensemble_size, args.ensemble_workers)
+    else:
+        all_test_preds = [train_ensemble_member(model_idx, *member_args) for model_idx in range(args.ensemble_size)]
 
+    for test_preds in all_test_preds:
         if len(test_preds) != 0:
             sum_test_preds += np.array(test_preds)
 
-        # Average test score
-        for metric, scores in test_scores.items():
-            avg_test_score = np.nanmean(scores)
-            info(f'Model {model_idx} test {metric} = {avg_test_score:.6f}')
-            writer.add_scalar(f'test_{metric}', avg_test_score, 0)
-
-            if args.show_individual_scores and args.dataset_type != 'spectra':
-                # Individual test scores
-                for task_name, test_score in zip(args.task_names, scores):
-                    info(f'Model {model_idx} test {task_name} {metric} = {test_score:.6f}')
-                    writer.add_scalar(f'test_{task_name}_{metric}', test_score, n_iter)
-        writer.close()
-
     # Evaluate ensemble on test set
     avg_test_preds = (sum_test_preds / args.ensemble_size).tolist()
 
@@ -372,3 +277,226 @@ def run_training(args: TrainArgs,
         test_preds_dataframe.to_csv(os.path.join(args.save_dir, 'test_preds.csv'), index=False)
 
     return ensemble_scores
+
+
+def train_ensemble_member(model_idx: int,
+                          args: TrainArgs,
+                          train_data_loader: MoleculeDataLoader,
+                          val_data_loader: MoleculeDataLoader,
+                          test_data_loader: MoleculeDataLoader,
+                          test_data: MoleculeDataset,
+                          test_targets: List[List[Optional[float]]],
+                          loss_func: Callable,
+                          scaler: StandardScaler = None,
+                          features_scaler: StandardScaler = None,
+                          atom_descriptor_scaler: StandardScaler = None,
+                          bond_feature_scaler: StandardScaler = None,
+                          logger: Logger = None) -> List[List[float]]:
+    """
+    Trains one model of an ensemble, saves the checkpoint with the best validation score to
+    :code:`model_{model_idx}` in :code:`args.save_dir` and evaluates it on the test set.
+
+    :param model_idx: The index of the model in the ensemble.
+    :param args: A :class:`~mixprop.args.TrainArgs` object containing arguments for training the model.
+    :param train_data_loader: A :class:`~mixprop.data.MoleculeDataLoader` for the training data.
+    :param val_data_loader: A :class:`~mixprop.data.MoleculeDataLoader` for the validation data.
+    :param test_data_loader: A :class:`~mixprop.data.MoleculeDataLoader` for the test data.
+    :param test_data: The :class:`~mixprop.data.MoleculeDataset` of the test data.
+    :param test_targets: The targets of the test data.
+    :param loss_func: The loss function.
+    :param scaler: The :class:`~mixprop.data.StandardScaler` fit on the training targets.
+    :param features_scaler: The :class:`~mixprop.data.StandardScaler` fit on the training features.
+    :param atom_descriptor_scaler: The :class:`~mixprop.data.StandardScaler` fit on the training atom descriptors.
+    :param bond_feature_scaler: The :class:`~mixprop.data.StandardScaler` fit on the training bond features.
+    :param logger: A logger to record output.
+    :return: The predictions of the model on the test data.
+    """
+    if logger is not None:
+        debug, info = logger.debug, logger.info
+    else:
+        debug = info = print
+
+    # Tensorboard writer
+    save_dir = os.path.join(args.save_dir, f'model_{model_idx}')
+    makedirs(save_dir)
+    from tensorboardX import SummaryWriter  # imported here since it is slow to import and only needed for training
+    try:
+        writer = SummaryWriter(log_dir=save_dir)
+    except:
+        writer = SummaryWriter(logdir=save_dir)
+
+    # Load/build model
+    if args.checkpoint_paths is not None:
+        debug(f'Loading model {model_idx} from {args.checkpoint_paths[model_idx]}')
+        model = load_checkpoint(args.checkpoint_paths[model_idx], logger=logger)
+    else:
+        debug(f'Building model {model_idx}')
+        model = MoleculeModel(args)
+
+    # Optionally, overwrite weights:
+    if args.checkpoint_frzn is not None:
+        debug(f'Loading and freezing parameters from {args.checkpoint_frzn}.')
+        model = load_frzn_model(model=model,path=args.checkpoint_frzn, current_args=args, logger=logger)     
+
+    debug(model)
+
+    if args.checkpoint_frzn is not None:
+        debug(f'Number of unfrozen parameters = {param_count(model):,}')
+        debug(f'Total number of parameters = {param_count_all(model):,}')
+    else:
+        debug(f'Number of parameters = {param_count_all(model):,}')
+
+    if args.cuda:
+        debug('Moving model to cuda')
+    model = model.to(args.device)
+
+    # Ensure that model is saved in correct location for evaluation if 0 epochs
+    save_checkpoint(os.path.join(save_dir, MODEL_FILE_NAME), model, scaler,
+                    features_scaler, atom_descriptor_scaler, bond_feature_scaler, args)
+
+    # Optimizers
+    optimizer = build_optimizer(model, args)
+
+    # Learning rate schedulers
+    scheduler = build_lr_scheduler(optimizer, args)
+
+    # Run training
+    best_score = float('inf') if args.minimize_score else -float('inf')
+    best_epoch, n_iter = 0, 0
+    for epoch in trange(args.epochs):
+        debug(f'Epoch {epoch}')
+        n_iter = train(
+            model=model,
+            data_loader=train_data_loader,
+            loss_func=loss_func,
+            optimizer=optimizer,
+            scheduler=scheduler,
+            args=args,
+            n_iter=n_iter,
+            logger=logger,
+            writer=writer
+        )
+        if isinstance(scheduler, ExponentialLR):
+            scheduler.step()
+        val_scores = evaluate(
+            model=model,
+            data_loader=val_data_loader,
+            num_tasks=args.num_tasks,
+            metrics=args.metrics,
+            dataset_type=args.dataset_type,
+            scaler=scaler,
+            logger=logger
+        )
+
+        for metric, scores in val_scores.items():
+            # Average validation score
+            avg_val_score = np.nanmean(scores)
+            debug(f'Validation {metric} = {avg_val_score:.6f}')
+            writer.add_scalar(f'validation_{metric}', avg_val_score, n_iter)
+
+            if args.show_individual_scores:
+                # Individual validation scores
+                for task_name, val_score in zip(args.task_names, scores):
+                    debug(f'Validation {task_name} {metric} = {val_score:.6f}')
+                    writer.add_scalar(f'validation_{task_name}_{metric}', val_score, n_iter)
+
+        # Save model checkpoint if improved validation score
+        avg_val_score = np.nanmean(val_scores[args.metric])
+        if args.minimize_score and avg_val_score < best_score or \
+                not args.minimize_score and avg_val_score > best_score:
+            best_score, best_epoch = avg_val_score, epoch
+            save_checkpoint(os.path.join(save_dir, MODEL_FILE_NAME), model, scaler, features_scaler,
+                            atom_descriptor_scaler, bond_feature_scaler, args)
+
+    # Evaluate on test set using model with best validation score
+    info(f'Model {model_idx} best validation {args.metric} = {best_score:.6f} on epoch {best_epoch}')
+    model = load_checkpoint(os.path.join(save_dir, MODEL_FILE_NAME), device=args.device, logger=logger)
+
+    test_preds = predict(
+        model=model,
+        data_loader=test_data_loader,
+        scaler=scaler
+    )
+    test_scores = evaluate_predictions(
+        preds=test_preds,
+        targets=test_targets,
+        num_tasks=args.num_tasks,
+        metrics=args.metrics,
+        dataset_type=args.dataset_type,
+        gt_targets=test_data.gt_targets(),
+        lt_targets=test_data.lt_targets(),
+        logger=logger
+    )
+
+    # Average test score
+    for metric, scores in test_scores.items():
+        avg_test_score = np.nanmean(scores)
+        info(f'Model {model_idx} test {metric} = {avg_test_score:.6f}')
+        writer.add_scalar(f'test_{metric}', avg_test_score, 0)
+
+        if args.show_individual_scores and args.dataset_type != 'spectra':
+            # Individual test scores
+            for task_name, test_score in zip(args.task_names, scores):
+                info(f'Model {model_idx} test {task_name} {metric} = {test_score:.6f}')
+                writer.add_scalar(f'test_{task_name}_{metric}', test_score, n_iter)
+    writer.close()
+
+    return test_preds
+
+
+# Arguments of train_ensemble_member, inherited by the forked processes which train ensemble members in parallel
+ENSEMBLE_MEMBER_ARGS = None
+
+
+def set_torch_threads(num_threads: int) -> None:
+    """
+    Sets the number of threads used by PyTorch in a worker process.
+
+    :param num_threads: The number of threads.
+    """
+    torch.set_num_threads(num_threads)
+
+
+def _train_ensemble_member_in_worker(model_idx: int) -> List[List[float]]:
+    args, train_data_loader = ENSEMBLE_MEMBER_ARGS[0], ENSEMBLE_MEMBER_ARGS[1]
+
+    # Each model starts from its own seed, since the models are not built one after another from the same random state
+    torch.manual_seed(args.pytorch_seed + model_idx)
+
+    # The training data is shuffled once per epoch, so the sampler inherited from the parent process is advanced
+    # to the state in which sequential training would start this model, which then sees the same batches
+    for _ in range(model_idx * args.epochs):
+        iter(train_data_loader.sampler)
+
+    return train_ensemble_member(model_idx, *ENSEMBLE_MEMBER_ARGS)
+
+
+def train_ensemble_members_in_parallel(member_args: Tuple,
+                                       ensemble_size: int,
+                                       num_workers: int) -> List[List[List[float]]]:
+    """
+    Trains the models of an ensemble concurrently in forked worker processes.
+
+    The worker processes inherit the data loaders and the featurized molecules from this process, so they are
+    shared rather than copied, and the PyTorch threads of this process are divided between the workers. Each
+    model is trained in a newly forked worker, so it starts from the sampler state of this process rather than
+    from the state left by the previous model of the worker. The data loaders must not use worker processes of
+    their own.
+
+    :param member_args: The arguments of :func:`train_ensemble_member` after :code:`model_idx`.
+    :param ensemble_size: The number of models in the ensemble.
+    :param num_workers: The number of worker processes.
+    :return: A list with the test predictions of each model of the ensemble.
+    """
+    global ENSEMBLE_MEMBER_ARGS
+
+    num_workers = min(num_workers, ensemble_size)
+    num_threads = max(1, torch.get_num_threads() // num_workers)
+
+    ENSEMBLE_MEMBER_ARGS = member_args
+    try:
+        with get_context('fork').Pool(processes=num_workers, initializer=set_torch_threads,
+                                      initargs=(num_threads,), maxtasksperchild=1) as pool:
+            return pool.map(_train_ensemble_member_in_worker, range(ensemble_size), chunksize=1)
+    finally:
+        ENSEMBLE_MEMBER_ARGS = None
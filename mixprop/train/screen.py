@@ -0,0 +1,192 @@
+from typing import List
+
+import numpy as np
+import torch
+from tqdm import tqdm
+
+from mixprop.args import ScreenArgs
+from mixprop.data import StandardScaler, get_smiles
+from mixprop.features import mol2graph, reset_featurization_parameters, set_adding_hs, set_explicit_h
+from mixprop.models import MoleculeModel
+from mixprop.rdkit import make_mol
+from mixprop.utils import load_args, load_checkpoint, load_scalers, makedirs, timeit
+
+
+def encode_molecules(model: MoleculeModel,
+                     smiles: List[str],
+                     position: int,
+                     batch_size: int = 50) -> torch.FloatTensor:
+    """
+    Encodes a list of molecules with one of the encoders of a mixture model.
+
+    :param model: A :class:`~mixprop.models.model.MoleculeModel`.
+    :param smiles: A list of SMILES strings.
+    :param position: The position of the molecules in the mixture (0 or 1), which selects the encoder.
+    :param batch_size: Number of molecules encoded at once.
+    :return: A PyTorch tensor of shape :code:`(len(smiles), hidden_size)` containing the encoding of each molecule.
+    """
+    encoder = model.encoder.encoder[position]
+
+    return torch.cat([encoder(mol2graph(smiles[i:i + batch_size])) for i in range(0, len(smiles), batch_size)])
+
+
+def screen_pairs(models: List[MoleculeModel],
+                 scalers: List[StandardScaler],
+                 features_scalers: List[StandardScaler],
+                 smiles_1: List[str],
+                 smiles_2: List[str],
+                 molfrac1_values: List[float],
+                 T_values: List[float],
+                 save_path: str = None,
+                 tile_size: int = 100000,
+                 batch_size: int = 50,
+                 disable_progress_bar: bool = False) -> np.ndarray:
+    r"""
+    Predicts every mixture of a molecule from :code:`smiles_1` with a molecule from :code:`smiles_2`
+    at every combination of mole fraction and temperature.
+
+    Each molecule is encoded once per model and the feed-forward network is evaluated on tiles of
+    at most :code:`tile_size` mixture and grid point combinations. Mixtures containing an invalid
+    SMILES are set to NaN.
+
+    :param models: A list of :class:`~mixprop.models.model.MoleculeModel`\ s forming the ensemble.
+    :param scalers: The target :class:`~mixprop.data.scaler.StandardScaler` of each model.
+    :param features_scalers: The features :class:`~mixprop.data.scaler.StandardScaler` of each model.
+    :param smiles_1: SMILES of the first molecule in each mixture.
+    :param smiles_2: SMILES of the second molecule in each mixture.
+    :param molfrac1_values: Mole fractions of the first molecule.
+    :param T_values: Temperatures.
+    :param save_path: Path to a :code:`.npy` file to which the results are written tile by tile.
+                      If None, the results are kept in memory.
+    :param tile_size: Maximum number of combinations evaluated in a single feed-forward batch.
+    :param batch_size: Number of molecules encoded at once.
+    :param disable_progress_bar: Whether to disable the progress bar.
+    :return: An array of shape :code:`(len(smiles_1), len(smiles_2), len(molfrac1_values), len(T_values), 2)`
+             containing the ensemble mean and variance of the predictions.
+    """
+    num_grid = len(molfrac1_values) * len(T_values)
+    shape = (len(smiles_1), len(smiles_2), len(molfrac1_values), len(T_values), 2)
+    if save_path is not None:
+        makedirs(save_path, isfile=True)
+        results = np.lib.format.open_memmap(save_path, mode='w+', dtype=np.float32, shape=shape)
+    else:
+        results = np.zeros(shape, dtype=np.float32)
+
+    valid_1 = np.array([make_mol(smiles, False, False) is not None for smiles in smiles_1], dtype=bool)
+    valid_2 = np.array([make_mol(smiles, False, False) is not None for smiles in smiles_2], dtype=bool)
+    valid_smiles_1 = [smiles for smiles, valid in zip(smiles_1, valid_1) if valid]
+    valid_smiles_2 = [smiles for smiles, valid in zip(smiles_2, valid_2) if valid]
+
+    # Without a valid mixture or grid point there is nothing to predict
+    if len(valid_smiles_1) == 0 or len(valid_smiles_2) == 0 or num_grid == 0:
+        results[...] = np.nan
+        if save_path is not None:
+            results.flush()
+
+        return results
+
+    grid = np.array([[molfrac1, T] for molfrac1 in molfrac1_values for T in T_values], dtype=float)
+
+    # Encode each unique molecule once per model
+    embeddings, grids = [], []
+    for model, features_scaler in zip(models, features_scalers):
+        model.eval()
+        with torch.no_grad():
+            embedding_1 = encode_molecules(model, valid_smiles_1, 0, batch_size) if len(valid_smiles_1) > 0 else None
+            embedding_2 = encode_molecules(model, valid_smiles_2, 1, batch_size) if len(valid_smiles_2) > 0 else None
+        embeddings.append((embedding_1, embedding_2))
+
+        model_grid = features_scaler.transform(grid) if features_scaler is not None else grid
+        device = next(model.parameters()).device
+        grids.append(torch.tensor(model_grid, dtype=torch.float, device=device))
+
+    # Tile the valid part of the matrix so that each tile holds at most tile_size combinations
+    num_cols = min(len(valid_smiles_2), max(1, tile_size // num_grid))
+    num_rows = max(1, tile_size // (max(num_cols, 1) * num_grid))
+    tiles = [(i, j) for i in range(0, len(valid_smiles_1), num_rows) for j in range(0, len(valid_smiles_2), num_cols)]
+
+    rows_1, rows_2 = np.flatnonzero(valid_1), np.flatnonzero(valid_2)
+
+    for i, j in tqdm(tiles, disable=disable_progress_bar, total=len(tiles)):
+        all_preds = []
+        for model, scaler, (embedding_1, embedding_2), model_grid in zip(models, scalers, embeddings, grids):
+            tile_1, tile_2 = embedding_1[i:i + num_rows], embedding_2[j:j + num_cols]
+            tile_shape = (len(tile_1), len(tile_2), num_grid)
+
+            with torch.no_grad():
+                preds = model.mixture_ffn(
+                    tile_1[:, None, None, :].expand(*tile_shape, -1).reshape(-1, tile_1.shape[1]),
+                    tile_2[None, :, None, :].expand(*tile_shape, -1).reshape(-1, tile_2.shape[1]),
+                    model_grid[None, None, :, 0:1].expand(*tile_shape, 1).reshape(-1, 1),
+                    model_grid[None, None, :, 1:2].expand(*tile_shape, 1).reshape(-1, 1)
+                )
+
+            preds = preds.data.cpu().numpy()
+            if scaler is not None:
+                preds = scaler.inverse_transform(preds)
+            all_preds.append(preds[:, 0].reshape(len(tile_1), len(tile_2), len(molfrac1_values), len(T_values)))
+
+        all_preds = np.array(all_preds)  # shape(num_models, tile rows, tile cols, num molfrac1, num T)
+        tile_results = np.stack((np.mean(all_preds, axis=0), np.var(all_preds, axis=0)), axis=-1)
+
+        results[np.ix_(rows_1[i:i + num_rows], rows_2[j:j + num_cols])] = tile_results
+
+    results[~valid_1] = np.nan
+    results[:, ~valid_2] = np.nan
+
+    if save_path is not None:
+        results.flush()
+
+    return results
+
+
+@timeit()
+def run_screen(args: ScreenArgs) -> np.ndarray:
+    """
+    Loads two libraries of molecules and an ensemble of trained models and predicts all mixtures of the two libraries.
+
+    :param args: A :class:`~mixprop.args.ScreenArgs` object containing arguments for screening.
+    :return: An array of shape :code:`(num_smiles_1, num_smiles_2, num_molfrac1, num_T, 2)` containing the
+             ensemble mean and variance of the predictions.
+    """
+    train_args = load_args(args.checkpoint_paths[0])
+    if train_args.number_of_molecules != 2:
+        raise ValueError('Screening requires a model trained on mixtures of two molecules.')
+
+    reset_featurization_parameters()
+    set_explicit_h(train_args.explicit_h)
+    set_adding_hs(train_args.adding_h)
+
+    print('Loading data')
+    smiles_1 = get_smiles(path=args.smiles_path_1, flatten=True)
+    smiles_2 = get_smiles(path=args.smiles_path_2, flatten=True)
+
+    print('Loading models')
+    models = [load_checkpoint(checkpoint_path, device=args.device) for checkpoint_path in args.checkpoint_paths]
+    scalers = [load_scalers(checkpoint_path) for checkpoint_path in args.checkpoint_paths]
+
+    print(f'Screening {len(smiles_1):,} x {len(smiles_2):,} mixtures at '
+          f'{len(args.molfrac1_values) * len(args.T_values):,} grid points')
+    results = screen_pairs(
+        models=models,
+        scalers=[scaler for scaler, _, _, _ in scalers],
+        features_scalers=[features_scaler for _, features_scaler, _, _ in scalers],
+        smiles_1=smiles_1,
+        smiles_2=smiles_2,
+        molfrac1_values=args.molfrac1_values,
+        T_values=args.T_values,
+        save_path=args.save_path,
+        tile_size=args.tile_size,
+        batch_size=args.batch_size
+    )
+    print(f'Saved predictions to {args.save_path}')
+
+    return results
+
+
+def mixprop_screen() -> None:
+    """Parses mixprop screening arguments and predicts all mixtures of two libraries of molecules.
+
+    This is the entry point for the command line command :code:`mixprop_screen`.
+    """
+    run_screen(args=ScreenArgs().parse_args())
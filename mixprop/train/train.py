@@ -1,7 +1,6 @@
 import logging
-from typing import Callable
+from typing import Callable, TYPE_CHECKING
 
-from tensorboardX import SummaryWriter
 import torch
 import torch.nn as nn
 from torch.optim import Optimizer
@@ -13,6 +12,9 @@ from mixprop.data import MoleculeDataLoader, MoleculeDataset
 from mixprop.models import MoleculeModel
 from mixprop.nn_utils import compute_gnorm, compute_pnorm, NoamLR
 
+if TYPE_CHECKING:
+    from tensorboardX import SummaryWriter
+
 
 def train(model: MoleculeModel,
           data_loader: MoleculeDataLoader,
@@ -22,7 +24,7 @@ def train(model: MoleculeModel,
           args: TrainArgs,
           n_iter: int = 0,
           logger: logging.Logger = None,
-          writer: SummaryWriter = None) -> int:
+          writer: 'SummaryWriter' = None) -> int:
     """
     Trains a model for an epoch.
 
@@ -42,27 +44,23 @@ def train(model: MoleculeModel,
     model.train()
     loss_sum = iter_count = 0
 
+    # The loss tensors of the whole dataset are built once, in this process, and each batch takes its rows of them
+    data_loader.dataset.loss_tensors()
+
+    if args.target_weights is not None:
+        target_weights = torch.tensor(args.target_weights).unsqueeze(0) # shape(1,tasks)
+    else:
+        target_weights = torch.ones(data_loader.dataset.num_tasks()).unsqueeze(0)
+
     for batch in tqdm(data_loader, total=len(data_loader), leave=False):
         # Prepare batch
         batch: MoleculeDataset
-        mol_batch, features_batch, target_batch, atom_descriptors_batch, atom_features_batch, bond_features_batch, data_weights_batch = \
-            batch.batch_graph(), batch.features(), batch.targets(), batch.atom_descriptors(), \
-            batch.atom_features(), batch.bond_features(), batch.data_weights()
-
-        mask = torch.tensor([[x is not None for x in tb] for tb in target_batch], dtype=torch.bool) # shape(batch, tasks)
-        targets = torch.tensor([[0 if x is None else x for x in tb] for tb in target_batch]) # shape(batch, tasks)
+        mol_batch, features_batch, atom_descriptors_batch, atom_features_batch, bond_features_batch = \
+            batch.batch_graph(), batch.features_tensor(), batch.atom_descriptors(), \
+            batch.atom_features(), batch.bond_features()
 
-        if args.target_weights is not None:
-            target_weights = torch.tensor(args.target_weights).unsqueeze(0) # shape(1,tasks)
-        else:
-            target_weights = torch.ones(targets.shape[1]).unsqueeze(0)
-        data_weights = torch.tensor(data_weights_batch).unsqueeze(1) # shape(batch,1)
-
-        if args.loss_function == 'bounded_mse':
-            lt_target_batch = batch.lt_targets() # shape(batch, tasks)
-            gt_target_batch = batch.gt_targets() # shape(batch, tasks)
-            lt_target_batch = torch.tensor(lt_target_batch)
-            gt_target_batch = torch.tensor(gt_target_batch)
+        # shape(batch, tasks), shape(batch, tasks), shape(batch, 1), shape(batch, tasks), shape(batch, tasks)
+        targets, mask, data_weights, lt_target_batch, gt_target_batch = batch.loss_tensors()
 
         # Run model
         model.zero_grad()
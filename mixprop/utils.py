@@ -2,6 +2,7 @@ from argparse import Namespace
 import csv
 from datetime import timedelta
 from functools import wraps
+import json
 import logging
 import os
 import pickle
@@ -10,14 +11,16 @@ from time import time
 from typing import Any, Callable, List, Tuple
 import collections
 
+import numpy as np
 import torch
 import torch.nn as nn
 from torch.optim import Adam, Optimizer
 from torch.optim.lr_scheduler import _LRScheduler
 from tqdm import tqdm
 
-from mixprop.args import PredictArgs, TrainArgs, FingerprintArgs
-from mixprop.data import StandardScaler, MoleculeDataset, preprocess_smiles_columns, get_task_names
+from mixprop.args import PackArgs, PredictArgs, TrainArgs, FingerprintArgs
+from mixprop.data import StandardScaler, MoleculeDataset, preprocess_smiles_columns, get_task_names, get_smiles, \
+    BinaryDataset, is_binary_dataset
 from mixprop.models import MoleculeModel
 from mixprop.nn_utils import NoamLR
 
@@ -273,8 +276,17 @@ def load_scalers(path: str) -> Tuple[StandardScaler, StandardScaler, StandardSca
     :return: A tuple with the data :class:`~mixprop.data.scaler.StandardScaler`
              and features :class:`~mixprop.data.scaler.StandardScaler`.
     """
-    state = torch.load(path, map_location=lambda storage, loc: storage)
+    return scalers_from_state(torch.load(path, map_location=lambda storage, loc: storage))
+
 
+def scalers_from_state(state: dict) -> Tuple[StandardScaler, StandardScaler, StandardScaler, StandardScaler]:
+    r"""
+    Builds the scalers a model was trained with from the state saved in a checkpoint.
+
+    :param state: A dictionary containing the saved scaler means and standard deviations.
+    :return: A tuple with the data, features, atom descriptor and bond feature
+             :class:`~mixprop.data.scaler.StandardScaler`\ s.
+    """
     scaler = StandardScaler(state['data_scaler']['means'],
                             state['data_scaler']['stds']) if state['data_scaler'] is not None else None
     features_scaler = StandardScaler(state['features_scaler']['means'],
@@ -298,6 +310,143 @@ def load_scalers(path: str) -> Tuple[StandardScaler, StandardScaler, StandardSca
     return scaler, features_scaler, atom_descriptor_scaler, bond_feature_scaler
 
 
+PACKED_ENSEMBLE_MAGIC = b'MIXPROP_PACKED_ENSEMBLE_2'
+
+
+def save_packed_ensemble(checkpoint_paths: List[str], path: str) -> None:
+    """
+    Packs an ensemble of model checkpoints into a single file which can be memory-mapped.
+
+    The file holds the training arguments once, the scalers of every model and the weights
+    of all models in one contiguous buffer.
+
+    :param checkpoint_paths: Paths to the checkpoints of the models in the ensemble.
+    :param path: Path where the packed ensemble will be saved.
+    """
+    args = load_args(checkpoint_paths[0])
+    arrays, index, scalers = [], [], []
+    offset = 0
+
+    for checkpoint_path in checkpoint_paths:
+        state_dict = load_checkpoint(checkpoint_path, device=torch.device('cpu')).state_dict()
+        if len(index) > 0 and {name: shape for name, (_, _, shape) in index[0].items()} != \
+                {name: tuple(tensor.shape) for name, tensor in state_dict.items()}:
+            raise ValueError('All models of a packed ensemble must have the same architecture.')
+
+        model_index = {}
+        for name, tensor in state_dict.items():
+            array = tensor.detach().contiguous().numpy()
+            offset = -(-offset // 64) * 64  # align each tensor to 64 bytes
+            model_index[name] = (offset, array.dtype.str, array.shape)
+            arrays.append((offset, array))
+            offset += array.nbytes
+        index.append(model_index)
+
+        state = torch.load(checkpoint_path, map_location=lambda storage, loc: storage)
+        scalers.append({key: {'means': np.asarray(state[key]['means']).tolist(),
+                              'stds': np.asarray(state[key]['stds']).tolist()} if state.get(key) is not None else None
+                        for key in ['data_scaler', 'features_scaler', 'atom_descriptor_scaler', 'bond_feature_scaler']})
+
+    # The header is JSON rather than a pickle, so that loading a packed ensemble cannot run code
+    args = args.as_dict()
+    args['device'] = str(args['device'])
+    header = json.dumps({
+        'args': args,
+        'scalers': scalers,
+        'index': index
+    }).encode('utf-8')
+
+    # The weights start on a page boundary so that they can be memory-mapped
+    data_offset = -(-(len(PACKED_ENSEMBLE_MAGIC) + 8 + len(header)) // 4096) * 4096
+
+    makedirs(path, isfile=True)
+    with open(path, 'wb') as f:
+        f.write(PACKED_ENSEMBLE_MAGIC)
+        f.write(len(header).to_bytes(8, 'little'))
+        f.write(header)
+        for array_offset, array in arrays:
+            f.seek(data_offset + array_offset)
+            f.write(array.tobytes())
+
+
+def load_packed_ensemble(path: str,
+                         device: torch.device = None) -> Tuple[TrainArgs, List[MoleculeModel],
+                                                               List[Tuple[StandardScaler, StandardScaler,
+                                                                          StandardScaler, StandardScaler]]]:
+    r"""
+    Loads an ensemble packed with :meth:`save_packed_ensemble`.
+
+    The weights are memory-mapped copy-on-write, so loading does not copy them and processes
+    loading the same file share its pages.
+
+    :param path: Path where the packed ensemble is saved.
+    :param device: Device where the models will be moved.
+    :return: A tuple of the training arguments, the list of loaded :class:`~mixprop.models.model.MoleculeModel`\ s
+             and the scalers of each model.
+    """
+    with open(path, 'rb') as f:
+        magic = f.read(len(PACKED_ENSEMBLE_MAGIC))
+        if magic != PACKED_ENSEMBLE_MAGIC:
+            if magic.startswith(PACKED_ENSEMBLE_MAGIC[:-1]):
+                raise ValueError(f'"{path}" was packed by an older version of mixprop, please pack the checkpoints again.')
+            raise ValueError(f'"{path}" is not a packed mixprop ensemble.')
+        header_size = int.from_bytes(f.read(8), 'little')
+        header = json.loads(f.read(header_size).decode('utf-8'))
+
+    data_offset = -(-(len(PACKED_ENSEMBLE_MAGIC) + 8 + header_size) // 4096) * 4096
+    buffer = np.memmap(path, dtype=np.uint8, mode='c', offset=data_offset)
+
+    header['args']['device'] = torch.device(header['args']['device'])
+    args = TrainArgs()
+    args.from_dict(header['args'], skip_unsettable=True)
+    if device is not None:
+        args.device = device
+
+    models = []
+    for model_index in header['index']:
+        state_dict = {}
+        for name, (offset, dtype, shape) in model_index.items():
+            dtype = np.dtype(dtype)
+            num_bytes = int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+            state_dict[name] = torch.from_numpy(buffer[offset:offset + num_bytes].view(dtype).reshape(shape))
+
+        # Built without allocating weights, which are then assigned from the memory-mapped buffer
+        with torch.device('meta'):
+            model = MoleculeModel(args)
+        model.load_state_dict(state_dict, assign=True)
+        models.append(model.to(args.device))
+
+    scalers = [scalers_from_state({key: {'means': np.array(scaler['means']), 'stds': np.array(scaler['stds'])}
+                                   if scaler is not None else None for key, scaler in state.items()})
+               for state in header['scalers']]
+
+    return args, models, scalers
+
+
+def is_packed_ensemble(path: str) -> bool:
+    """
+    Checks whether a file is an ensemble packed with :meth:`save_packed_ensemble`.
+
+    :param path: Path to a file.
+    :return: Whether the file is a packed ensemble.
+    """
+    if not os.path.isfile(path):
+        return False
+    with open(path, 'rb') as f:
+        # Ensembles packed by older versions are recognized so that loading them explains how to repack them
+        return f.read(len(PACKED_ENSEMBLE_MAGIC)).startswith(PACKED_ENSEMBLE_MAGIC[:-1])
+
+
+def mixprop_pack() -> None:
+    """Packs an ensemble of model checkpoints into a single memory-mappable file.
+
+    This is the entry point for the command line command :code:`mixprop_pack`.
+    """
+    args = PackArgs().parse_args()
+    save_packed_ensemble(args.checkpoint_paths, args.save_path)
+    print(f'Packed {len(args.checkpoint_paths)} models into {args.save_path}')
+
+
 def load_args(path: str) -> TrainArgs:
     """
     Loads the arguments a model was trained with.
@@ -463,17 +612,14 @@ def save_smiles_splits(data_path: str,
     if not isinstance(smiles_columns, list):
         smiles_columns = preprocess_smiles_columns(path=data_path, smiles_columns=smiles_columns)
 
-    with open(data_path) as f:
-        reader = csv.DictReader(f)
-
-        indices_by_smiles = {}
-        for i, row in enumerate(tqdm(reader)):
-            smiles = tuple([row[column] for column in smiles_columns])
-            if smiles in indices_by_smiles:
-                save_split_indices = False
-                info('Warning: Repeated SMILES found in data, pickle file of split indices cannot distinguish entries and will not be generated.')
-                break
-            indices_by_smiles[smiles] = i
+    indices_by_smiles = {}
+    for i, smiles in enumerate(tqdm(get_smiles(path=data_path, smiles_columns=smiles_columns))):
+        smiles = tuple(smiles)
+        if smiles in indices_by_smiles:
+            save_split_indices = False
+            info('Warning: Repeated SMILES found in data, pickle file of split indices cannot distinguish entries and will not be generated.')
+            break
+        indices_by_smiles[smiles] = i
 
     if task_names is None:
         task_names = get_task_names(path=data_path, smiles_columns=smiles_columns)
@@ -481,6 +627,9 @@ def save_smiles_splits(data_path: str,
     features_header = []
     if features_path is not None:
         for feat_path in features_path:
+            if is_binary_dataset(feat_path):
+                features_header.extend(BinaryDataset(feat_path).features_columns)
+                continue
             with open(feat_path, 'r') as f:
                 reader = csv.reader(f)
                 feat_header = next(reader)
@@ -1,19 +1,26 @@
+from collections import OrderedDict
+from itertools import chain
+import threading
+
 import numpy as np
 import os
 import pandas as pd
 from pathlib import Path
-import zenodo_get as zget
+import torch
 from zipfile import ZipFile
 
-from mixprop.train import predict
-from mixprop.data import MoleculeDataset, MoleculeDataLoader, MoleculeDatapoint
-from mixprop.utils import load_args, load_checkpoint, load_scalers
+from mixprop.train import predict, predict_ensemble
+from mixprop.data import MoleculeDataset, MoleculeDataLoader, MoleculeDatapoint, cache_stats, graph_store, \
+    precompute_graphs, set_graph_cache_budget, set_graph_store, set_mol_cache_budget
+from mixprop.models import EmbeddingCache, MoleculeEnsemble
+from mixprop.utils import is_packed_ensemble, load_args, load_checkpoint, load_packed_ensemble, load_scalers
 
 from rdkit import Chem
 
 
 def download_models():
     
+    import zenodo_get as zget # only needed to download the models
     zget.zenodo_get(["-r 8042966"])
 
     with ZipFile("pretrained_models.zip","r") as zObject:
@@ -21,10 +28,136 @@ def download_models():
         zObject.extractall(path=".")
 
 
+# Inputs with at most this many rows are featurized in the calling process instead of by DataLoader workers
+WORKER_THRESHOLD = 2000
+
+
+def set_worker_threshold(num_rows):
+    """Sets the number of rows above which inputs are featurized by DataLoader worker processes."""
+    global WORKER_THRESHOLD
+    WORKER_THRESHOLD = num_rows
+
+
+# Process-wide registry of loaded ensembles, ordered from least to most recently used
+MODEL_REGISTRY = OrderedDict()
+MODEL_REGISTRY_MAX_BYTES = None
+MODEL_REGISTRY_LOCK = threading.Lock()
+
+
+def set_model_registry_budget(max_bytes):
+    """Sets the memory budget of the model registry in bytes (None means unbounded) and evicts models to fit."""
+    global MODEL_REGISTRY_MAX_BYTES
+    with MODEL_REGISTRY_LOCK:
+        MODEL_REGISTRY_MAX_BYTES = max_bytes
+        evict_models()
+
+
+def clear_model_registry():
+    """Removes all loaded ensembles from the model registry."""
+    with MODEL_REGISTRY_LOCK:
+        MODEL_REGISTRY.clear()
+
+
+def evict_models():
+    # Drops least recently used ensembles until the registry fits in its budget, always keeping the newest one
+    if MODEL_REGISTRY_MAX_BYTES is None:
+        return
+    while len(MODEL_REGISTRY) > 1 and sum(model.nbytes for model in MODEL_REGISTRY.values()) > MODEL_REGISTRY_MAX_BYTES:
+        MODEL_REGISTRY.popitem(last=False)
+
+
+def set_molecule_cache_budget(max_entries=None, max_bytes=None):
+    """
+    Sets the budget of the in-memory caches of RDKit molecules and molecular graphs of this process
+    (None means unbounded) and evicts the least recently used molecules to fit.
+    """
+    set_mol_cache_budget(max_entries=max_entries)
+    set_graph_cache_budget(max_entries=max_entries, max_bytes=max_bytes)
+
+
+def molecule_cache_stats():
+    """Returns the hits, misses, evictions and size of the molecule and graph caches of this process."""
+    return cache_stats()
+
+
+def checkpoint_dir_key(checkpoint_dir):
+    # Keyed by the checkpoint files and their modification times and sizes so that retrained models are reloaded
+    checkpoint_files = []
+    if os.path.isfile(checkpoint_dir):
+        stat = os.stat(checkpoint_dir)
+        checkpoint_files.append((checkpoint_dir, stat.st_mtime_ns, stat.st_size))
+    for root, _, files in os.walk(checkpoint_dir):
+        for fname in files:
+            if fname.endswith('.pt'):
+                fname = os.path.join(root, fname)
+                stat = os.stat(fname)
+                checkpoint_files.append((fname, stat.st_mtime_ns, stat.st_size))
+    return os.path.abspath(checkpoint_dir), tuple(sorted(checkpoint_files))
+
+
+def embedding_cache_key(args):
+    # None without an embedding cache, otherwise the directory of the cache ('' for a cache kept in memory only)
+    if args.get('embedding_cache') or args.get('embedding_cache_dir') is not None:
+        cache_dir = args.get('embedding_cache_dir')
+        return os.path.abspath(cache_dir) if cache_dir is not None else ''
+    return None
+
+
+def get_registered_model(checkpoint_dir, embedding_cache_dir=None):
+    # Ensembles with different embedding caches are registered apart, so that a call never attaches or
+    # detaches the cache of an ensemble another call is predicting with
+    key = checkpoint_dir_key(checkpoint_dir) + (embedding_cache_dir,)
+    with MODEL_REGISTRY_LOCK:
+        if key in MODEL_REGISTRY:
+            MODEL_REGISTRY.move_to_end(key)
+            return MODEL_REGISTRY[key]
+
+    # Checkpoints are loaded without holding the lock so that callers of other ensembles are not kept waiting
+    model = mixprop_model(checkpoint_dir)
+    if embedding_cache_dir is not None:
+        model.set_embedding_cache(cache_dir=embedding_cache_dir or None)
+
+    with MODEL_REGISTRY_LOCK:
+        # Another caller may have loaded the same checkpoints in the meantime
+        if key in MODEL_REGISTRY:
+            MODEL_REGISTRY.move_to_end(key)
+            return MODEL_REGISTRY[key]
+
+        # Checkpoints in this directory have changed, so any stale ensemble is dropped
+        for stale_key in [k for k in MODEL_REGISTRY if k[0] == key[0] and k[1] != key[1]]:
+            del MODEL_REGISTRY[stale_key]
+
+        MODEL_REGISTRY[key] = model
+        evict_models()
+
+    return model
+
+
+def warmup_models(args):
+    """
+    Loads the ensemble into the model registry and runs a dummy prediction so that
+    the first real request does not pay for checkpoint loading.
+    """
+    model = load_model(args)
+    # Runs every model of the ensemble, which also works for ensembles too small for reliability analysis
+    model.grid_members(len(model.checkpoints), 'O', 'CCO', [0.5], [298.0])
+
+    return model
+
+
 class mixprop_model():
     
     def __init__(self, checkpoint_dir):
         self.checkpoints = []
+        self.embedding_cache = None
+        self.ensembles = {}
+
+        # A packed ensemble holds all checkpoints in one memory-mapped file
+        if is_packed_ensemble(checkpoint_dir):
+            self.train_args, self.checkpoints, scalers = load_packed_ensemble(checkpoint_dir)
+            self.scaler, self.features_scaler = scalers[-1][0], scalers[-1][1]
+            return
+
         for root, _, files in os.walk(checkpoint_dir):
             for fname in files:
                 if fname.endswith('.pt'):
@@ -35,33 +168,141 @@ class mixprop_model():
                     model = load_checkpoint(fname) #, cuda=True)
                     self.checkpoints.append(model)
 
-    def __call__(self, args):
-                
+    def set_embedding_cache(self, cache_dir=None, max_size=100000):
+        # One cache is shared by all models in the ensemble, entries are keyed by the encoder weights
+        if self.embedding_cache is None or self.embedding_cache.cache_dir != (os.path.abspath(cache_dir) if cache_dir else None):
+            self.embedding_cache = EmbeddingCache(cache_dir=cache_dir,max_size=max_size)
+            for model in self.checkpoints:
+                model.set_embedding_cache(self.embedding_cache)
+
+    def remove_embedding_cache(self):
+        # Detaches the cache from every model, predictions run message passing for all molecules again
+        if self.embedding_cache is not None:
+            self.embedding_cache = None
+            for model in self.checkpoints:
+                model.set_embedding_cache(None)
+
+    @property
+    def nbytes(self):
+        return sum(tensor.numel()*tensor.element_size() for model in self.checkpoints
+                   for tensor in chain(model.parameters(), model.buffers())) \
+            + sum(ensemble.nbytes for ensemble in self.ensembles.values() if ensemble is not None)
+
+    def ensemble(self, n_models):
+        # Stacked ensembles are built once per ensemble size, None if the models cannot be stacked
+        if n_models not in self.ensembles:
+            try:
+                self.ensembles[n_models] = MoleculeEnsemble(self.checkpoints[:n_models])
+            except ValueError:
+                self.ensembles[n_models] = None
+        return self.ensembles[n_models]
+
+    def predict_members(self, args, model_input_loader):
+        # Returns the predictions of each model, shape(n_models, num_rows)
+        ensemble = self.ensemble(args['n_models']) if self.embedding_cache is None else None
+        if ensemble is not None:
+            return predict_ensemble(
+                       ensemble=ensemble,
+                       data_loader=model_input_loader,
+                       scalers=[self.scaler]*args['n_models'],
+                       disable_progress_bar=True)[:,:,0]
+
+        all_model_preds = []
+        for model in self.checkpoints[:args['n_models']]:
+            model_preds = predict(
+                           model=model,
+                           data_loader=model_input_loader,
+                           scaler=self.scaler,
+                           disable_progress_bar=True)
+            all_model_preds.append(np.array(model_preds)[:,0])
+        return np.array(all_model_preds)
+
+    def set_n_models(self, args):
+
         if args['n_models']==None:
             args['n_models']=len(self.checkpoints)
         assert args['n_models']<=len(self.checkpoints),'Too many models requested. {} models requested.'.format(args['n_models'])
         assert args['n_models']>1, 'Multiple models are needed for reliability analysis.'
-        
+
+    def data_loader(self, args, model_input):
+        batch_size = args.get('batch_size',50)
+        precompute_graphs(model_input,num_workers=args.get('featurization_workers',0))
+
+        # Starting worker processes dominates the run time of small inputs, so their batches are built
+        # here once and reused by every model in the ensemble
+        # Models with a shared MPN encode the molecules of both columns in one graph
+        if len(model_input) <= args.get('worker_threshold',WORKER_THRESHOLD) or args.get('num_workers',0)==0:
+            batches = [MoleculeDataset(model_input[i:i+batch_size]) for i in range(0,len(model_input),batch_size)]
+            for batch in batches:
+                batch.batch_graph(self.train_args.mpn_shared)
+            return batches
+
+        return MoleculeDataLoader(dataset=model_input,batch_size=batch_size,num_workers=args['num_workers'],
+                                  cache_batches=args.get('cache_batches',False),shared_graphs=self.train_args.mpn_shared)
+
+    def __call__(self, args):
+
+        self.set_n_models(args)
+
         model_input= MoleculeDatapoint(smiles=[args['smi1'],args['smi2']],features=[args['molfrac1'],args['T']])
         model_input = MoleculeDataset([model_input])
-        model_input_loader = MoleculeDataLoader(dataset=model_input,num_workers=args['num_workers'])
+        model_input_loader = self.data_loader(args, model_input)
 
-        all_model_preds = []
-        for model in self.checkpoints[:args['n_models']]:
-             model_preds = predict(
-                            model=model,
-                            data_loader=model_input_loader,
-                            scaler=self.scaler,
-                            disable_progress_bar=True)
-             all_model_preds.append(model_preds)
+        all_model_preds = self.predict_members(args, model_input_loader)
         
         avg_prediction = np.mean(all_model_preds)
         reliability = np.var(all_model_preds)<args['threshold']
         return avg_prediction,reliability
 
+    def predict_grid(self, args, molfrac1_vals, T_vals):
+        self.set_n_models(args)
+
+        all_model_preds = self.grid_members(args['n_models'], args['smi1'], args['smi2'], molfrac1_vals, T_vals)
+        avg_prediction = np.mean(all_model_preds,axis=0)
+        reliability = np.var(all_model_preds,axis=0)<args['threshold']
+        return avg_prediction,reliability
+
+    def grid_members(self, n_models, smi1, smi2, molfrac1_vals, T_vals):
+        # Encodes each molecule once per checkpoint, then evaluates every (molfrac1, T) point in one FFN pass,
+        # returns shape(n_models, num_points)
+
+        # Only the molecules are needed by the encoder, the features are replaced by the grid below
+        mol_batch = [[smi1,smi2]]
+
+        num_points = len(molfrac1_vals)
+        all_model_preds = []
+        for model in self.checkpoints[:n_models]:
+            model.eval()
+            with torch.no_grad():
+                embedding1, embedding2, _, _ = model.mixture_embeddings(mol_batch, [np.zeros(2)])
+                mol_frac1 = torch.tensor(molfrac1_vals, dtype=torch.float, device=embedding1.device).view(-1,1)
+                T = torch.tensor(T_vals, dtype=torch.float, device=embedding1.device).view(-1,1)
+                model_preds = model.mixture_ffn(embedding1.expand(num_points,-1), embedding2.expand(num_points,-1),
+                                                mol_frac1, T)
+            model_preds = model_preds.data.cpu().numpy()
+            if self.scaler is not None:
+                model_preds = self.scaler.inverse_transform(model_preds)
+            all_model_preds.append(model_preds[:,0])
+
+        return np.array(all_model_preds)
+
+    def predict_batch(self, args, smi1_vals, smi2_vals, molfrac1_vals, T_vals):
+
+        self.set_n_models(args)
+
+        # Featurizes all rows once and runs full batches through every model in the ensemble
+        model_input = MoleculeDataset([MoleculeDatapoint(smiles=[smi1,smi2],features=np.array([molfrac1,T],dtype=float))
+                                       for smi1, smi2, molfrac1, T in zip(smi1_vals, smi2_vals, molfrac1_vals, T_vals)])
+        model_input_loader = self.data_loader(args, model_input)
+
+        all_model_preds = self.predict_members(args, model_input_loader) # shape(n_models, num_rows)
+        avg_prediction = np.mean(all_model_preds,axis=0)
+        reliability = np.var(all_model_preds,axis=0)<args['threshold']
+        return avg_prediction,reliability
+
 def load_model(args):
     if 'checkpoint_dir' in args.keys():
-        return mixprop_model(args['checkpoint_dir'])
+        model = get_registered_model(args['checkpoint_dir'], embedding_cache_key(args))
     else:
         path = str(Path(__file__).absolute())
         path = '/'.join(path.split('/')[:-1])
@@ -69,7 +310,15 @@ def load_model(args):
         
         print('Loading models from {}'.format(checkpoint_dir))
         
-        return mixprop_model(checkpoint_dir)
+        model = get_registered_model(checkpoint_dir, embedding_cache_key(args))
+
+    # Switching the store drops the opened stores, so it is only done when the directory changes
+    if args.get('graph_store_dir') is not None:
+        store = graph_store()
+        if store is None or os.path.dirname(store.path) != os.path.abspath(args['graph_store_dir']):
+            set_graph_store(args['graph_store_dir'])
+
+    return model
 
 
 
@@ -117,6 +366,38 @@ def visc_pred_single(args):
     return prediction, reliability
     
 
+def grid_assertions(args, molfrac1_vals, T_vals):
+
+    # Requirements:
+    assert type(args['smi1'])==str, 'Molecules need to be input as SMILES strings.'
+    assert type(args['smi2'])==str, 'Molecules need to be input as SMILES strings.'
+    assert len(molfrac1_vals)==len(T_vals), 'Mole fraction and temperature grids need to be the same length.'
+    assert np.all((np.asarray(molfrac1_vals)>=0.0)&(np.asarray(molfrac1_vals)<=1.0)), 'Mole fraction needs to be between 0 and 1.'
+
+    mol1 = Chem.MolFromSmiles(args['smi1'])
+    mol2 = Chem.MolFromSmiles(args['smi2'])
+    assert type(mol1)==Chem.rdchem.Mol, 'Invalid SMILES entry, please check that your SMILES are valid.'
+    assert type(mol2)==Chem.rdchem.Mol, 'Invalid SMILES entry, please check that your SMILES are valid.'
+
+    # Warnings:
+    if ('.' in args['smi1'])|('.' in args['smi2']):
+        print('\nWARNING: Multiple molecules are contained within a single SMILES. Predictions may be unreliable.')
+
+    if np.any((np.asarray(T_vals)<293)|(np.asarray(T_vals)>323)):
+        print('\nWARNING: Temperature is outside of recommended range (293 < T < 323). Predictions may be unreliable.')
+
+
+def visc_pred_grid(model, args, molfrac1_vals, T_vals):
+
+    # Check input validity:
+    grid_assertions(args, molfrac1_vals, T_vals)
+
+    prediction_log,reliability = model.predict_grid(args, molfrac1_vals, T_vals)
+    prediction = 10**prediction_log #Prediction must be converted cP units (without the log)
+
+    return list(prediction), list(reliability)
+
+
 def visc_pred_T_curve(args):
     
     model = load_model(args)
@@ -125,14 +406,9 @@ def visc_pred_T_curve(args):
     T_high = 323
     interval = 5
     T_vals = np.arange(T_low,T_high+interval,interval)
-    
-    preds, rels = [], []
-    for T in T_vals:
-        T = float(T)
-        args['T'] = T
-        prediction, reliability = visc_pred_onepoint(model, args)
-        preds.append(prediction)
-        rels.append(reliability)
+    molfrac1_vals = np.full(len(T_vals),args['molfrac1'],dtype=float)
+
+    preds, rels = visc_pred_grid(model, args, molfrac1_vals, T_vals.astype(float))
 
     return preds, T_vals, rels
 
@@ -146,37 +422,99 @@ def visc_pred_molfrac1_curve(args):
     frac_high = 1.0
     interval = 0.1
     frac_vals = np.arange(frac_low,frac_high+interval,interval)
-    
-    preds, rels = [], []
-    for frac in frac_vals:
-        frac = float(frac)
-        args['molfrac1'] = frac
-        prediction, reliability = visc_pred_onepoint(model, args)
-        preds.append(prediction)
-        rels.append(reliability)
+    T_vals = np.full(len(frac_vals),args['T'],dtype=float)
+
+    preds, rels = visc_pred_grid(model, args, frac_vals, T_vals)
 
     return preds, frac_vals, rels
 
 
+def batch_assertions(smi1_vals, smi2_vals, molfrac1_vals, T_vals):
+
+    # Returns a mask of valid rows, checking each unique SMILES only once
+    smi1_vals, smi2_vals = np.asarray(smi1_vals,dtype=object), np.asarray(smi2_vals,dtype=object)
+    molfrac1_vals = pd.to_numeric(pd.Series(molfrac1_vals),errors='coerce').values
+    T_vals = pd.to_numeric(pd.Series(T_vals),errors='coerce').values
+
+    unique_smiles = set(smi1_vals) | set(smi2_vals)
+    valid_smiles = {smi for smi in unique_smiles if type(smi)==str and type(Chem.MolFromSmiles(smi))==Chem.rdchem.Mol}
+
+    valid = np.array([(smi1 in valid_smiles)&(smi2 in valid_smiles) for smi1, smi2 in zip(smi1_vals, smi2_vals)],dtype=bool)
+    valid &= ~np.isnan(T_vals) & ~np.isnan(molfrac1_vals)
+    valid &= (molfrac1_vals>=0.0)&(molfrac1_vals<=1.0)
+
+    # Warnings:
+    if any('.' in smi for smi in valid_smiles):
+        print('\nWARNING: Multiple molecules are contained within a single SMILES. Predictions may be unreliable.')
+
+    if np.any(valid&((T_vals<293)|(T_vals>323))):
+        print('\nWARNING: Temperature is outside of recommended range (293 < T < 323). Predictions may be unreliable.')
+
+    return valid, molfrac1_vals, T_vals
+
+
+def visc_pred_batch(model, args, smi1_vals, smi2_vals, molfrac1_vals, T_vals, skip_invalid=False):
+
+    # Check input validity:
+    valid, molfrac1_vals, T_vals = batch_assertions(smi1_vals, smi2_vals, molfrac1_vals, T_vals)
+    if not skip_invalid:
+        assert valid.all(), 'Invalid input in row {}, please check that SMILES are valid and that mole fraction (between 0 and 1) and temperature are numbers.'.format(np.argmin(valid))
+
+    prediction = np.full(len(valid),np.nan)
+    reliability = np.zeros(len(valid),dtype=bool)
+    if valid.any():
+        prediction_log,reliability[valid] = model.predict_batch(args, np.asarray(smi1_vals)[valid], np.asarray(smi2_vals)[valid],
+                                                                molfrac1_vals[valid], T_vals[valid])
+        prediction[valid] = 10**prediction_log #Prediction must be converted cP units (without the log)
+
+    return prediction, reliability
+
+
 def visc_pred_read_csv(args): # Need additional path argument
     
     model = load_model(args)
     
     data = pd.read_csv(args['input_path'])
     cols = data.columns
-    
-    preds, rels = [], []
-    for i in range(len(data)):
-        args['smi1'] = data[cols[0]].iloc[i]
-        args['smi2'] = data[cols[1]].iloc[i]
-        args['molfrac1'] = data[cols[2]].iloc[i]
-        args['T'] = data[cols[3]].iloc[i]
 
-        prediction, reliability = visc_pred_onepoint(model, args)
-        preds.append(prediction)
-        rels.append(reliability)
-        
+    preds, rels = visc_pred_batch(model, args, data[cols[0]].values, data[cols[1]].values,
+                                  data[cols[2]].values, data[cols[3]].values)
+    preds, rels = list(preds), list(rels)
+
     data['Viscoisty Predictions'] = preds
     data['Reliability'] = rels
     
-    return preds, rels, data
\ No newline at end of file
+    return preds, rels, data
+
+
+def visc_pred_stream_csv(args): # Need additional input_path and output_path arguments
+
+    model = load_model(args)
+
+    # Rows are read, predicted and appended to the output one chunk at a time to bound memory use.
+    # Invalid rows are written with a missing prediction instead of stopping the run.
+    num_rows = 0
+    num_invalid = 0
+    for i, data in enumerate(pd.read_csv(args['input_path'],chunksize=args.get('chunk_size',10000))):
+        cols = data.columns
+        preds, rels = visc_pred_batch(model, args, data[cols[0]].values, data[cols[1]].values,
+                                      data[cols[2]].values, data[cols[3]].values, skip_invalid=True)
+
+        data['Viscoisty Predictions'] = preds
+        data['Reliability'] = rels
+        data.to_csv(args['output_path'],mode='w' if i==0 else 'a',header=(i==0),index=False)
+
+        num_rows += len(data)
+        num_invalid += int(np.isnan(preds).sum())
+
+    # An input without rows yields no chunks, the output still gets the header
+    if num_rows == 0:
+        data = pd.read_csv(args['input_path'],nrows=0)
+        data['Viscoisty Predictions'] = []
+        data['Reliability'] = []
+        data.to_csv(args['output_path'],index=False)
+
+    if num_invalid > 0:
+        print('\nWARNING: {} of {} rows could not be predicted because of invalid inputs.'.format(num_invalid,num_rows))
+
+    return num_rows
@@ -0,0 +1,6 @@
+"""Packs an ensemble of trained mixprop model checkpoints into a single memory-mappable file."""
+
+from mixprop.utils import mixprop_pack
+
+if __name__ == '__main__':
+    mixprop_pack()
@@ -0,0 +1,6 @@
+"""Predicts all mixtures of two libraries of molecules over a grid of mole fractions and temperatures."""
+
+from mixprop.train import mixprop_screen
+
+if __name__ == '__main__':
+    mixprop_screen()
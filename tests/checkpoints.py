@@ -0,0 +1,53 @@
+"""Builds small untrained mixture models and checkpoints for the tests."""
+
+import os
+from typing import List
+
+import numpy as np
+import torch
+
+from mixprop.args import TrainArgs
+from mixprop.data import StandardScaler
+from mixprop.models import MoleculeModel
+from mixprop.utils import save_checkpoint
+
+# Checkpoints store their arguments as a Namespace, which newer versions of PyTorch only load when asked to
+os.environ.setdefault('TORCH_FORCE_NO_WEIGHTS_ONLY_LOAD', '1')
+
+
+def build_args(*extra_args: str) -> TrainArgs:
+    """Builds the arguments of a small mixture model taking the mole fraction and temperature as features."""
+    args = TrainArgs().parse_args(['--data_path', 'unused.csv', '--features_path', 'unused_features.csv',
+                                   '--dataset_type', 'regression', '--number_of_molecules', '2',
+                                   '--hidden_size', '8', '--depth', '2', '--ffn_num_layers', '3',
+                                   *extra_args])
+    args.task_names = ['viscosity']
+    args.features_size = 2
+
+    return args
+
+
+def build_model(seed: int = 0, *extra_args: str) -> MoleculeModel:
+    """Builds a small mixture model with randomly initialized weights in evaluation mode."""
+    torch.manual_seed(seed)
+    model = MoleculeModel(build_args(*extra_args))
+    model.eval()
+
+    return model
+
+
+def save_ensemble(save_dir: str, ensemble_size: int = 3, *extra_args: str) -> List[str]:
+    """
+    Saves the checkpoints of an ensemble of small mixture models, laid out like the output of training.
+
+    :return: The paths of the checkpoints.
+    """
+    scaler = StandardScaler(means=np.array([0.5]), stds=np.array([0.25]))
+    paths = []
+    for model_idx in range(ensemble_size):
+        path = os.path.join(save_dir, f'model_{model_idx}', 'model.pt')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        save_checkpoint(path, build_model(model_idx, *extra_args), scaler=scaler, args=build_args(*extra_args))
+        paths.append(path)
+
+    return paths
@@ -0,0 +1,135 @@
+"""Tests for the least recently used cache."""
+
+import threading
+import unittest
+
+from mixprop.data import LRUCache
+
+
+class TestLRUCache(unittest.TestCase):
+    """Tests for :class:`~mixprop.data.LRUCache`."""
+
+    def test_eviction_order(self):
+        cache = LRUCache(max_entries=3)
+        for key in 'abc':
+            cache[key] = key.upper()
+
+        # Reads and writes mark entries as recently used
+        self.assertEqual(cache.get('a'), 'A')
+        self.assertEqual(cache['b'], 'B')
+        cache['d'] = 'D'
+        self.assertEqual(list(cache.entries), ['a', 'b', 'd'])
+
+        cache['a'] = 'A2'
+        cache['e'] = 'E'
+        self.assertEqual(list(cache.entries), ['d', 'a', 'e'])
+        self.assertEqual(cache['a'], 'A2')
+        self.assertEqual(list(cache.entries), ['d', 'e', 'a'])
+        self.assertNotIn('b', cache)
+
+        # Lookups of missing keys do not change the order
+        self.assertIsNone(cache.get('b'))
+        with self.assertRaises(KeyError):
+            cache['c']
+        self.assertEqual(list(cache.entries), ['d', 'e', 'a'])
+        self.assertEqual(cache.stats(), {'hits': 3, 'misses': 2, 'evictions': 2, 'entries': 3, 'bytes': 0,
+                                         'max_entries': 3, 'max_bytes': None})
+
+    def test_size_limit(self):
+        cache = LRUCache(max_bytes=10, sizeof=len)
+        cache['a'] = 'aaaa'
+        cache['b'] = 'bbbb'
+        self.assertEqual(cache.nbytes, 8)
+
+        cache['c'] = 'cccc'
+        self.assertEqual(list(cache.entries), ['b', 'c'])
+        self.assertEqual(cache.nbytes, 8)
+
+        # Replacing an entry updates the size
+        cache['b'] = 'bb'
+        self.assertEqual(cache.nbytes, 6)
+
+        # An entry larger than the budget is not kept
+        cache['d'] = 'd' * 11
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.nbytes, 0)
+        self.assertEqual(cache.evictions, 4)
+
+    def test_set_budget(self):
+        with self.assertRaises(ValueError):
+            LRUCache(max_bytes=10)
+
+        cache = LRUCache(sizeof=len)
+        for key in 'abcde':
+            cache[key] = key * 3
+
+        # Entries added without a byte budget are measured once one is set
+        self.assertEqual(cache.nbytes, 0)
+        cache.set_budget(max_entries=4, max_bytes=9)
+        self.assertEqual(list(cache.entries), ['c', 'd', 'e'])
+        self.assertEqual(cache.nbytes, 9)
+
+        cache.set_budget(max_entries=1)
+        self.assertEqual(list(cache.entries), ['e'])
+
+        cache.clear()
+        self.assertEqual((len(cache), cache.nbytes, cache.evictions), (0, 0, 4))
+        cache.reset_stats()
+        self.assertEqual(cache.evictions, 0)
+
+    def test_locked_access(self):
+        cache = LRUCache(max_entries=50, max_bytes=400, sizeof=len)
+        num_threads, num_steps = 8, 2000
+        barrier = threading.Barrier(num_threads)
+        errors = []
+
+        def work(thread_idx: int):
+            try:
+                barrier.wait()
+                for step in range(num_steps):
+                    key = (thread_idx * step) % 97
+                    if step % 3 == 0:
+                        cache[key] = 'x' * (key % 16)
+                    else:
+                        value = cache.get(key)
+                        if value is not None and len(value) != key % 16:
+                            errors.append((key, value))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=work, args=(i,)) for i in range(num_threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        stats = cache.stats()
+        self.assertEqual(stats['hits'] + stats['misses'], num_threads * (num_steps - (num_steps + 2) // 3))
+        self.assertLessEqual(len(cache), 50)
+        self.assertLessEqual(cache.nbytes, 400)
+        self.assertEqual(cache.nbytes, sum(size for _, size in cache.entries.values()))
+
+    def test_lock_is_held(self):
+        # Other threads wait for the lock before reading or changing the entries
+        cache = LRUCache(max_entries=2)
+        cache['a'] = 1
+        done = threading.Event()
+
+        def write():
+            cache['b'] = 2
+            cache.get('a')
+            done.set()
+
+        with cache.lock:
+            thread = threading.Thread(target=write)
+            thread.start()
+            self.assertFalse(done.wait(0.1))
+            self.assertEqual(list(cache.entries), ['a'])
+        thread.join()
+        self.assertTrue(done.is_set())
+        self.assertEqual(list(cache.entries), ['b', 'a'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+"""Tests for storing datasets column-wise."""
+
+import os
+import tempfile
+from typing import List, Tuple
+import unittest
+
+import numpy as np
+import torch
+
+from mixprop.args import TrainArgs
+from mixprop.data import ColumnarMoleculeDataset, MoleculeDataset, get_data, split_data
+from mixprop.features import BatchMolGraph
+
+
+ROWS = [
+    ('CCO', 'O', '1.5', '0.2', '300'),
+    ('CCO', 'CC(=O)C', '', '0.4', '310'),
+    ('c1ccccc1', 'O', '2.5', '0.6', '320'),
+    ('O', 'CCO', '-0.5', '0.8', '330'),
+    ('CCCCO', 'CC(=O)C', '0.7', '0.1', '340'),
+    ('c1ccccc1', 'CCO', '3.0', '0.3', '350'),
+    ('CCO', 'O', '1.1', '0.5', '360'),
+    ('CC(C)O', 'O', '', '0.7', '370'),
+    ('CCN', 'CC(=O)C', '0.9', '0.9', '380'),
+    ('CCCCO', 'O', '4.2', '0.2', '390'),
+]
+
+
+def molecule_graphs(batch: BatchMolGraph) -> List[Tuple[list, list, list]]:
+    """Returns the atom features, bond features and reverse bonds of the graph of each molecule of a batch."""
+    graphs = []
+    for i in range(len(batch.a_scope)):
+        (atom_start, n_atoms), (bond_start, n_bonds) = batch.a_scope[i], batch.b_scope[i]
+        graphs.append((batch.f_atoms[atom_start:atom_start + n_atoms].tolist(),
+                       batch.f_bonds[bond_start:bond_start + n_bonds].tolist(),
+                       (batch.b2revb[bond_start:bond_start + n_bonds] - bond_start).tolist()))
+
+    # Batches which encode each unique molecule once map every molecule to its graph
+    mol_index = batch.mol_index.tolist() if batch.mol_index is not None else range(len(graphs))
+
+    return [graphs[i] for i in mol_index]
+
+
+class TestColumnarMoleculeDataset(unittest.TestCase):
+    """Tests that a :class:`~mixprop.data.ColumnarMoleculeDataset` behaves like the row-wise dataset of the same file."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        data_path = os.path.join(cls.tmp_dir.name, 'data.csv')
+        features_path = os.path.join(cls.tmp_dir.name, 'features.csv')
+        weights_path = os.path.join(cls.tmp_dir.name, 'weights.csv')
+        with open(data_path, 'w') as f:
+            f.write('MOL_1,MOL_2,visc\n')
+            f.writelines(f'{smi1},{smi2},{visc}\n' for smi1, smi2, visc, _, _ in ROWS)
+        with open(features_path, 'w') as f:
+            f.write('x,T\n')
+            f.writelines(f'{x},{T}\n' for _, _, _, x, T in ROWS)
+        with open(weights_path, 'w') as f:
+            f.write('weight\n')
+            f.writelines(f'{1 + i / 10}\n' for i in range(len(ROWS)))
+
+        cls.kwargs = dict(path=data_path, smiles_columns=['MOL_1', 'MOL_2'], features_path=[features_path],
+                          data_weights_path=weights_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def setUp(self):
+        self.rows = get_data(columnar=False, **self.kwargs)
+        self.columns = get_data(columnar=True, **self.kwargs)
+        self.assertIsInstance(self.columns, ColumnarMoleculeDataset)
+
+    def assert_equal_datasets(self, rows: MoleculeDataset, columns: MoleculeDataset):
+        self.assertEqual(len(columns), len(rows))
+        self.assertEqual(columns.smiles(), rows.smiles())
+        self.assertEqual(columns.smiles(flatten=True), rows.smiles(flatten=True))
+        self.assertEqual(columns.targets(), rows.targets())
+        self.assertEqual(columns.number_of_molecules, rows.number_of_molecules)
+        np.testing.assert_allclose(np.array(columns.features()), np.array(rows.features()))
+        np.testing.assert_allclose(columns.data_weights(), rows.data_weights())
+        torch.testing.assert_close(columns.features_tensor(), rows.features_tensor())
+        for column_tensor, row_tensor in zip(columns.loss_tensors(), rows.loss_tensors()):
+            torch.testing.assert_close(column_tensor, row_tensor)
+
+        for column_graph, row_graph in zip(columns.batch_graph(), rows.batch_graph()):
+            self.assertEqual(molecule_graphs(column_graph), molecule_graphs(row_graph))
+
+    def test_dataset(self):
+        self.assert_equal_datasets(self.rows, self.columns)
+
+    def test_datapoints(self):
+        for i in range(len(self.rows)):
+            self.assertEqual(self.columns[i].smiles, self.rows[i].smiles)
+            self.assertEqual(self.columns[i].targets, self.rows[i].targets)
+            np.testing.assert_allclose(self.columns[i].features, self.rows[i].features)
+            self.assertEqual(self.columns[i].data_weight, self.rows[i].data_weight)
+
+    def test_slicing_and_subsets(self):
+        self.assert_equal_datasets(MoleculeDataset(self.rows[2:7]), self.columns[2:7])
+        self.assert_equal_datasets(MoleculeDataset(self.rows[::3]), self.columns[::3])
+
+        indices = [7, 0, 3, 3, 9]
+        self.assert_equal_datasets(self.rows.subset(indices), self.columns.subset(indices))
+
+        # Batches built after the loss tensors are computed take their rows of the tensors
+        self.rows.loss_tensors()
+        self.columns.loss_tensors()
+        self.assert_equal_datasets(self.rows.__getitems__(indices), self.columns.__getitems__(indices))
+
+    def test_normalization(self):
+        features_scaler = self.rows.normalize_features(replace_nan_token=0)
+        columns_features_scaler = self.columns.normalize_features(replace_nan_token=0)
+        np.testing.assert_allclose(columns_features_scaler.means, features_scaler.means)
+        np.testing.assert_allclose(columns_features_scaler.stds, features_scaler.stds)
+        targets_scaler = self.rows.normalize_targets()
+        columns_targets_scaler = self.columns.normalize_targets()
+        np.testing.assert_allclose(columns_targets_scaler.means, targets_scaler.means)
+        self.assert_equal_datasets(self.rows, self.columns)
+
+        # A fitted scaler applied to a slice is applied to the rows of the slice
+        rows, columns = MoleculeDataset(self.rows[:4]), self.columns[:4]
+        rows.normalize_features(features_scaler)
+        columns.normalize_features(columns_features_scaler)
+        self.assert_equal_datasets(rows, columns)
+
+        self.rows.reset_features_and_targets()
+        self.columns.reset_features_and_targets()
+        self.assert_equal_datasets(self.rows, self.columns)
+        self.assert_equal_datasets(get_data(columnar=False, **self.kwargs), self.columns)
+
+    def test_split_data(self):
+        args = TrainArgs().parse_args(['--data_path', self.kwargs['path'], '--dataset_type', 'regression',
+                                       '--number_of_molecules', '2'])
+        for split_type in ['random', 'scaffold_balanced', 'random_with_repeated_smiles']:
+            with self.subTest(split_type=split_type):
+                row_splits = split_data(self.rows, split_type=split_type, sizes=(0.6, 0.2, 0.2), seed=3, args=args)
+                column_splits = split_data(self.columns, split_type=split_type, sizes=(0.6, 0.2, 0.2), seed=3,
+                                           args=args)
+                for row_split, column_split in zip(row_splits, column_splits):
+                    self.assertIsInstance(column_split, ColumnarMoleculeDataset)
+                    self.assertEqual(len(column_split), len(row_split))
+                    if len(row_split) > 0:
+                        self.assert_equal_datasets(row_split, column_split)
+
+
+if __name__ == '__main__':
+    unittest.main()
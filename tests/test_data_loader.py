@@ -0,0 +1,183 @@
+"""Tests for sampling and loading batches of molecules."""
+
+import unittest
+
+import numpy as np
+
+from mixprop.data import ColumnarMoleculeDataset, MoleculeDataLoader, MoleculeDatapoint, MoleculeDataset, \
+    MoleculeSampler
+from mixprop.data.data import BUCKET_POOL_BATCHES
+from mixprop.train import predict, predict_ensemble
+from mixprop.train.molecule_fingerprint import model_fingerprint
+from mixprop.models import MoleculeEnsemble
+from tests.checkpoints import build_model
+
+
+# Molecules of different sizes and maximum degrees, each row is unique
+MOLECULES = ['C', 'CC', 'CCC', 'CCCC', 'CCO', 'CCN', 'O', 'N', 'c1ccccc1', 'CC(=O)O', 'CCCCCC', 'C=O', 'CC(C)(C)C',
+             'CCCCCCCCO', 'c1ccccc1O', 'C1CC2CCC1C2', '[Na+].[Cl-]', 'CC(C)O']
+ROWS = [(smi1, smi2) for i, smi1 in enumerate(MOLECULES) for smi2 in MOLECULES[i % 3::6]]
+
+
+def build_dataset() -> MoleculeDataset:
+    return MoleculeDataset([MoleculeDatapoint(smiles=list(row), targets=[float(i)],
+                                              features=np.array([(i % 10) / 10, 290.0 + i]))
+                            for i, row in enumerate(ROWS)])
+
+
+def batch_indices(loader: MoleculeDataLoader) -> list:
+    """Returns the indices of the rows of each batch of a loader."""
+    row_index = {row: i for i, row in enumerate(ROWS)}
+
+    return [[row_index[tuple(smiles)] for smiles in batch.smiles()] for batch in loader]
+
+
+class TestMoleculeSampler(unittest.TestCase):
+    """Tests for bucketing batches by size with :class:`~mixprop.data.MoleculeSampler`."""
+
+    def test_bucketed_batches(self):
+        dataset = build_dataset()
+        smiles, sizes = MoleculeSampler(dataset, bucket_by_size=True, batch_size=5).molecule_sizes()
+        for shuffle, batch_size in [(False, 5), (False, 7), (True, 5), (True, 1), (False, len(ROWS) + 3)]:
+            with self.subTest(shuffle=shuffle, batch_size=batch_size):
+                loader = MoleculeDataLoader(dataset, batch_size=batch_size, num_workers=0, shuffle=shuffle, seed=3,
+                                            bucket_by_size=True)
+                for _ in range(2):
+                    batches = batch_indices(loader)
+
+                    # Every index is loaded once per epoch, and only the last batch may be partial
+                    self.assertEqual(sorted(index for batch in batches for index in batch), list(range(len(ROWS))))
+                    self.assertTrue(all(len(batch) == batch_size for batch in batches[:-1]))
+
+                    if not shuffle:
+                        self.assertEqual([index for batch in batches for index in batch], loader.indices)
+
+                        # Without shuffling, all datapoints are sorted by maximum degree, then by size
+                        keys = [(max(sizes[s][2] for s in smiles[index]),
+                                 sum(sizes[s][0] + sizes[s][1] for s in smiles[index]))
+                                for batch in batches for index in batch]
+                        self.assertEqual(keys, sorted(keys))
+
+    def test_shuffled_pools(self):
+        # Shuffled datapoints are bucketed in pools, and the batches change from epoch to epoch
+        dataset = MoleculeDataset([MoleculeDatapoint(smiles=[MOLECULES[i % len(MOLECULES)], 'O'])
+                                   for i in range(2 * BUCKET_POOL_BATCHES + 1)])
+        sampler = MoleculeSampler(dataset, shuffle=True, seed=0, bucket_by_size=True, batch_size=1)
+        first_epoch, second_epoch = list(sampler), list(sampler)
+        self.assertEqual(sorted(first_epoch), list(range(len(dataset))))
+        self.assertEqual(sorted(second_epoch), list(range(len(dataset))))
+        self.assertNotEqual(first_epoch, second_epoch)
+
+    def test_restore_order(self):
+        dataset = build_dataset()
+        loader = MoleculeDataLoader(dataset, batch_size=4, num_workers=0, bucket_by_size=True)
+        indices = loader.indices
+        self.assertNotEqual(indices, sorted(indices))
+
+        self.assertEqual(loader.restore_order(indices), list(range(len(ROWS))))
+        outputs = np.stack([np.array(indices), -np.array(indices)])
+        np.testing.assert_array_equal(loader.restore_order(outputs, axis=1),
+                                      np.stack([np.arange(len(ROWS)), -np.arange(len(ROWS))]))
+
+        # Outputs of batches in the order of the dataset are not changed
+        unbucketed_loader = MoleculeDataLoader(dataset, batch_size=4, num_workers=0)
+        self.assertIs(unbucketed_loader.restore_order(indices), indices)
+
+    def test_predictions_in_dataset_order(self):
+        models = [build_model(seed) for seed in range(2)]
+        for dataset in [build_dataset(), ColumnarMoleculeDataset.from_lists(
+                [list(row) for row in ROWS], [[float(i)] for i in range(len(ROWS))],
+                features=np.array([[(i % 10) / 10, 290.0 + i] for i in range(len(ROWS))]))]:
+            with self.subTest(dataset=type(dataset).__name__):
+                loader = MoleculeDataLoader(dataset, batch_size=4, num_workers=0)
+                bucketed_loader = MoleculeDataLoader(dataset, batch_size=4, num_workers=0, bucket_by_size=True)
+
+                expected = [predict(model, loader, disable_progress_bar=True) for model in models]
+                for model, model_expected in zip(models, expected):
+                    np.testing.assert_allclose(predict(model, bucketed_loader, disable_progress_bar=True),
+                                               model_expected, rtol=1e-5, atol=1e-6)
+                np.testing.assert_allclose(predict_ensemble(MoleculeEnsemble(models), bucketed_loader,
+                                                            disable_progress_bar=True),
+                                           np.array(expected), rtol=1e-5, atol=1e-6)
+                np.testing.assert_allclose(model_fingerprint(models[0], bucketed_loader, disable_progress_bar=True),
+                                           model_fingerprint(models[0], loader, disable_progress_bar=True),
+                                           rtol=1e-5, atol=1e-6)
+
+
+class TestCachedBatches(unittest.TestCase):
+    """Tests for keeping the batches of a :class:`~mixprop.data.MoleculeDataLoader` with :code:`cache_batches`."""
+
+    def assert_batches_equal(self, batches: list, expected_batches: list):
+        self.assertEqual(len(batches), len(expected_batches))
+        for batch, expected_batch in zip(batches, expected_batches):
+            self.assertEqual(batch.smiles(), expected_batch.smiles())
+            np.testing.assert_array_equal(batch.features_tensor().numpy(), expected_batch.features_tensor().numpy())
+            for tensor, expected_tensor in zip(batch.loss_tensors(), expected_batch.loss_tensors()):
+                if expected_tensor is None:
+                    self.assertIsNone(tensor)
+                else:
+                    np.testing.assert_array_equal(tensor.numpy(), expected_tensor.numpy())
+            for graph, expected_graph in zip(batch.batch_graph(), expected_batch.batch_graph()):
+                np.testing.assert_array_equal(graph.f_atoms.numpy(), expected_graph.f_atoms.numpy())
+                np.testing.assert_array_equal(graph.a2b.numpy(), expected_graph.a2b.numpy())
+
+    def test_cached_across_epochs(self):
+        for bucket_by_size in [False, True]:
+            for num_workers in [0, 2]:
+                with self.subTest(bucket_by_size=bucket_by_size, num_workers=num_workers):
+                    dataset = build_dataset()
+                    loader = MoleculeDataLoader(dataset, batch_size=4, num_workers=num_workers,
+                                                bucket_by_size=bucket_by_size, cache_batches=True)
+                    expected_batches = list(MoleculeDataLoader(dataset, batch_size=4, num_workers=0,
+                                                               bucket_by_size=bucket_by_size))
+
+                    first_epoch = list(loader)
+                    self.assert_batches_equal(first_epoch, expected_batches)
+
+                    # Later epochs return the same batches, with their tensors and graphs already built
+                    for _ in range(2):
+                        epoch = list(loader)
+                        self.assertEqual(len(epoch), len(first_epoch))
+                        for batch, first_batch in zip(epoch, first_epoch):
+                            self.assertIs(batch, first_batch)
+                            self.assertIsNotNone(batch._features_tensor)
+                            self.assertIsNotNone(batch._loss_tensors)
+                            self.assertIsNotNone(batch._batch_graph)
+                    self.assert_batches_equal(list(loader), expected_batches)
+
+                    if bucket_by_size:
+                        rows = [tuple(smiles) for batch in loader for smiles in batch.smiles()]
+                        self.assertEqual(loader.restore_order(rows), ROWS)
+
+    def test_predictions(self):
+        model = build_model(0)
+        dataset = build_dataset()
+        expected = predict(model, MoleculeDataLoader(dataset, batch_size=4, num_workers=0), disable_progress_bar=True)
+        for bucket_by_size in [False, True]:
+            with self.subTest(bucket_by_size=bucket_by_size):
+                loader = MoleculeDataLoader(dataset, batch_size=4, num_workers=0, bucket_by_size=bucket_by_size,
+                                            cache_batches=True)
+                for _ in range(2):
+                    np.testing.assert_allclose(predict(model, loader, disable_progress_bar=True), expected,
+                                               rtol=1e-5, atol=1e-6)
+
+    def test_interrupted_pass(self):
+        # Batches are only kept once a pass through the data is complete
+        loader = MoleculeDataLoader(build_dataset(), batch_size=4, num_workers=0, cache_batches=True)
+        first_batch = next(iter(loader))
+        self.assertIsNone(loader._batches)
+
+        batches = list(loader)
+        self.assertIsNot(batches[0], first_batch)
+        self.assertEqual(batches[0].smiles(), first_batch.smiles())
+        self.assertEqual(len(loader._batches), len(batches))
+
+    def test_shuffle(self):
+        for kwargs in [{'shuffle': True}, {'class_balance': True}]:
+            with self.subTest(**kwargs):
+                with self.assertRaises(ValueError):
+                    MoleculeDataLoader(build_dataset(), batch_size=4, num_workers=0, cache_batches=True, **kwargs)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+"""Tests for reading data files."""
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from mixprop.data import get_data, save_binary_dataset
+from mixprop.data.utils import has_short_rows, read_csv_columns
+
+
+class TestReadCsvColumns(unittest.TestCase):
+    """Tests for :func:`~mixprop.data.utils.read_csv_columns`."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, content: str) -> str:
+        path = os.path.join(self.tmp_dir.name, 'data.csv')
+        with open(path, 'w', newline='') as f:
+            f.write(content)
+
+        return path
+
+    def test_complete_rows(self):
+        for content in ['smiles,solvent,visc\nCCO,O,1.5\nCC,,\n\nc1ccccc1,O,<2\n',
+                        'smiles,solvent,visc\r\nCCO,O,1.5\r\nCC,,\r\n\r\nc1ccccc1,O,<2',
+                        'smiles,solvent,visc\n"CCO",O,1.5\nCC,"",\n\nc1ccccc1,"O",<2\n']:
+            path = self.write(content)
+            self.assertFalse(has_short_rows(path, 3))
+
+            smiles, targets, gt_targets, lt_targets, _ = read_csv_columns(path, ['smiles', 'solvent'], ['visc'])
+            self.assertEqual(smiles, [['CCO', 'O'], ['CC', ''], ['c1ccccc1', 'O']])
+            self.assertEqual(targets[:, 0].tolist(), [1.5, None, 2.0])
+            self.assertEqual(lt_targets[:, 0].tolist(), [False, False, True])
+            self.assertFalse(gt_targets.any())
+
+    def test_short_rows(self):
+        for content in ['smiles,solvent,visc\nCCO,O,1.5\nCCO,O\n',
+                        'smiles,solvent,visc\r\nCCO,O\r\nCC,O,1.0\r\n',
+                        'smiles,solvent,visc\n"CCO",O,1.5\n"CCO,O"\n']:
+            path = self.write(content)
+            self.assertTrue(has_short_rows(path, 3))
+            self.assertIsNone(read_csv_columns(path, ['smiles', 'solvent'], ['visc']))
+
+            # Short rows are read row by row, which rejects them rather than loading unknown targets
+            with self.assertRaises(Exception):
+                get_data(path, smiles_columns=['smiles', 'solvent'], target_columns=['visc'])
+
+
+class TestBinaryFeatures(unittest.TestCase):
+    """Tests for loading features from binary datasets."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.data_path = os.path.join(self.tmp_dir.name, 'data.csv')
+        with open(self.data_path, 'w') as f:
+            f.write('smiles,solvent,visc\nCCO,O,1.5\nCC,O,2.5\n')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_features(self):
+        features_path = os.path.join(self.tmp_dir.name, 'features')
+        save_binary_dataset(features_path, [['CCO', 'O'], ['CC', 'O']], np.array([[1.5], [2.5]]),
+                            features=np.array([[0.2, 300.0], [0.4, 310.0]]))
+
+        data = get_data(self.data_path, smiles_columns=['smiles', 'solvent'], features_path=[features_path])
+        np.testing.assert_array_equal(np.array(data.features()), [[0.2, 300.0], [0.4, 310.0]])
+
+    def test_no_features(self):
+        features_path = os.path.join(self.tmp_dir.name, 'features')
+        save_binary_dataset(features_path, [['CCO', 'O'], ['CC', 'O']], np.array([[1.5], [2.5]]))
+
+        with self.assertRaisesRegex(ValueError, 'does not contain features'):
+            get_data(self.data_path, smiles_columns=['smiles', 'solvent'], features_path=[features_path])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,189 @@
+"""Tests for the embedding cache."""
+
+from concurrent.futures import ThreadPoolExecutor
+import os
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+import torch
+
+from mixprop.args import TrainArgs
+from mixprop.features import get_atom_fdim, get_bond_fdim, mol2graph
+from mixprop.features.graph_store import store_lock
+from mixprop.models import EmbeddingCache
+from mixprop.models.embedding_cache import EmbeddingStore
+from mixprop.models.mpn import MPNEncoder
+
+
+SMILES = ['CCO', 'O', 'c1ccccc1', 'CC(=O)O']
+
+
+def build_encoder() -> MPNEncoder:
+    torch.manual_seed(0)
+    args = TrainArgs().parse_args(['--data_path', 'unused.csv', '--dataset_type', 'regression',
+                                   '--hidden_size', '8', '--depth', '2'])
+    encoder = MPNEncoder(args, get_atom_fdim(), get_bond_fdim())
+    encoder.eval()
+
+    return encoder
+
+
+class TestEmbeddingCache(unittest.TestCase):
+    """Tests for :class:`~mixprop.models.embedding_cache.EmbeddingCache`."""
+
+    def setUp(self):
+        self.encoder = build_encoder()
+        with torch.no_grad():
+            self.expected = self.encoder(mol2graph(SMILES))
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = self.tmp_dir.name
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def encode(self, cache: EmbeddingCache, smiles) -> torch.Tensor:
+        with torch.no_grad():
+            return cache.encode(self.encoder, 'key', smiles)
+
+    def test_hits_and_misses(self):
+        cache = EmbeddingCache()
+        torch.testing.assert_close(self.encode(cache, SMILES), self.expected)
+        self.assertEqual((cache.hits, cache.disk_hits, cache.misses), (0, 0, len(SMILES)))
+
+        # A non-canonical SMILES of a cached molecule is a hit
+        encodings = self.encode(cache, ['OCC', 'O', 'O'])
+        torch.testing.assert_close(encodings, self.expected[[0, 1, 1]])
+        self.assertEqual((cache.hits, cache.misses), (2, len(SMILES)))
+        self.assertEqual(cache.canonical['OCC'], 'CCO')
+
+    def test_memory_size_limit(self):
+        cache = EmbeddingCache(max_size=2)
+        self.encode(cache, SMILES)
+        self.assertEqual(len(cache.memory), 2)
+        self.assertLessEqual(len(cache.canonical), 2)
+
+        torch.testing.assert_close(self.encode(cache, SMILES[:1]), self.expected[:1])
+        self.assertEqual(cache.misses, len(SMILES) + 1)
+
+    def test_persistence_across_reopen(self):
+        self.encode(EmbeddingCache(cache_dir=self.cache_dir), SMILES)
+
+        cache = EmbeddingCache(cache_dir=self.cache_dir)
+        torch.testing.assert_close(self.encode(cache, SMILES[::-1]), self.expected.flip(0))
+        self.assertEqual((cache.hits, cache.disk_hits, cache.misses), (0, len(SMILES), 0))
+
+    def test_truncated_store(self):
+        self.encode(EmbeddingCache(cache_dir=self.cache_dir), SMILES)
+
+        # An interrupted write leaves a partial row at the end of the embeddings
+        data_path = os.path.join(self.cache_dir, 'key', 'embeddings.bin')
+        row_bytes = 4 * self.encoder.hidden_size
+        os.truncate(data_path, 2 * row_bytes + row_bytes // 2)
+
+        cache = EmbeddingCache(cache_dir=self.cache_dir)
+        self.assertEqual(len(cache.store('key', self.encoder.hidden_size)), 2)
+        self.assertEqual(os.path.getsize(data_path), 2 * row_bytes)
+
+        torch.testing.assert_close(self.encode(cache, SMILES), self.expected)
+        self.assertEqual((cache.disk_hits, cache.misses), (2, 2))
+        self.assertEqual(len(EmbeddingCache(cache_dir=self.cache_dir).store('key', self.encoder.hidden_size)),
+                         len(SMILES))
+
+    def test_concurrent_threads(self):
+        cache = EmbeddingCache(cache_dir=self.cache_dir, max_size=3)
+        batches = [SMILES[i % len(SMILES):] + SMILES[:i % len(SMILES)] for i in range(16)]
+        barrier = threading.Barrier(8)
+
+        def encode(batch):
+            barrier.wait()
+            return self.encode(cache, batch)
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            encodings = list(executor.map(encode, batches))
+        for batch, batch_encodings in zip(batches, encodings):
+            torch.testing.assert_close(batch_encodings, self.expected[[SMILES.index(smi) for smi in batch]])
+
+        # Molecules missed by several threads at once are stored once
+        self.assertLessEqual(len(cache.memory), 3)
+        self.assertEqual(cache.hits + cache.disk_hits + cache.misses, len(SMILES) * len(batches))
+        store = EmbeddingCache(cache_dir=self.cache_dir).store('key', self.encoder.hidden_size)
+        self.assertEqual(store.num_rows, len(SMILES))
+        self.assertEqual(os.path.getsize(store.data_path), len(SMILES) * 4 * self.encoder.hidden_size)
+
+
+class TestEmbeddingStore(unittest.TestCase):
+    """Tests for :class:`~mixprop.models.embedding_cache.EmbeddingStore`."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = self.tmp_dir.name
+        self.embeddings = {smi: np.full(4, i, dtype=np.float32) for i, smi in enumerate(SMILES)}
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def add(self, store: EmbeddingStore, smiles: list):
+        store.add(smiles, np.stack([self.embeddings[smi] for smi in smiles]))
+
+    def assert_stored(self, store: EmbeddingStore, smiles: list):
+        self.assertEqual(sorted(store.index), sorted(smiles))
+        for smi in smiles:
+            np.testing.assert_array_equal(store.get(smi), self.embeddings[smi])
+
+    def test_duplicates(self):
+        store = EmbeddingStore(self.path, 4)
+        self.add(store, ['CCO', 'O', 'CCO'])
+        self.add(store, ['O', 'c1ccccc1'])
+        self.assert_stored(store, ['CCO', 'O', 'c1ccccc1'])
+        self.assertEqual(store.num_rows, 3)
+        self.assert_stored(EmbeddingStore(self.path, 4), ['CCO', 'O', 'c1ccccc1'])
+
+    def test_two_stores(self):
+        store, other_store = EmbeddingStore(self.path, 4), EmbeddingStore(self.path, 4)
+        self.add(store, ['CCO', 'O'])
+
+        # The other store reads the rows appended by the first one before appending its own
+        self.add(other_store, ['O', 'c1ccccc1'])
+        self.assert_stored(other_store, ['CCO', 'O', 'c1ccccc1'])
+        self.add(store, ['c1ccccc1', 'CC(=O)O'])
+        self.assert_stored(store, SMILES)
+
+        reopened = EmbeddingStore(self.path, 4)
+        self.assert_stored(reopened, SMILES)
+        self.assertEqual(reopened.num_rows, len(SMILES))
+        self.assertEqual(os.path.getsize(reopened.data_path), len(SMILES) * 16)
+
+    def test_interrupted_write(self):
+        self.add(EmbeddingStore(self.path, 4), ['CCO', 'O'])
+        with open(os.path.join(self.path, 'embeddings.bin'), 'ab') as f:
+            f.write(self.embeddings['c1ccccc1'].tobytes() + b'\0\0')
+        with open(os.path.join(self.path, 'smiles.txt'), 'a') as f:
+            f.write('c1cc')
+
+        store = EmbeddingStore(self.path, 4)
+        self.assert_stored(store, ['CCO', 'O'])
+        self.assertEqual(os.path.getsize(store.data_path), 2 * 16)
+        self.add(store, ['c1ccccc1'])
+        self.assert_stored(EmbeddingStore(self.path, 4), ['CCO', 'O', 'c1ccccc1'])
+
+    def test_open_during_write(self):
+        self.add(EmbeddingStore(self.path, 4), ['CCO'])
+        opened = []
+        thread = threading.Thread(target=lambda: opened.append(EmbeddingStore(self.path, 4)))
+
+        # A store opened while another writer holds the lock waits for it, rather than discarding its rows
+        with store_lock(self.path):
+            with open(os.path.join(self.path, 'embeddings.bin'), 'ab') as f:
+                f.write(self.embeddings['O'].tobytes())
+            thread.start()
+            with open(os.path.join(self.path, 'smiles.txt'), 'a') as f:
+                f.write('O\n')
+        thread.join()
+
+        self.assert_stored(opened[0], ['CCO', 'O'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+"""Tests for evaluating stacked ensembles."""
+
+import unittest
+
+import numpy as np
+import torch
+
+from mixprop.data import MoleculeDataLoader, MoleculeDatapoint, MoleculeDataset, StandardScaler
+from mixprop.models import MoleculeEnsemble
+from mixprop.train import predict, predict_ensemble
+from tests.checkpoints import build_model
+
+
+# Repeated molecules are featurized and encoded once per batch
+ROWS = [('CCO', 'O', 0.3, 300.0), ('c1ccccc1', 'O', 0.5, 310.0), ('CCO', 'CC(=O)C', 0.8, 320.0),
+        ('CCO', 'O', 0.0, 295.0), ('O', 'CCO', 0.6, 305.0), ('CCN', 'O', 1.0, 315.0), ('CCCCCCO', 'CCN', 0.1, 300.0),
+        ('CCO', 'CCO', 0.4, 310.0)]
+
+
+class TestMoleculeEnsemble(unittest.TestCase):
+    """Tests that a :class:`~mixprop.models.MoleculeEnsemble` predicts like each of its members."""
+
+    def setUp(self):
+        self.dataset = MoleculeDataset([MoleculeDatapoint(smiles=[smi1, smi2], features=np.array([molfrac1, T]))
+                                        for smi1, smi2, molfrac1, T in ROWS])
+        self.scaler = StandardScaler(means=np.array([0.5]), stds=np.array([0.25]))
+
+    def assert_member_predictions(self, models: list, **loader_kwargs):
+        ensemble = MoleculeEnsemble(models)
+        loader = MoleculeDataLoader(self.dataset, batch_size=5, num_workers=0, **loader_kwargs)
+        preds = predict_ensemble(ensemble, loader, disable_progress_bar=True, scalers=[self.scaler] * len(models))
+
+        self.assertEqual(preds.shape, (len(models), len(ROWS), 1))
+        for model, model_preds in zip(models, preds):
+            expected = predict(model, loader, disable_progress_bar=True, scaler=self.scaler)
+            np.testing.assert_allclose(model_preds.astype(float), np.array(expected, dtype=float), rtol=1e-5)
+
+        # The batches gather the encodings of repeated molecules by index
+        self.assertTrue(any(graph.mol_index is not None for batch in loader for graph in batch.batch_graph()))
+
+    def test_predictions(self):
+        self.assert_member_predictions([build_model(seed) for seed in range(3)])
+
+    def test_scatter_message_passing(self):
+        self.assert_member_predictions([build_model(seed, '--scatter_message_passing') for seed in range(3)])
+
+    def test_mpn_shared(self):
+        self.assert_member_predictions([build_model(seed, '--mpn_shared') for seed in range(2)])
+        self.assert_member_predictions([build_model(seed, '--mpn_shared') for seed in range(2)], shared_graphs=True)
+
+    def test_bucket_by_size(self):
+        self.assert_member_predictions([build_model(seed) for seed in range(3)], bucket_by_size=True)
+
+    def test_unbatched_molecules(self):
+        # Molecules passed as SMILES are featurized without deduplication
+        models = [build_model(seed) for seed in range(3)]
+        batch = [[smi1, smi2] for smi1, smi2, _, _ in ROWS]
+        features_batch = [np.array([molfrac1, T]) for _, _, molfrac1, T in ROWS]
+        with torch.no_grad():
+            preds = MoleculeEnsemble(models)(batch, features_batch)
+            for model, model_preds in zip(models, preds):
+                torch.testing.assert_close(model_preds, model(batch, features_batch), rtol=1e-5, atol=1e-5)
+
+    def test_different_architectures(self):
+        with self.assertRaises(ValueError):
+            MoleculeEnsemble([build_model(0), build_model(1, '--hidden_size', '16')])
+
+
+if __name__ == '__main__':
+    unittest.main()
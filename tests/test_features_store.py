@@ -0,0 +1,125 @@
+"""Tests for the on-disk features store."""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from mixprop.data import set_features_store
+from mixprop.data.data import features_store, precompute_features, SMILES_TO_FEATURES
+from mixprop.features import FeaturesStore
+from mixprop.features.features_store import HEADER_BYTES
+from mixprop.features.graph_store import canonical_smiles
+
+
+SMILES = ['CCO', 'O', 'c1ccccc1', 'CC(=O)O', '[Na+].[Cl-]', 'C']
+
+
+class TestFeaturesStore(unittest.TestCase):
+    """Tests for :class:`~mixprop.features.FeaturesStore`."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = self.tmp_dir.name
+        self.features = {smi: np.arange(3, dtype=np.float64) + i / 7 for i, smi in enumerate(SMILES)}
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def add(self, store: FeaturesStore, smiles: list):
+        store.add(smiles, [self.features[smi] for smi in smiles])
+
+    def assert_stored(self, store: FeaturesStore, smiles: list):
+        self.assertEqual(sorted(store.index), sorted(smiles))
+        for smi in smiles:
+            np.testing.assert_array_equal(store.get(smi), self.features[smi])
+
+    def test_round_trip(self):
+        store = FeaturesStore(self.path)
+        self.assertEqual(len(store), 0)
+        self.add(store, SMILES[:3])
+        self.add(store, SMILES[3:])
+        self.assert_stored(store, SMILES)
+        self.assertIsNone(store.get('CCN'))
+
+        # Rows are appended to the file rather than rewriting it
+        self.assertEqual(os.path.getsize(store.features_path), HEADER_BYTES + 8 * 3 * len(SMILES))
+        reopened = FeaturesStore(self.path)
+        self.assert_stored(reopened, SMILES)
+        self.assertEqual(reopened.num_features, 3)
+
+    def test_duplicates_and_two_stores(self):
+        store, other_store = FeaturesStore(self.path), FeaturesStore(self.path)
+        self.add(store, ['CCO', 'O', 'CCO'])
+
+        # The other store reads the rows appended by the first one before appending its own
+        self.add(other_store, ['O', 'c1ccccc1'])
+        self.assert_stored(other_store, ['CCO', 'O', 'c1ccccc1'])
+        self.add(store, SMILES)
+        self.assert_stored(store, SMILES)
+
+        reopened = FeaturesStore(self.path)
+        self.assert_stored(reopened, SMILES)
+        self.assertEqual(reopened.num_rows, len(SMILES))
+
+    def test_interrupted_write(self):
+        self.add(FeaturesStore(self.path), SMILES[:2])
+        sizes = {name: os.path.getsize(os.path.join(self.path, name)) for name in ['features.bin', 'smiles.txt']}
+
+        # The features of a molecule are written, but only part of its SMILES
+        store = FeaturesStore(self.path)
+        with mock.patch.object(store, '_sync'):
+            self.add(store, ['c1ccccc1'])
+        with open(os.path.join(self.path, 'smiles.txt'), 'rb+') as f:
+            f.truncate(sizes['smiles.txt'] + 3)
+
+        reopened = FeaturesStore(self.path)
+        self.assert_stored(reopened, SMILES[:2])
+        for name, size in sizes.items():
+            self.assertEqual(os.path.getsize(os.path.join(self.path, name)), size)
+
+        self.add(reopened, ['c1ccccc1'])
+        self.assert_stored(FeaturesStore(self.path), SMILES[:3])
+
+    def test_partial_header(self):
+        with open(os.path.join(self.path, 'features.bin'), 'wb') as f:
+            f.write(b'\x03\x00')
+
+        store = FeaturesStore(self.path)
+        self.assertIsNone(store.num_features)
+        self.assertEqual(os.path.getsize(store.features_path), 0)
+        self.add(store, SMILES)
+        self.assert_stored(FeaturesStore(self.path), SMILES)
+
+    def test_different_lengths(self):
+        store = FeaturesStore(self.path)
+        self.add(store, SMILES[:2])
+        with self.assertRaises(ValueError):
+            store.add(['C'], [np.zeros(4)])
+        self.assert_stored(FeaturesStore(self.path), SMILES[:2])
+
+    def test_precompute_features(self):
+        smiles = ['OCC', 'CCO', 'O', 'c1ccccc1', 'OCC']
+        set_features_store(self.path)
+        try:
+            SMILES_TO_FEATURES.clear()
+            precompute_features(smiles, ['morgan'])
+            store = features_store('morgan')
+            self.assertEqual(sorted(store.index), sorted({canonical_smiles(smi) for smi in smiles}))
+
+            # Features are read back from the store
+            SMILES_TO_FEATURES.clear()
+            set_features_store(self.path)
+            with mock.patch('mixprop.data.data.generate_features') as generate_features:
+                precompute_features(smiles, ['morgan'])
+            generate_features.assert_not_called()
+            self.assertEqual(len(features_store('morgan')), 3)
+        finally:
+            set_features_store(None)
+            SMILES_TO_FEATURES.clear()
+
+
+if __name__ == '__main__':
+    unittest.main()
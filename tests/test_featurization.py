@@ -0,0 +1,186 @@
+"""Tests for batching molecular graphs."""
+
+import tempfile
+import unittest
+
+import numpy as np
+from rdkit import Chem
+
+from mixprop.data import MoleculeDatapoint, MoleculeDataset, precompute_graphs, set_graph_store
+from mixprop.data.data import empty_cache, graph_store, SMILES_TO_GRAPH
+from mixprop.features import BatchMolGraph, atom_features, bond_features, mol2graph, reset_featurization_parameters, \
+    set_explicit_h
+from mixprop.features.featurization import map_smiles, mol_graph_from_smiles
+from mixprop.features.graph_store import canonical_smiles_from_smiles
+
+
+def expected_features(smiles):
+    """Builds the atom and bond features of a batch with the original pairwise loop over atoms."""
+    f_atoms, f_bonds = [], []
+    for smi in smiles:
+        mol = Chem.MolFromSmiles(smi)
+        mol_f_atoms = [atom_features(atom) for atom in mol.GetAtoms()]
+        f_atoms.extend(mol_f_atoms)
+        for a1 in range(mol.GetNumAtoms()):
+            for a2 in range(a1 + 1, mol.GetNumAtoms()):
+                bond = mol.GetBondBetweenAtoms(a1, a2)
+                if bond is None:
+                    continue
+                f_bond = bond_features(bond)
+                f_bonds.append(mol_f_atoms[a1] + f_bond)
+                f_bonds.append(mol_f_atoms[a2] + f_bond)
+
+    return f_atoms, f_bonds
+
+
+class TestBatchMolGraph(unittest.TestCase):
+    """Tests for :class:`~mixprop.features.featurization.BatchMolGraph`."""
+
+    def assert_batch(self, smiles, a2b, b2a, b2revb, a_scope, b_scope, b2b, a2a):
+        batch = mol2graph(smiles)
+        f_atoms, f_bonds = expected_features(smiles)
+
+        np.testing.assert_array_equal(batch.f_atoms[0], 0)
+        np.testing.assert_array_equal(batch.f_bonds[0], 0)
+        f_atoms = np.array(f_atoms, dtype=np.float32).reshape(-1, batch.atom_fdim)
+        f_bonds = np.array(f_bonds, dtype=np.float32).reshape(-1, batch.bond_fdim)
+
+        np.testing.assert_array_equal(batch.f_atoms[1:], f_atoms)
+        np.testing.assert_array_equal(batch.f_bonds[1:], f_bonds)
+        self.assertEqual(batch.a2b.tolist(), a2b)
+        self.assertEqual(batch.b2a.tolist(), b2a)
+        self.assertEqual(batch.b2revb.tolist(), b2revb)
+        self.assertEqual(batch.a_scope, a_scope)
+        self.assertEqual(batch.b_scope, b_scope)
+        self.assertEqual(batch.get_b2b().tolist(), b2b)
+        self.assertEqual(batch.get_a2a().tolist(), a2a)
+
+    def test_hydrogen(self):
+        self.assert_batch(['[H][H]'],
+                          a2b=[[0], [2], [1]], b2a=[0, 1, 2], b2revb=[0, 2, 1],
+                          a_scope=[(1, 2)], b_scope=[(1, 2)],
+                          b2b=[[0], [0], [0]], a2a=[[0], [2], [1]])
+
+    def test_water(self):
+        self.assert_batch(['O'],
+                          a2b=[[0], [0]], b2a=[0], b2revb=[0],
+                          a_scope=[(1, 1)], b_scope=[(1, 0)],
+                          b2b=[[0]], a2a=[[0], [0]])
+
+    def test_salt(self):
+        self.assert_batch(['[Na+].[Cl-]'],
+                          a2b=[[0], [0], [0]], b2a=[0], b2revb=[0],
+                          a_scope=[(1, 2)], b_scope=[(1, 0)],
+                          b2b=[[0]], a2a=[[0], [0], [0]])
+
+    def test_mixed_batch(self):
+        self.assert_batch(['CCO', 'O', 'C=O'],
+                          a2b=[[0, 0], [2, 0], [1, 4], [3, 0], [0, 0], [6, 0], [5, 0]],
+                          b2a=[0, 1, 2, 2, 3, 5, 6], b2revb=[0, 2, 1, 4, 3, 6, 5],
+                          a_scope=[(1, 3), (4, 1), (5, 2)], b_scope=[(1, 4), (5, 0), (5, 2)],
+                          b2b=[[0, 0], [0, 0], [0, 4], [1, 0], [0, 0], [0, 0], [0, 0]],
+                          a2a=[[0, 0], [2, 0], [1, 3], [2, 0], [0, 0], [6, 0], [5, 0]])
+
+    def test_batch_with_bondless_molecules(self):
+        self.assert_batch(['[H][H]', '[Na+].[Cl-]', 'CC'],
+                          a2b=[[0], [2], [1], [0], [0], [4], [3]],
+                          b2a=[0, 1, 2, 5, 6], b2revb=[0, 2, 1, 4, 3],
+                          a_scope=[(1, 2), (3, 2), (5, 2)], b_scope=[(1, 2), (3, 0), (3, 2)],
+                          b2b=[[0], [0], [0], [0], [0]],
+                          a2a=[[0], [2], [1], [0], [0], [6], [5]])
+
+    def test_larger_molecules(self):
+        smiles = ['c1ccccc1O', 'CC(C)(C)C(=O)[O-].[K+]', 'C1CC2CCC1C2']
+        batch = mol2graph(smiles)
+        f_atoms, f_bonds = expected_features(smiles)
+        np.testing.assert_array_equal(batch.f_atoms[1:], np.array(f_atoms, dtype=np.float32))
+        np.testing.assert_array_equal(batch.f_bonds[1:], np.array(f_bonds, dtype=np.float32))
+
+        # Reversing a bond twice is the identity and each bond is an incoming bond of the atom its reverse starts from
+        b2revb = batch.b2revb[1:]
+        self.assertTrue((batch.b2revb[b2revb] == np.arange(1, batch.n_bonds)).all())
+        for b in range(1, batch.n_bonds):
+            self.assertIn(b, batch.a2b[batch.b2a[b2revb[b - 1]]].tolist())
+
+    def test_no_graphs(self):
+        batch = BatchMolGraph([])
+        self.assertEqual((batch.n_atoms, batch.n_bonds), (1, 1))
+        self.assertEqual(tuple(batch.f_atoms.shape), (1, batch.atom_fdim))
+        self.assertEqual(tuple(batch.f_bonds.shape), (1, batch.bond_fdim))
+        self.assertEqual(batch.a2b.tolist(), [[0]])
+        self.assertEqual(batch.b2a.tolist(), [0])
+        self.assertEqual(batch.b2revb.tolist(), [0])
+        self.assertEqual((batch.a_scope, batch.b_scope), ([], []))
+        self.assertEqual(batch.get_b2b().tolist(), [[0]])
+        self.assertEqual(batch.get_a2a().tolist(), [[0]])
+        self.assertEqual(len(batch.get_a2mol()), 0)
+
+
+# Includes an invalid SMILES and molecules repeated under other SMILES
+PARALLEL_SMILES = ['CCO', 'O', 'c1ccccc1', 'invalid', 'OCC', 'CC(=O)O', '[Na+].[Cl-]', 'C1CC2CCC1C2', 'c1ccccc1O',
+                   'CC(C)(C)C(=O)[O-].[K+]', 'C', 'CCN']
+
+
+def graph_arrays(mol_graph):
+    if mol_graph is None:
+        return None
+    return [np.asarray(array).tolist() for array in [mol_graph.f_atoms, mol_graph.f_bonds, mol_graph.a2b_offsets,
+                                                     mol_graph.a2b_indices, mol_graph.b2a, mol_graph.b2revb]]
+
+
+class TestParallelFeaturization(unittest.TestCase):
+    """Tests that featurizing molecules in a pool of workers gives the same results as featurizing them serially."""
+
+    def setUp(self):
+        empty_cache()
+
+    def tearDown(self):
+        reset_featurization_parameters()
+        set_graph_store(None)
+        empty_cache()
+
+    def dataset(self) -> MoleculeDataset:
+        return MoleculeDataset([MoleculeDatapoint(smiles=[smi1, smi2])
+                                for smi1, smi2 in zip(PARALLEL_SMILES, PARALLEL_SMILES[1:] + PARALLEL_SMILES[:1])])
+
+    def test_map_smiles(self):
+        for explicit_h in [False, True]:
+            set_explicit_h(explicit_h)
+            for function in [mol_graph_from_smiles, canonical_smiles_from_smiles]:
+                with self.subTest(explicit_h=explicit_h, function=function.__name__):
+                    serial = list(map_smiles(function, PARALLEL_SMILES))
+                    pooled = list(map_smiles(function, PARALLEL_SMILES, num_workers=2, chunk_size=3))
+                    if function is mol_graph_from_smiles:
+                        serial, pooled = [graph_arrays(g) for g in serial], [graph_arrays(g) for g in pooled]
+                    self.assertEqual(pooled, serial)
+                    self.assertIsNone(pooled[PARALLEL_SMILES.index('invalid')])
+
+    def test_precompute_graphs(self):
+        precompute_graphs(self.dataset())
+        serial = {smi: graph_arrays(mol_graph) for smi, (mol_graph, _) in SMILES_TO_GRAPH.entries.items()}
+
+        empty_cache()
+        precompute_graphs(self.dataset(), num_workers=2, chunk_size=3)
+        pooled = {smi: graph_arrays(mol_graph) for smi, (mol_graph, _) in SMILES_TO_GRAPH.entries.items()}
+
+        self.assertEqual(pooled, serial)
+        self.assertEqual(len(serial), len(PARALLEL_SMILES) - 1)
+
+    def test_precompute_graphs_in_store(self):
+        stores = []
+        for num_workers in [0, 2]:
+            with tempfile.TemporaryDirectory() as store_dir:
+                set_graph_store(store_dir)
+                precompute_graphs(self.dataset(), num_workers=num_workers, chunk_size=3)
+                store = graph_store()
+                stores.append([(smi, graph_arrays(store.get(smi))) for smi in store.index])
+                set_graph_store(None)
+            empty_cache()
+
+        # The molecules are stored in the same order
+        self.assertEqual(stores[1], stores[0])
+        self.assertEqual(len(stores[0]), len(PARALLEL_SMILES) - 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+"""Tests for the on-disk graph store."""
+
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from mixprop.data import MoleculeDatapoint, MoleculeDataset, get_data, precompute_graphs, set_cache_graph, \
+    set_graph_store
+from mixprop.data.data import empty_cache, graph_store
+from mixprop.features import MolGraph, reset_featurization_parameters, set_explicit_h
+from mixprop.features.graph_store import canonical_smiles, featurization_hash, GraphStore
+from tests.test_columnar_dataset import molecule_graphs
+
+data_module = sys.modules['mixprop.data.data']
+
+
+SMILES = ['CCO', 'O', 'c1ccccc1', 'CC(=O)O', '[Na+].[Cl-]', 'C']
+
+
+def graph_arrays(mol_graph: MolGraph) -> list:
+    return [np.asarray(array).tolist() for array in [mol_graph.f_atoms, mol_graph.f_bonds, mol_graph.a2b_offsets,
+                                                     mol_graph.a2b_indices, mol_graph.b2a, mol_graph.b2revb]]
+
+
+def sorted_graphs(batch) -> list:
+    # Molecules are stored with the atom order of the SMILES they were first featurized from
+    return [(sorted(f_atoms), sorted(f_bonds)) for f_atoms, f_bonds, _ in molecule_graphs(batch)]
+
+
+class TestGraphStore(unittest.TestCase):
+    """Tests for :class:`~mixprop.features.graph_store.GraphStore`."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = self.tmp_dir.name
+        self.graphs = {smi: MolGraph(smi) for smi in SMILES}
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def add(self, store: GraphStore, smiles: list):
+        store.add(smiles, [self.graphs[smi] for smi in smiles])
+
+    def assert_stored(self, store: GraphStore, smiles: list):
+        self.assertEqual(sorted(store.index), sorted(smiles))
+        for smi in smiles:
+            self.assertEqual(graph_arrays(store.get(smi)), graph_arrays(self.graphs[smi]))
+
+    def test_round_trip(self):
+        store = GraphStore(self.path)
+        self.add(store, SMILES[:3])
+        self.add(store, SMILES[3:])
+        self.assert_stored(store, SMILES)
+        self.assertIsNone(store.get('CCN'))
+        self.assert_stored(GraphStore(self.path), SMILES)
+
+    def test_duplicates_and_two_stores(self):
+        store, other_store = GraphStore(self.path), GraphStore(self.path)
+        self.add(store, ['CCO', 'O', 'CCO'])
+
+        # The other store reads the graphs appended by the first one before appending its own
+        self.add(other_store, ['O', 'c1ccccc1'])
+        self.assert_stored(other_store, ['CCO', 'O', 'c1ccccc1'])
+        self.add(store, SMILES)
+        self.assert_stored(store, SMILES)
+
+        reopened = GraphStore(self.path)
+        self.assert_stored(reopened, SMILES)
+        self.assertEqual(reopened.num_mols, len(SMILES))
+
+    def test_interrupted_write(self):
+        self.add(GraphStore(self.path), SMILES[:2])
+        sizes = {name: os.path.getsize(os.path.join(self.path, name)) for name in os.listdir(self.path)}
+
+        # The arrays and the index of a graph are written, but only part of its SMILES
+        store = GraphStore(self.path)
+        with mock.patch.object(store, '_sync'):
+            self.add(store, ['c1ccccc1'])
+        with open(os.path.join(self.path, 'smiles.txt'), 'rb+') as f:
+            f.truncate(sizes['smiles.txt'] + 3)
+
+        reopened = GraphStore(self.path)
+        self.assert_stored(reopened, SMILES[:2])
+        for name, size in sizes.items():
+            self.assertEqual(os.path.getsize(os.path.join(self.path, name)), size)
+
+        self.add(reopened, ['c1ccccc1'])
+        self.assert_stored(GraphStore(self.path), SMILES[:3])
+
+    def test_featurization_hash(self):
+        with tempfile.TemporaryDirectory() as store_dir:
+            set_graph_store(store_dir)
+            try:
+                store = graph_store()
+                self.assertEqual(store.path, os.path.join(os.path.abspath(store_dir), featurization_hash()))
+                self.add(store, SMILES)
+
+                # Graphs featurized with other parameters are kept in another store
+                set_explicit_h(True)
+                explicit_h_store = graph_store()
+                self.assertNotEqual(explicit_h_store.path, store.path)
+                self.assertEqual(len(explicit_h_store), 0)
+
+                reset_featurization_parameters()
+                self.assertIs(graph_store(), store)
+                self.assertNotEqual(featurization_hash(overwrite_default_atom_features=True), featurization_hash())
+            finally:
+                reset_featurization_parameters()
+                set_graph_store(None)
+
+
+class TestGraphStoreLookups(unittest.TestCase):
+    """Tests that datasets look up their molecules in the graph store under canonical SMILES computed once."""
+
+    ROWS = [('OCC', 'O'), ('c1ccccc1', 'CCO'), ('CCO', 'O'), ('C(=O)(O)C', 'OCC')]
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        empty_cache()
+        set_cache_graph(False)
+        self.expected = {smi: sorted_graphs(MoleculeDataset([MoleculeDatapoint(smiles=[smi])]).batch_graph()[0])[0]
+                         for row in self.ROWS for smi in row}
+        set_graph_store(self.tmp_dir.name)
+
+    def tearDown(self):
+        set_graph_store(None)
+        set_cache_graph(True)
+        empty_cache()
+        self.tmp_dir.cleanup()
+
+    def datapoints(self) -> list:
+        return [MoleculeDatapoint(smiles=list(row)) for row in self.ROWS]
+
+    def assert_batch_graph(self, datasets: list, num_canonicalized: int):
+        with mock.patch.object(data_module, 'canonical_smiles', wraps=canonical_smiles) as canonicalize:
+            for dataset in datasets:
+                for i, graph in enumerate(dataset.batch_graph()):
+                    self.assertEqual(sorted_graphs(graph), [self.expected[row[i]] for row in dataset.smiles()])
+        self.assertEqual(canonicalize.call_count, num_canonicalized)
+
+    def test_precomputed(self):
+        datapoints = self.datapoints()
+        precompute_graphs(MoleculeDataset(datapoints))
+        self.assertEqual(datapoints[0].store_smiles, ['CCO', 'O'])
+        self.assertEqual(len(graph_store()), 4)
+        self.assert_batch_graph([MoleculeDataset(datapoints), MoleculeDataset(datapoints[1:])], 0)
+
+    def test_computed_once(self):
+        datapoints = self.datapoints()
+        graph_store().add(['CCO', 'O', 'c1ccccc1', 'CC(=O)O'],
+                          [MolGraph(smi) for smi in ['CCO', 'O', 'c1ccccc1', 'CC(=O)O']])
+
+        # Each datapoint canonicalizes its molecules the first time they are looked up
+        self.assert_batch_graph([MoleculeDataset(datapoints)], 2 * len(datapoints))
+        self.assert_batch_graph([MoleculeDataset(datapoints), MoleculeDataset(datapoints[::2])], 0)
+
+    def test_columnar(self):
+        data_path = os.path.join(self.tmp_dir.name, 'data.csv')
+        with open(data_path, 'w') as f:
+            f.write('smi1,smi2\n')
+            f.writelines(f'{smi1},{smi2}\n' for smi1, smi2 in self.ROWS)
+        data = get_data(data_path, smiles_columns=['smi1', 'smi2'], target_columns=[], columnar=True)
+
+        precompute_graphs(data)
+        self.assert_batch_graph([data, data[:2], data[1:]], 0)
+
+        # Molecules of the table are canonicalized once when they were not precomputed
+        data = get_data(data_path, smiles_columns=['smi1', 'smi2'], target_columns=[], columnar=True)
+        self.assert_batch_graph([data[:2]], 4)
+        self.assert_batch_graph([data], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
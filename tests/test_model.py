@@ -0,0 +1,86 @@
+"""Tests for the mixture model."""
+
+import unittest
+
+import numpy as np
+import torch
+
+from mixprop.features import mol2graph
+from tests.checkpoints import build_args, build_model
+
+
+SMILES = [['CCO', 'O'], ['c1ccccc1', 'CC(=O)C'], ['CCCCO', 'O'], ['CC(C)O', 'CCN'], ['O', 'CCO']]
+
+
+def reference_forward(model, batch: list, features_batch: list) -> torch.Tensor:
+    """Computes the symmetrized mixture prediction directly from the encoder output."""
+    hidden_size = model.hidden_size
+    encodings = model.encoder(batch, features_batch)
+    embedding1, embedding2 = encodings[:, :hidden_size], encodings[:, hidden_size:2 * hidden_size]
+    mol_frac1, T = encodings[:, -2:-1], encodings[:, -1:]
+
+    output = model.ffn(torch.cat((embedding1 * mol_frac1, embedding2 * (1 - mol_frac1), T), dim=1))
+    output_swapped = model.ffn(torch.cat((embedding2 * (1 - mol_frac1), embedding1 * mol_frac1, T), dim=1))
+
+    return (output + output_swapped) / 2
+
+
+class TestMoleculeModel(unittest.TestCase):
+    """Tests for the mixture head of :class:`~mixprop.models.MoleculeModel`."""
+
+    def test_head_size(self):
+        # The mole fraction scales the embeddings, so only the temperature is appended to them
+        for hidden_size in ['8', '300']:
+            with self.subTest(hidden_size=hidden_size):
+                model = build_model(0, '--hidden_size', hidden_size)
+                self.assertEqual(model.ffn[1].in_features, 2 * int(hidden_size) + 1)
+
+        model = build_model(0, '--ffn_num_layers', '1')
+        self.assertEqual(model.ffn[1].in_features, 17)
+        self.assertEqual(model.ffn[1].out_features, 1)
+
+    def test_forward(self):
+        model = build_model(0)
+        for num_mixtures in [1, 5, 60]:
+            with self.subTest(num_mixtures=num_mixtures):
+                batch = [SMILES[i % len(SMILES)] for i in range(num_mixtures)]
+                features_batch = [np.array([i / num_mixtures, 293.0 + i]) for i in range(num_mixtures)]
+                with torch.no_grad():
+                    encodings = model.encoder(batch, features_batch)
+                    output = model(batch, features_batch)
+                    expected = reference_forward(model, batch, features_batch)
+
+                self.assertEqual(tuple(encodings.shape), (num_mixtures, 2 * model.hidden_size + 2))
+                self.assertEqual(tuple(output.shape), (num_mixtures, 1))
+                torch.testing.assert_close(output, expected)
+
+    def test_symmetric(self):
+        # With a shared encoder, swapping the molecules and the mole fractions does not change the prediction
+        model = build_model(1, '--mpn_shared')
+        features_batch = [np.array([0.2 * i, 300.0]) for i in range(len(SMILES))]
+        swapped_batch = [[smi2, smi1] for smi1, smi2 in SMILES]
+        swapped_features_batch = [np.array([1 - molfrac1, T]) for molfrac1, T in features_batch]
+        with torch.no_grad():
+            output = model(SMILES, features_batch)
+            swapped_output = model(swapped_batch, swapped_features_batch)
+        torch.testing.assert_close(output, swapped_output)
+
+    def test_graph_batch(self):
+        # Batches of SMILES and of molecular graphs give the same predictions
+        model = build_model(2)
+        features_batch = [np.array([0.5, 310.0])] * len(SMILES)
+        graphs = [mol2graph([smiles[i] for smiles in SMILES]) for i in range(2)]
+        with torch.no_grad():
+            torch.testing.assert_close(model(graphs, features_batch), model(SMILES, features_batch))
+
+    def test_mpn_shared(self):
+        model = build_model(0, '--mpn_shared')
+        self.assertIs(model.encoder.encoder[0], model.encoder.encoder[1])
+        self.assertEqual(model.ffn[1].in_features, 2 * build_args().hidden_size + 1)
+        features_batch = [np.array([0.4, 300.0])] * len(SMILES)
+        with torch.no_grad():
+            torch.testing.assert_close(model(SMILES, features_batch), reference_forward(model, SMILES, features_batch))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+"""Tests for the message passing encoder."""
+
+from itertools import product
+import unittest
+from unittest import mock
+
+import numpy as np
+import torch
+
+from mixprop.args import TrainArgs
+from mixprop.data import ColumnarMoleculeDataset, MoleculeDataLoader, MoleculeDatapoint, MoleculeDataset, \
+    set_cache_graph
+from mixprop.data.data import empty_cache
+from mixprop.features import get_atom_fdim, get_bond_fdim, mol2graph
+from mixprop.models.mpn import MPNEncoder
+from tests.checkpoints import build_model
+
+
+SMILES = ['CCO', 'O', '[Na+].[Cl-]', 'c1ccccc1C(=O)O', '[H][H]', 'C1CC2CCC1C2', 'CC(C)(C)N']
+
+
+def build_encoder(atom_messages: bool, undirected: bool, bias: bool, aggregation: str) -> MPNEncoder:
+    torch.manual_seed(0)
+    args = TrainArgs().parse_args(['--data_path', 'unused.csv', '--dataset_type', 'regression',
+                                   '--hidden_size', '16', '--depth', '4', '--aggregation', aggregation]
+                                  + ['--atom_messages'] * atom_messages
+                                  + ['--undirected'] * undirected
+                                  + ['--bias'] * bias)
+    encoder = MPNEncoder(args, get_atom_fdim(), get_bond_fdim(atom_messages=atom_messages))
+    encoder.eval()
+
+    return encoder
+
+
+class TestMPNEncoder(unittest.TestCase):
+    """Tests for :class:`~mixprop.models.mpn.MPNEncoder`."""
+
+    def test_scatter_message_passing(self):
+        batch = mol2graph(SMILES)
+        for atom_messages, undirected, bias, aggregation in product([False, True], [False, True], [False, True],
+                                                                    ['mean', 'sum', 'norm']):
+            # Atom messages are undirected by construction, so the arguments do not allow both
+            if atom_messages and undirected:
+                continue
+
+            with self.subTest(atom_messages=atom_messages, undirected=undirected, bias=bias, aggregation=aggregation):
+                encoder = build_encoder(atom_messages, undirected, bias, aggregation)
+
+                encoder.scatter_message_passing = False
+                expected = encoder(batch)
+                expected.sum().backward()
+                expected_grads = [param.grad.clone() for param in encoder.parameters() if param.requires_grad]
+
+                encoder.zero_grad()
+                encoder.scatter_message_passing = True
+                encodings = encoder(batch)
+                encodings.sum().backward()
+                grads = [param.grad for param in encoder.parameters() if param.requires_grad]
+
+                torch.testing.assert_close(encodings, expected, rtol=1e-5, atol=1e-5)
+                for grad, expected_grad in zip(grads, expected_grads):
+                    torch.testing.assert_close(grad, expected_grad, rtol=1e-4, atol=1e-4)
+
+
+# Most molecules appear in both columns
+ROWS = [('CCO', 'O'), ('O', 'CCO'), ('c1ccccc1', 'CCO'), ('CCO', 'CCO'), ('O', 'CC(=O)O'), ('CCN', 'c1ccccc1')]
+
+
+class TestSharedGraphs(unittest.TestCase):
+    """Tests that batches whose molecule columns share their graphs give the same encodings as separate columns."""
+
+    def setUp(self):
+        empty_cache()
+        set_cache_graph(False)
+        self.features = np.array([[0.1 * i, 300.0 + i] for i in range(len(ROWS))])
+
+    def tearDown(self):
+        set_cache_graph(True)
+        empty_cache()
+
+    def datasets(self) -> list:
+        return [MoleculeDataset([MoleculeDatapoint(smiles=list(row), features=features)
+                                 for row, features in zip(ROWS, self.features)]),
+                ColumnarMoleculeDataset.from_lists([list(row) for row in ROWS], [[None]] * len(ROWS),
+                                                   features=self.features)]
+
+    def assert_same_outputs(self, model, shared_graphs: list, graphs: list):
+        model.zero_grad()
+        output = model(shared_graphs, self.features)
+        output.sum().backward()
+        grads = [param.grad.clone() for param in model.parameters() if param.grad is not None]
+
+        model.zero_grad()
+        expected = model(graphs, self.features)
+        expected.sum().backward()
+        expected_grads = [param.grad for param in model.parameters() if param.grad is not None]
+
+        torch.testing.assert_close(output, expected, rtol=1e-5, atol=1e-5)
+        self.assertEqual(len(grads), len(expected_grads))
+        for grad, expected_grad in zip(grads, expected_grads):
+            torch.testing.assert_close(grad, expected_grad, rtol=1e-4, atol=1e-4)
+
+    def test_batch_graph(self):
+        for dataset, other_dataset in zip(self.datasets(), self.datasets()):
+            with self.subTest(dataset=type(dataset).__name__):
+                shared_graphs, graphs = dataset.batch_graph(shared_graphs=True), other_dataset.batch_graph()
+
+                # The unique molecules of both columns are featurized once
+                self.assertTrue(shared_graphs[1].shares_graphs(shared_graphs[0]))
+                self.assertEqual(len(shared_graphs[0].a_scope), 5)
+                self.assertEqual([len(graph.a_scope) for graph in graphs], [4, 4])
+                self.assertEqual([len(graph.mol_index) for graph in shared_graphs], [len(ROWS)] * 2)
+
+                for args in [['--mpn_shared'], ['--mpn_shared', '--scatter_message_passing'], []]:
+                    with self.subTest(args=args):
+                        self.assert_same_outputs(build_model(0, *args), shared_graphs, graphs)
+
+    def test_encoded_once(self):
+        model = build_model(0, '--mpn_shared')
+        encoder = model.encoder.encoder[0]
+        shared_graphs = self.datasets()[0].batch_graph(shared_graphs=True)
+        with mock.patch.object(encoder, 'forward', wraps=encoder.forward) as forward:
+            with torch.no_grad():
+                model(shared_graphs, self.features)
+        self.assertEqual(forward.call_count, 1)
+
+    def test_data_loader(self):
+        model = build_model(0, '--mpn_shared')
+        for dataset in self.datasets():
+            with self.subTest(dataset=type(dataset).__name__):
+                loaders = [MoleculeDataLoader(dataset, batch_size=4, num_workers=0, shared_graphs=shared_graphs)
+                           for shared_graphs in [True, False]]
+                for batch, other_batch in zip(*loaders):
+                    shared_graphs = batch.batch_graph()
+                    self.assertTrue(shared_graphs[1].shares_graphs(shared_graphs[0]))
+                    with torch.no_grad():
+                        torch.testing.assert_close(model(shared_graphs, batch.features()),
+                                                   model(other_batch.batch_graph(), other_batch.features()))
+
+
+if __name__ == '__main__':
+    unittest.main()
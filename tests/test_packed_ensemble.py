@@ -0,0 +1,113 @@
+"""Tests for packing ensembles into a single file."""
+
+import json
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import torch
+
+from mixprop.data import StandardScaler
+from mixprop.utils import (is_packed_ensemble, load_args, load_checkpoint, load_packed_ensemble, load_scalers,
+                           PACKED_ENSEMBLE_MAGIC, save_checkpoint, save_packed_ensemble)
+from mixprop.visc_pred_wrapper import clear_model_registry, visc_pred_single
+from tests.checkpoints import build_args, build_model
+
+
+SMILES = [['CCO', 'O'], ['c1ccccc1', 'CC(=O)C'], ['CCCCO', 'O'], ['CC(C)O', 'CCN']]
+
+
+class TestPackedEnsemble(unittest.TestCase):
+    """Tests for :func:`~mixprop.utils.save_packed_ensemble` and :func:`~mixprop.utils.load_packed_ensemble`."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.checkpoint_dir = os.path.join(self.tmp_dir.name, 'checkpoints')
+        self.checkpoint_paths = []
+        for model_idx in range(3):
+            path = os.path.join(self.checkpoint_dir, f'model_{model_idx}', 'model.pt')
+            os.makedirs(os.path.dirname(path))
+            scaler = StandardScaler(means=np.array([0.5 + model_idx]), stds=np.array([0.25]))
+            features_scaler = StandardScaler(means=np.array([0.5, 300.0]), stds=np.array([0.3, 10.0 + model_idx]))
+            save_checkpoint(path, build_model(model_idx), scaler=scaler, features_scaler=features_scaler,
+                            args=build_args())
+            self.checkpoint_paths.append(path)
+        self.path = os.path.join(self.tmp_dir.name, 'ensemble.mixprop')
+
+    def tearDown(self):
+        clear_model_registry()
+        self.tmp_dir.cleanup()
+
+    def test_round_trip(self):
+        save_packed_ensemble(self.checkpoint_paths, self.path)
+        self.assertTrue(is_packed_ensemble(self.path))
+        self.assertFalse(is_packed_ensemble(self.checkpoint_paths[0]))
+
+        args, models, scalers = load_packed_ensemble(self.path)
+        expected_args = load_args(self.checkpoint_paths[0])
+        self.assertEqual(args.hidden_size, expected_args.hidden_size)
+        self.assertEqual(args.task_names, expected_args.task_names)
+        self.assertEqual(args.device, torch.device('cpu'))
+        self.assertEqual(len(models), 3)
+
+        features_batch = [np.array([0.2 * i, 300.0 + i]) for i in range(len(SMILES))]
+        for checkpoint_path, model, model_scalers in zip(self.checkpoint_paths, models, scalers):
+            expected_model = load_checkpoint(checkpoint_path)
+            for (name, tensor), (expected_name, expected_tensor) in zip(model.state_dict().items(),
+                                                                        expected_model.state_dict().items()):
+                self.assertEqual(name, expected_name)
+                torch.testing.assert_close(tensor, expected_tensor)
+
+            model.eval()
+            expected_model.eval()
+            with torch.no_grad():
+                torch.testing.assert_close(model(SMILES, features_batch), expected_model(SMILES, features_batch))
+
+            for scaler, expected_scaler in zip(model_scalers, load_scalers(checkpoint_path)):
+                if expected_scaler is None:
+                    self.assertIsNone(scaler)
+                else:
+                    np.testing.assert_array_equal(scaler.means, expected_scaler.means)
+                    np.testing.assert_array_equal(scaler.stds, expected_scaler.stds)
+                    self.assertEqual(scaler.replace_nan_token, expected_scaler.replace_nan_token)
+
+    def test_predictions(self):
+        save_packed_ensemble(self.checkpoint_paths, self.path)
+        for smi1, smi2 in SMILES:
+            args = {'smi1': smi1, 'smi2': smi2, 'molfrac1': 0.4, 'T': 305.0, 'n_models': None, 'threshold': 0.1}
+            pred, rel = visc_pred_single(dict(args, checkpoint_dir=self.path))
+            expected_pred, expected_rel = visc_pred_single(dict(args, checkpoint_dir=self.checkpoint_dir))
+            np.testing.assert_allclose(pred, expected_pred, rtol=1e-6)
+            self.assertEqual(rel, expected_rel)
+
+    def test_json_header(self):
+        # The header holds no pickled objects
+        save_packed_ensemble(self.checkpoint_paths, self.path)
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(len(PACKED_ENSEMBLE_MAGIC)), PACKED_ENSEMBLE_MAGIC)
+            header = json.loads(f.read(int.from_bytes(f.read(8), 'little')))
+        self.assertEqual(len(header['index']), 3)
+        self.assertEqual(header['scalers'][1]['data_scaler'], {'means': [1.5], 'stds': [0.25]})
+
+    def test_invalid_files(self):
+        with self.assertRaisesRegex(ValueError, 'is not a packed mixprop ensemble'):
+            load_packed_ensemble(self.checkpoint_paths[0])
+
+        # Ensembles packed with a pickled header are not loaded
+        with open(self.path, 'wb') as f:
+            f.write(PACKED_ENSEMBLE_MAGIC[:-1] + b'1' + bytes(8))
+        self.assertTrue(is_packed_ensemble(self.path))
+        with self.assertRaisesRegex(ValueError, 'older version'):
+            load_packed_ensemble(self.path)
+
+    def test_different_architectures(self):
+        path = os.path.join(self.tmp_dir.name, 'other', 'model.pt')
+        os.makedirs(os.path.dirname(path))
+        save_checkpoint(path, build_model(0, '--hidden_size', '16'), args=build_args('--hidden_size', '16'))
+        with self.assertRaises(ValueError):
+            save_packed_ensemble(self.checkpoint_paths + [path], self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
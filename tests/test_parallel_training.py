@@ -0,0 +1,113 @@
+"""Tests for training ensemble members in parallel."""
+
+from multiprocessing import get_all_start_methods, get_context
+import os
+import sys
+from types import SimpleNamespace
+import unittest
+from unittest import mock
+
+from mixprop.data import MoleculeDataLoader, MoleculeDatapoint, MoleculeDataset
+from mixprop.train.cross_validate import run_folds_in_parallel
+from mixprop.train.run_training import train_ensemble_members_in_parallel
+
+# The package exports the cross_validate and run_training functions under the names of their modules
+cross_validate = sys.modules['mixprop.train.cross_validate']
+run_training = sys.modules['mixprop.train.run_training']
+
+
+SMILES = ['C', 'CC', 'CCC', 'CCCC', 'CCO', 'CCN', 'O', 'N', 'c1ccccc1', 'CC(=O)O', 'CCCCCC', 'C=O']
+
+
+def batch_order(model_idx: int, args, train_data_loader: MoleculeDataLoader, *_) -> list:
+    """Stands in for :func:`train_ensemble_member` and returns the batches seen in each epoch."""
+    return [[batch.smiles() for batch in train_data_loader] for _ in range(args.epochs)]
+
+
+def build_loader(**kwargs) -> MoleculeDataLoader:
+    data = MoleculeDataset([MoleculeDatapoint(smiles=[smiles, 'O'], targets=[i % 2])
+                            for i, smiles in enumerate(SMILES)])
+
+    return MoleculeDataLoader(data, batch_size=4, num_workers=0, shuffle=True, seed=7, **kwargs)
+
+
+@unittest.skipUnless('fork' in get_all_start_methods(), 'parallel training requires the fork start method')
+class TestTrainEnsembleMembersInParallel(unittest.TestCase):
+    """Tests for :func:`~mixprop.train.run_training.train_ensemble_members_in_parallel`."""
+
+    def assert_sequential_batch_order(self, ensemble_size: int, num_workers: int, **loader_kwargs):
+        args = SimpleNamespace(pytorch_seed=0, epochs=2)
+
+        # Sequential training shuffles the same loader once per epoch of each model in turn
+        train_data_loader = build_loader(**loader_kwargs)
+        expected = [batch_order(model_idx, args, train_data_loader) for model_idx in range(ensemble_size)]
+
+        with mock.patch.object(run_training, 'train_ensemble_member', batch_order):
+            member_batches = train_ensemble_members_in_parallel((args, build_loader(**loader_kwargs)),
+                                                                ensemble_size, num_workers)
+
+        self.assertEqual(member_batches, expected)
+        self.assertEqual(len(set(str(batches) for batches in member_batches)), ensemble_size)
+
+    def test_batch_order(self):
+        self.assert_sequential_batch_order(ensemble_size=3, num_workers=2)
+        self.assert_sequential_batch_order(ensemble_size=4, num_workers=1)
+
+    def test_batch_order_bucket_by_size(self):
+        self.assert_sequential_batch_order(ensemble_size=3, num_workers=2, bucket_by_size=True)
+
+    def test_batch_order_class_balance(self):
+        self.assert_sequential_batch_order(ensemble_size=3, num_workers=2, class_balance=True)
+
+
+WORKER_CPUS = None
+# Receives the process and the CPUs of each worker as it starts
+STARTED_WORKERS = None
+
+
+def record_cpus(pid: int, cpus: list) -> None:
+    """Stands in for :func:`os.sched_setaffinity` and records the CPUs of the worker."""
+    global WORKER_CPUS
+    WORKER_CPUS = list(cpus)
+    STARTED_WORKERS.put((os.getpid(), WORKER_CPUS))
+
+
+def worker_cpus(fold_num: int, *_) -> tuple:
+    """Stands in for :func:`run_fold` and returns the worker process and its CPUs."""
+    return os.getpid(), WORKER_CPUS
+
+
+@unittest.skipUnless('fork' in get_all_start_methods() and hasattr(os, 'sched_setaffinity'),
+                     'parallel folds require the fork start method and CPU affinity')
+class TestRunFoldsInParallel(unittest.TestCase):
+    """Tests for :func:`~mixprop.train.cross_validate.run_folds_in_parallel`."""
+
+    def setUp(self):
+        global STARTED_WORKERS
+        STARTED_WORKERS = get_context('fork').SimpleQueue()
+
+    def assert_cpu_groups(self, available_cpus: set, num_workers: int, expected_groups: list):
+        with mock.patch.object(os, 'sched_getaffinity', return_value=available_cpus), \
+                mock.patch.object(os, 'sched_setaffinity', record_cpus), \
+                mock.patch.object(cross_validate, 'run_fold', worker_cpus):
+            results = run_folds_in_parallel((), num_folds=6, num_workers=num_workers)
+
+        # Every worker takes its own group as it starts, whichever folds it runs
+        workers = dict(STARTED_WORKERS.get() for _ in range(len(expected_groups)))
+        self.assertTrue(STARTED_WORKERS.empty())
+        self.assertEqual(len(workers), len(expected_groups))
+        self.assertEqual(sorted(workers.values()), expected_groups)
+
+        self.assertEqual(len(results), 6)
+        for pid, cpus in results:
+            self.assertEqual(cpus, workers[pid])
+
+    def test_cpu_groups(self):
+        self.assert_cpu_groups({0, 1, 2, 3, 4, 5}, num_workers=3, expected_groups=[[0, 1], [2, 3], [4, 5]])
+        self.assert_cpu_groups({0, 1, 2, 3, 4}, num_workers=2, expected_groups=[[0, 1], [2, 3, 4]])
+
+    def test_fewer_cpus_than_workers(self):
+        self.assert_cpu_groups({3}, num_workers=2, expected_groups=[[3], [3]])
+
+if __name__ == '__main__':
+    unittest.main()
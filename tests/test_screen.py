@@ -0,0 +1,64 @@
+"""Tests for screening all mixtures of two libraries of molecules."""
+
+import unittest
+
+import numpy as np
+import torch
+
+from mixprop.args import TrainArgs
+from mixprop.models import MoleculeModel
+from mixprop.train.screen import screen_pairs
+
+
+def build_model() -> MoleculeModel:
+    torch.manual_seed(0)
+    args = TrainArgs().parse_args(['--data_path', 'unused.csv', '--features_path', 'unused_features.csv',
+                                   '--dataset_type', 'regression',
+                                   '--number_of_molecules', '2', '--hidden_size', '8', '--depth', '2',
+                                   '--ffn_num_layers', '3'])
+    args.task_names = ['viscosity']
+    args.features_size = 2
+    model = MoleculeModel(args)
+    model.eval()
+
+    return model
+
+
+class TestScreenPairs(unittest.TestCase):
+    """Tests for :meth:`~mixprop.train.screen.screen_pairs`."""
+
+    def setUp(self):
+        self.models = [build_model()]
+        self.molfrac1_values = [0.25, 0.75]
+        self.T_values = [298.0, 320.0, 350.0]
+
+    def screen(self, smiles_1, smiles_2, **kwargs) -> np.ndarray:
+        return screen_pairs(self.models, [None], [None], smiles_1, smiles_2, self.molfrac1_values, self.T_values,
+                            disable_progress_bar=True, **kwargs)
+
+    def test_matches_model(self):
+        smiles_1, smiles_2 = ['CCO', 'invalid', 'CC(=O)O'], ['O', 'c1ccccc1']
+        results = self.screen(smiles_1, smiles_2, tile_size=7)
+        self.assertEqual(results.shape, (3, 2, 2, 3, 2))
+        self.assertTrue(np.isnan(results[1]).all())
+
+        for i in [0, 2]:
+            for j in range(len(smiles_2)):
+                features = [np.array([molfrac1, T]) for molfrac1 in self.molfrac1_values for T in self.T_values]
+                with torch.no_grad():
+                    preds = self.models[0]([[smiles_1[i], smiles_2[j]]] * len(features), features)
+                np.testing.assert_allclose(results[i, j, :, :, 0].ravel(), preds[:, 0].numpy(), rtol=1e-5, atol=1e-5)
+                np.testing.assert_array_equal(results[i, j, :, :, 1], 0)
+
+    def test_no_valid_smiles(self):
+        for smiles_1, smiles_2 in [(['CCO', 'O'], ['invalid']),
+                                   (['invalid', 'invalid'], ['CCO']),
+                                   (['CCO'], []),
+                                   ([], [])]:
+            results = self.screen(smiles_1, smiles_2)
+            self.assertEqual(results.shape, (len(smiles_1), len(smiles_2), 2, 3, 2))
+            self.assertTrue(np.isnan(results).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,303 @@
+"""Tests for the viscosity prediction wrapper."""
+
+from concurrent.futures import ThreadPoolExecutor
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from mixprop import visc_pred_wrapper
+from mixprop.data import MoleculeDataLoader, MoleculeDatapoint, MoleculeDataset
+from mixprop.visc_pred_wrapper import (MODEL_REGISTRY, clear_model_registry, get_registered_model, load_model,
+                                       set_model_registry_budget, visc_pred_grid, visc_pred_molfrac1_curve,
+                                       visc_pred_read_csv, visc_pred_single, visc_pred_stream_csv, visc_pred_T_curve)
+from tests.checkpoints import save_ensemble
+
+
+class WrapperTestCase(unittest.TestCase):
+    """Saves a small ensemble and builds the prediction arguments of a mixture."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        save_ensemble(cls.tmp_dir.name)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def tearDown(self):
+        clear_model_registry()
+
+    def build_args(self, **kwargs) -> dict:
+        args = {'smi1': 'CCO', 'smi2': 'O', 'molfrac1': 0.3, 'T': 300.0, 'n_models': None, 'threshold': 0.1,
+                'checkpoint_dir': self.tmp_dir.name}
+        args.update(kwargs)
+
+        return args
+
+    def assert_single_point_predictions(self, preds: list, rels: list, points: list, **kwargs):
+        """Asserts that predictions at (molfrac1, T) points equal those of :func:`visc_pred_single`."""
+        self.assertEqual(len(preds), len(points))
+        for pred, rel, (molfrac1, T) in zip(preds, rels, points):
+            expected_pred, expected_rel = visc_pred_single(self.build_args(molfrac1=molfrac1, T=T, **kwargs))
+            np.testing.assert_allclose(pred, expected_pred, rtol=1e-5)
+            self.assertEqual(rel, expected_rel)
+
+
+class TestGridPredictions(WrapperTestCase):
+    """Tests that grid predictions equal single point predictions."""
+
+    def test_T_curve(self):
+        for n_models in [None, 2]:
+            with self.subTest(n_models=n_models):
+                preds, T_vals, rels = visc_pred_T_curve(self.build_args(n_models=n_models))
+                self.assertEqual(T_vals.tolist(), [293, 298, 303, 308, 313, 318, 323])
+                self.assert_single_point_predictions(preds, rels, [(0.3, float(T)) for T in T_vals],
+                                                     n_models=n_models)
+
+    def test_molfrac1_curve(self):
+        preds, molfrac1_vals, rels = visc_pred_molfrac1_curve(self.build_args())
+        self.assertEqual(len(molfrac1_vals), 11)
+        self.assert_single_point_predictions(preds, rels, [(float(molfrac1), 300.0) for molfrac1 in molfrac1_vals])
+
+    def test_grid(self):
+        args = self.build_args(smi1='c1ccccc1', smi2='CC(=O)C')
+        model = load_model(args)
+        molfrac1_vals, T_vals = np.array([0.0, 0.25, 0.5, 1.0]), np.array([350.0, 300.0, 320.0, 293.0])
+
+        preds, rels = visc_pred_grid(model, args, molfrac1_vals, T_vals)
+        points = [(float(molfrac1), float(T)) for molfrac1, T in zip(molfrac1_vals, T_vals)]
+        self.assert_single_point_predictions(preds, rels, points, smi1='c1ccccc1', smi2='CC(=O)C')
+
+        # Each member predicts every point of the grid as it would predict the point alone
+        members = model.grid_members(3, 'c1ccccc1', 'CC(=O)C', molfrac1_vals, T_vals).astype(float)
+        self.assertEqual(members.shape, (3, 4))
+        np.testing.assert_allclose(10 ** members.mean(axis=0), np.array(preds, dtype=float), rtol=1e-6)
+        for i, (molfrac1, T) in enumerate(zip(molfrac1_vals, T_vals)):
+            point_members = model.grid_members(3, 'c1ccccc1', 'CC(=O)C', [molfrac1], [T])
+            np.testing.assert_allclose(point_members[:, 0].astype(float), members[:, i], rtol=1e-5)
+
+
+class TestModelRegistry(WrapperTestCase):
+    """Tests for the process-wide registry of loaded ensembles."""
+
+    def tearDown(self):
+        set_model_registry_budget(None)
+        super().tearDown()
+
+    def test_keyed_by_checkpoint_files(self):
+        model = load_model(self.build_args())
+        self.assertIs(load_model(self.build_args()), model)
+
+        # Retrained checkpoints are reloaded and the stale ensemble is dropped
+        checkpoint_path = os.path.join(self.tmp_dir.name, 'model_0', 'model.pt')
+        stat = os.stat(checkpoint_path)
+        os.utime(checkpoint_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+        reloaded = load_model(self.build_args())
+        self.assertIsNot(reloaded, model)
+        self.assertEqual(list(MODEL_REGISTRY.values()), [reloaded])
+
+    def test_embedding_cache(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            model = load_model(self.build_args())
+            cached_model = load_model(self.build_args(embedding_cache=True))
+            stored_model = load_model(self.build_args(embedding_cache_dir=cache_dir))
+            self.assertEqual(len({id(model), id(cached_model), id(stored_model)}), 3)
+
+            # Each call gets the ensemble registered for its cache, which later calls do not change
+            self.assertIs(load_model(self.build_args()), model)
+            self.assertIsNone(model.embedding_cache)
+            self.assertIsNone(cached_model.embedding_cache.cache_dir)
+            self.assertEqual(stored_model.embedding_cache.cache_dir, os.path.abspath(cache_dir))
+            for checkpoint in model.checkpoints:
+                self.assertIsNone(checkpoint.encoder.embedding_cache)
+
+    def test_concurrent_calls(self):
+        expected = [visc_pred_single(self.build_args(T=T)) for T in [295.0, 305.0, 315.0]]
+        clear_model_registry()
+
+        # Calls with and without the embedding cache predict at the same time from the same checkpoints
+        barrier = threading.Barrier(6)
+
+        def predict(i):
+            barrier.wait()
+            return visc_pred_single(self.build_args(T=[295.0, 305.0, 315.0][i % 3], embedding_cache=i % 2 == 0))
+
+        for _ in range(3):
+            with ThreadPoolExecutor(max_workers=6) as executor:
+                preds = list(executor.map(predict, range(6)))
+            for i, (pred, rel) in enumerate(preds):
+                self.assertAlmostEqual(pred, expected[i % 3][0], places=5)
+                self.assertEqual(rel, expected[i % 3][1])
+        self.assertEqual(len(MODEL_REGISTRY), 2)
+
+    def test_concurrent_loads(self):
+        # Every caller gets the registered ensemble, even when several callers load the checkpoints at once
+        barrier = threading.Barrier(4)
+
+        def load(_):
+            barrier.wait()
+            return get_registered_model(self.tmp_dir.name)
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            models = list(executor.map(load, range(4)))
+        self.assertEqual(len(MODEL_REGISTRY), 1)
+        for model in models:
+            self.assertIs(model, models[0])
+
+    def test_loads_outside_lock(self):
+        # Checkpoints are loaded without the registry lock held
+        locked = []
+        mixprop_model = visc_pred_wrapper.mixprop_model
+
+        def load(checkpoint_dir):
+            locked.append(visc_pred_wrapper.MODEL_REGISTRY_LOCK.locked())
+            return mixprop_model(checkpoint_dir)
+
+        with mock.patch.object(visc_pred_wrapper, 'mixprop_model', load):
+            get_registered_model(self.tmp_dir.name)
+        self.assertEqual(locked, [False])
+
+    def test_budget(self):
+        with tempfile.TemporaryDirectory() as other_dir:
+            save_ensemble(other_dir, 2)
+            model = load_model(self.build_args())
+            set_model_registry_budget(model.nbytes)
+
+            # The least recently used ensemble is evicted to fit in the budget
+            other_model = get_registered_model(other_dir)
+            self.assertEqual(list(MODEL_REGISTRY.values()), [other_model])
+            self.assertIsNot(load_model(self.build_args()), model)
+
+            # The newest ensemble is kept even if it does not fit in the budget
+            set_model_registry_budget(1)
+            self.assertEqual(len(MODEL_REGISTRY), 1)
+
+            set_model_registry_budget(None)
+            model = load_model(self.build_args())
+            self.assertIs(get_registered_model(other_dir), get_registered_model(other_dir))
+            self.assertEqual(len(MODEL_REGISTRY), 2)
+
+            # Using an ensemble makes it the most recently used one, so the other one is evicted
+            self.assertIs(load_model(self.build_args()), model)
+            set_model_registry_budget(model.nbytes)
+            self.assertEqual(list(MODEL_REGISTRY.values()), [model])
+
+
+class TestStreamCsv(WrapperTestCase):
+    """Tests for :func:`~mixprop.visc_pred_wrapper.visc_pred_stream_csv`."""
+
+    ROWS = [('CCO', 'O', 0.3, 300.0), ('c1ccccc1', 'CC(=O)C', 0.5, 310.0), ('not a smiles', 'O', 0.5, 300.0),
+            ('CCO', 'O', 1.5, 300.0), ('CCCCO', 'O', 0.8, 320.0), ('CCO', 'C1CC', 0.2, 300.0),
+            ('CC(C)O', 'CCN', 0.0, 295.0), ('O', 'CCO', 'warm', 300.0)]
+
+    def setUp(self):
+        self.data_dir = tempfile.TemporaryDirectory()
+        self.input_path = os.path.join(self.data_dir.name, 'input.csv')
+        self.output_path = os.path.join(self.data_dir.name, 'output.csv')
+
+    def tearDown(self):
+        self.data_dir.cleanup()
+        super().tearDown()
+
+    def write_input(self, rows: list):
+        pd.DataFrame(rows, columns=['smi1', 'smi2', 'molfrac1', 'T']).to_csv(self.input_path, index=False)
+
+    def test_stream(self):
+        self.write_input(self.ROWS)
+        for chunk_size in [1, 3, 100]:
+            with self.subTest(chunk_size=chunk_size):
+                args = self.build_args(input_path=self.input_path, output_path=self.output_path,
+                                       chunk_size=chunk_size)
+                self.assertEqual(visc_pred_stream_csv(args), len(self.ROWS))
+
+                output = pd.read_csv(self.output_path)
+                self.assertEqual(list(output.columns), ['smi1', 'smi2', 'molfrac1', 'T', 'Viscoisty Predictions',
+                                                        'Reliability'])
+                self.assertEqual(len(output), len(self.ROWS))
+
+                # Invalid SMILES, mole fractions and temperatures give missing predictions
+                for (smi1, smi2, molfrac1, T), pred, rel in zip(self.ROWS, output['Viscoisty Predictions'],
+                                                                output['Reliability']):
+                    if smi1 == 'not a smiles' or smi2 == 'C1CC' or molfrac1 in [1.5, 'warm']:
+                        self.assertTrue(np.isnan(pred))
+                        self.assertFalse(rel)
+                    else:
+                        expected_pred, expected_rel = visc_pred_single(self.build_args(smi1=smi1, smi2=smi2,
+                                                                                       molfrac1=molfrac1, T=T))
+                        np.testing.assert_allclose(pred, expected_pred, rtol=1e-5)
+                        self.assertEqual(rel, expected_rel)
+
+    def test_read_csv(self):
+        valid_rows = [row for row in self.ROWS if row[0] != 'not a smiles' and row[1] != 'C1CC'
+                      and row[2] not in [1.5, 'warm']]
+        self.write_input(valid_rows)
+        preds, rels, data = visc_pred_read_csv(self.build_args(input_path=self.input_path))
+
+        visc_pred_stream_csv(self.build_args(input_path=self.input_path, output_path=self.output_path))
+        output = pd.read_csv(self.output_path)
+        np.testing.assert_allclose(output['Viscoisty Predictions'], preds, rtol=1e-6)
+        self.assertEqual(output['Reliability'].tolist(), rels)
+        self.assertEqual(output['smi1'].tolist(), data['smi1'].tolist())
+
+    def test_header_only(self):
+        self.write_input([])
+        args = self.build_args(input_path=self.input_path, output_path=self.output_path)
+        self.assertEqual(visc_pred_stream_csv(args), 0)
+
+        output = pd.read_csv(self.output_path)
+        self.assertEqual(len(output), 0)
+        self.assertEqual(list(output.columns), ['smi1', 'smi2', 'molfrac1', 'T', 'Viscoisty Predictions',
+                                                'Reliability'])
+
+
+class TestDataLoader(WrapperTestCase):
+    """Tests for the batches built by :meth:`~mixprop.visc_pred_wrapper.mixprop_model.data_loader`."""
+
+    ROWS = [('CCO', 'O', 0.3, 300.0), ('c1ccccc1', 'CC(=O)C', 0.5, 310.0), ('CCCCO', 'O', 0.8, 320.0),
+            ('CC(C)O', 'CCN', 0.0, 295.0), ('O', 'CCO', 0.6, 305.0), ('CCN', 'O', 1.0, 315.0), ('C', 'O', 0.1, 300.0)]
+
+    def setUp(self):
+        self.model = load_model(self.build_args())
+        self.dataset = MoleculeDataset([MoleculeDatapoint(smiles=[smi1, smi2], features=np.array([molfrac1, T]))
+                                        for smi1, smi2, molfrac1, T in self.ROWS])
+
+    def test_slices(self):
+        # Small inputs and inputs without workers are split into slices of the dataset
+        for num_workers, worker_threshold in [(2, 2000), (0, 0)]:
+            args = self.build_args(batch_size=3, num_workers=num_workers, worker_threshold=worker_threshold)
+            loader = self.model.data_loader(args, self.dataset)
+            self.assertIsInstance(loader, list)
+            self.assertEqual([len(batch) for batch in loader], [3, 3, 1])
+            self.assertEqual([smiles for batch in loader for smiles in batch.smiles()], self.dataset.smiles())
+            for batch in loader:
+                self.assertIsInstance(batch, MoleculeDataset)
+
+        loader = self.model.data_loader(self.build_args(batch_size=3, num_workers=2, worker_threshold=0),
+                                        self.dataset)
+        self.assertIsInstance(loader, MoleculeDataLoader)
+
+    def test_predictions(self):
+        # Predictions from the slices equal those of a data loader over the same dataset
+        args = self.build_args(batch_size=3)
+        self.model.set_n_models(args)
+        slices = self.model.data_loader(args, self.dataset)
+        loader = MoleculeDataLoader(dataset=self.dataset, batch_size=3, num_workers=0)
+        np.testing.assert_allclose(self.model.predict_members(args, slices).astype(float),
+                                   self.model.predict_members(args, loader).astype(float), rtol=1e-6)
+
+        smi1_vals, smi2_vals, molfrac1_vals, T_vals = (list(column) for column in zip(*self.ROWS))
+        preds, rels = self.model.predict_batch(args, smi1_vals, smi2_vals, molfrac1_vals, T_vals)
+        worker_args = self.build_args(batch_size=3, num_workers=2, worker_threshold=0)
+        worker_preds, worker_rels = self.model.predict_batch(worker_args, smi1_vals, smi2_vals, molfrac1_vals, T_vals)
+        np.testing.assert_allclose(worker_preds.astype(float), preds.astype(float), rtol=1e-6)
+        self.assertEqual(worker_rels.tolist(), rels.tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()